@@ -2,6 +2,9 @@
 ASGI config for afyalink_config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve through this (e.g. ``uvicorn afyalink_config.asgi:application``) so the
+live event stream at /api/events/ can hold connections open without tying up
+a worker thread each.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,13 +9,22 @@ DEBUG = False
 # This tells Django which website address is allowed to host this app.
 ALLOWED_HOSTS = ['jrjunior.pythonanywhere.com']
 
+# settings.py derives this from DEBUG before it is switched off above, so it
+# is set again here: request timings are not for clients in production.
+REQUEST_METRICS_SERVER_TIMING = False
+
 
 # --- Whitenoise Static File Configuration ---
 # This helps your live server handle static files correctly and efficiently.
 
 # This line adds the Whitenoise functionality into Django's request/response cycle.
-# It should be placed right after the SecurityMiddleware.
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+# It should be placed right after the SecurityMiddleware. settings.py already
+# lists it there, so this only adds it if that entry is ever removed.
+if 'whitenoise.middleware.WhiteNoiseMiddleware' not in MIDDLEWARE:
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+        'whitenoise.middleware.WhiteNoiseMiddleware',
+    )
 
 # This defines the single folder on the server where Django will collect all static files.
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
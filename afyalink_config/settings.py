@@ -1,6 +1,7 @@
 from pathlib import Path
 from dotenv import load_dotenv
 import os
+import sys
 import logging
 
 # --- Load environment variables ---
@@ -31,6 +32,8 @@ INSTALLED_APPS = [
 
 # MODIFIED: Middleware order is corrected
 MIDDLEWARE = [
+    # First, so that its wall time covers the rest of the stack.
+    'api.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware', # ADDED: For serving static files correctly.
@@ -77,6 +80,25 @@ DATABASES = {
     }
 }
 
+# --- Caches ---
+# 'default' is local to each worker process: fine for per-worker caches (menu
+# texts, lookups). Anything every worker must see goes through 'shared':
+# Redis when REDIS_URL is set, otherwise a database table that `migrate`
+# creates (migration api/0027; `manage.py createcachetable` does the same).
+REDIS_URL = os.getenv('REDIS_URL')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'afyalink_shared_cache',
+    },
+}
+
 # --- Password Validation ---
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -105,9 +127,41 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+    ],
+    # Token buckets for the public endpoints (api/throttling.py): 'count/period'
+    # is a burst of `count` refilled at that rate. None switches a scope off.
+    'DEFAULT_THROTTLE_RATES': {
+        'ussd_phone': '30/min',  # per subscriber; a session is several hops
+        'lookup': '30/min',  # username/email/approval checks, per client IP
+        'otp_ip': '10/min',
+        'otp_phone': '5/min',
+    },
+    # The number of proxies in front of the app (one on PythonAnywhere), so
+    # throttles key on the address the last proxy saw rather than on
+    # X-Forwarded-For entries the client can make up. Set NUM_PROXIES=0 when
+    # serving directly.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 1)),
 }
 
+# Throttle buckets live in the THROTTLE_CACHE_ALIAS cache. The local store is
+# exact but per worker; 'api.throttling.SharedCacheBucketStore' with a shared
+# cache (Redis, Memcached) applies one limit across all workers.
+THROTTLE_STORE = 'api.throttling.LocalMemoryBucketStore'
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Username/email availability checks (check-username/, check-email/) are
+# cached this many seconds; registrations clear their own entries.
+ACCOUNT_LOOKUP_CACHE_TIMEOUT = 30
+
+# Case list (cursor pagination); clients may ask for ?page_size= up to the max
+CASE_LIST_PAGE_SIZE = 50
+CASE_LIST_MAX_PAGE_SIZE = 200
+
+# Case change feed (cases/changes/)
+CASE_CHANGES_LIMIT = 500  # changes per poll; clients poll again while has_more
+CASE_CHANGES_SETTLE_DELAY = 2  # seconds; lets in-flight transactions commit before a change is handed out
+CASE_TOMBSTONE_RETENTION_DAYS = 7  # older tokens get 410 and must reload the list
+
 # --- CORRECTED CORS CONFIGURATION ---
 # REMOVED: CORS_ALLOW_ALL_ORIGINS = True, as it conflicts with the specific list.
 # This list explicitly tells your backend which frontend URLs are allowed to connect.
@@ -120,17 +174,141 @@ CORS_ALLOWED_ORIGINS = [
 
 ]
 
+# --- USSD ---
+# Session state between USSD hops. LocalMemorySessionStore is per-process; use
+# 'api.ussd_session.CacheSessionStore' with a shared cache when running several workers.
+USSD_SESSION_STORE = 'api.ussd_session.LocalMemorySessionStore'
+USSD_SESSION_TIMEOUT = 180  # seconds, a little over the gateway's session lifetime
+USSD_MENU_CACHE_TIMEOUT = 300  # seconds before a worker reloads its cached menu texts
+
+# --- M-Pesa (Daraja) ---
+DARAJA_BASE_URL = os.getenv('DARAJA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+# The OAuth token is shared through this cache, so it must be one every worker
+# can see (not the per-process 'default' LocMemCache).
+DARAJA_TOKEN_CACHE_ALIAS = 'shared'
+DARAJA_TOKEN_REFRESH_MARGIN = 300  # seconds before expiry that the token is renewed
+# STK pushes are sent by `python manage.py payment_worker`; one stuck in
+# 'sending' this long (seconds) is marked failed rather than pushed twice.
+PAYMENT_STALE_AFTER = 120
+# A callback can beat its own push result to the database. One whose
+# CheckoutRequestID matches no payment attempt yet is retried this many times,
+# first after DARAJA_CALLBACK_RETRY_BACKOFF seconds and doubling, then failed.
+DARAJA_CALLBACK_MAX_ATTEMPTS = 8
+DARAJA_CALLBACK_RETRY_BACKOFF = 15
+
+# --- Outbound HTTP (api/http_client.py) ---
+# (connect, read) timeouts in seconds, per '<client>.<endpoint>' or per client.
+OUTBOUND_HTTP_TIMEOUTS = {
+    'daraja.oauth': (3.05, 10),
+    'daraja.stk_push': (3.05, 30),
+}
+OUTBOUND_HTTP_RETRIES = 2  # idempotent calls only (and connects that never opened)
+OUTBOUND_HTTP_BACKOFF = 0.5  # seconds, doubled per retry
+OUTBOUND_HTTP_POOL_SIZE = 10  # keep-alive connections per upstream
+OUTBOUND_HTTP_BREAKER_FAILURES = 5  # consecutive failures before failing fast
+OUTBOUND_HTTP_BREAKER_RESET = 30  # seconds to fail fast before trying the upstream again
+
+# --- SMS (Africa's Talking; run `python manage.py sms_worker`) ---
+# 'api.sms.LocalTransport' only logs messages, for development.
+SMS_TRANSPORT = 'api.sms.AfricasTalkingTransport'
+SMS_SENDER_ID = os.getenv('AT_SENDER_ID') or None
+SMS_SEND_RATE = 10  # messages per second across one worker
+SMS_BULK_SIZE = 100  # recipients per gateway call
+SMS_MAX_ATTEMPTS = 5
+SMS_RETRY_BACKOFF = 30  # seconds before the first retry, doubled each time
+SMS_NOTIFY_CASE_ASSIGNED = True  # text agents when a case is auto-assigned to them
+
+# --- Patient OTP login (api/otp.py) ---
+# Codes are kept hashed in this cache when it is Redis or Memcached. Any other
+# backend, or an unreachable cache, stores them in the api_otpcode table.
+OTP_CACHE_ALIAS = 'shared'
+OTP_TTL = 300  # seconds a code stays valid
+OTP_MAX_ATTEMPTS = 5  # wrong codes before the current code is burned
+OTP_MAX_REQUESTS = 3  # codes sent to one number per OTP_REQUEST_WINDOW
+OTP_REQUEST_WINDOW = 600  # seconds
+
+# --- Live events (api/events/, served through asgi.py) ---
+# Events are published by whichever process saves a case: web workers, but
+# also triage_worker, payment_worker and sms_worker. The broker must therefore
+# reach across processes. DatabaseBroker does so through the api_outboxevent
+# table; 'api.events.CacheBroker' does through EVENTS_CACHE_ALIAS, which must
+# be Redis or Memcached (startup fails otherwise). 'api.events.InProcessBroker'
+# is for tests and single-process development servers only.
+EVENTS_BROKER = 'api.events.DatabaseBroker'
+EVENTS_CACHE_ALIAS = 'shared'
+EVENTS_HEARTBEAT_INTERVAL = 15  # seconds between keep-alive comments on an idle stream
+EVENTS_POLL_INTERVAL = 1  # seconds between subscriber polls
+EVENTS_RETENTION = 120  # seconds an event stays available to Last-Event-ID; DatabaseBroker only
+
+# --- Background AI triage (run `python manage.py triage_worker`) ---
+TRIAGE_MAX_ATTEMPTS = 3
+TRIAGE_STALE_AFTER = 300  # seconds before a 'running' job is handed to another worker
+ASSIGN_BATCH_SIZE = 200  # queued cases the worker hands to agents per transaction
+
+# --- Request metrics (api/middleware.py, served at api/metrics/) ---
+# Fraction of requests timed (wall, database, serializers, Daraja and Africa's
+# Talking calls). 0 takes the middleware out of the stack entirely.
+REQUEST_METRICS_SAMPLE_RATE = 1.0
+# Send the timings back in a Server-Timing header (visible in browser dev tools).
+REQUEST_METRICS_SERVER_TIMING = DEBUG
+
 # --- Logging ---
+# One JSON object per line on stderr (LOG_FORMAT=console for plain text while
+# developing). Lines are written by a background thread (api.log.QueueingStreamHandler)
+# so log I/O never blocks a request, and secrets, bearer tokens and OTPs are
+# masked before any handler sees them.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'redact_secrets': {
+            '()': 'api.log.RedactSecretsFilter',
+        },
+    },
+    'formatters': {
+        'json': {
+            '()': 'api.log.JsonFormatter',
+        },
+        'console': {
+            'format': '%(asctime)s %(levelname)s %(name)s: %(message)s',
+        },
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'api.log.QueueingStreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['redact_secrets'],
         },
     },
     'root': {
         'handlers': ['console'],
-        'level': 'DEBUG',
+        'level': LOG_LEVEL,
     },
-}
\ No newline at end of file
+    # Per-module levels; each can be raised or lowered independently of LOG_LEVEL.
+    'loggers': {
+        'api': {
+            'level': os.getenv('API_LOG_LEVEL', LOG_LEVEL),
+        },
+        # Replaces the handlers Django's default config gives this logger,
+        # which would print each of its records a second time.
+        'django': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        # Every SQL statement at DEBUG; only switch on deliberately.
+        'django.db.backends': {
+            'level': os.getenv('SQL_LOG_LEVEL', 'WARNING'),
+        },
+        'django.request': {
+            'level': 'WARNING',
+        },
+    },
+}
+# `manage.py test` drives failure paths on purpose; keep their log lines out
+# of the test output. assertLogs() still sees the records.
+TESTING = sys.argv[1:2] == ['test']
+if TESTING:
+    LOGGING['handlers']['console'] = {'class': 'logging.NullHandler'}
@@ -0,0 +1,50 @@
+# In api/account_lookup.py
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User as AuthUser
+from django.core.cache import caches
+from django.db.models.functions import Lower
+
+# Case-insensitive account lookups. They filter on LOWER(column) so the
+# expression indexes added in migration 0024 can serve them; an iexact
+# lookup compiles to UPPER()/LIKE depending on the backend and cannot.
+
+# The registration form checks availability as the user types, so answers
+# are cached briefly. Saving or deleting an account clears its entries
+# (see signals.py), so a new registration shows as taken straight away.
+CACHE_TIMEOUT = getattr(settings, 'ACCOUNT_LOOKUP_CACHE_TIMEOUT', 30)  # seconds
+
+LOOKUP_FIELDS = ('username', 'email')
+
+
+def _cache():
+    return caches[getattr(settings, 'ACCOUNT_LOOKUP_CACHE_ALIAS', 'default')]
+
+
+def _key(field, value):
+    # Hashed so that any input makes a valid (memcached-safe) key.
+    return f'account-lookup:{field}:{hashlib.sha256(value.encode()).hexdigest()}'
+
+
+def matching_accounts(field, value):
+    """AuthUser rows whose `field` equals `value`, ignoring case."""
+    return AuthUser.objects.alias(lookup=Lower(field)).filter(lookup=value.lower())
+
+
+def account_exists(field, value):
+    """Whether an account already uses `value` as its username or email, cached for CACHE_TIMEOUT."""
+    key = _key(field, value.lower())
+    cache = _cache()
+    exists = cache.get(key)
+    if exists is None:
+        exists = matching_accounts(field, value).exists()
+        cache.set(key, exists, CACHE_TIMEOUT)
+    return exists
+
+
+def invalidate_account_lookup(sender, instance, **kwargs):
+    _cache().delete_many([
+        _key(field, value.lower()) for field in LOOKUP_FIELDS if (value := getattr(instance, field))
+    ])
@@ -2,7 +2,10 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User as AuthUser
 
-from .models import Agent, Case, Language, PaymentDeclaration, User as UssdUser, UssdMenuText
+from .models import (
+    Agent, Case, DarajaCallback, Language, PaymentAttempt, PaymentDeclaration, SmsMessage, User as UssdUser,
+    UssdMenuText, UssdMenuNode,
+)
 
 # ✅ Inline: Agent profile inside AuthUser admin
 class AgentInline(admin.StackedInline):
@@ -10,6 +13,9 @@ class AgentInline(admin.StackedInline):
     can_delete = False
     verbose_name_plural = 'Agent Profile'
     fk_name = 'user'
+    # Moved with F() updates by the workload signals; a form would write back
+    # the value it loaded and undo them. `rebuild_agent_workload` fixes drift.
+    readonly_fields = ('open_cases',)
 
 
 # ✅ Admin Action: Bulk approve selected inactive agents
@@ -20,6 +26,7 @@ def approve_selected_users(modeladmin, request, queryset):
             user.is_active = True
             user.save()
             updated += 1
+    # Cases queued while no agent was available are handed out by triage_worker.
     modeladmin.message_user(request, f"✅ Approved {updated} agent(s).")
 approve_selected_users.short_description = "✅ Approve selected agents"
 
@@ -78,8 +85,44 @@ class UssdMenuTextAdmin(admin.ModelAdmin):
     search_fields = ('menu_key', 'menu_text')
 
 
+@admin.register(UssdMenuNode)
+class UssdMenuNodeAdmin(admin.ModelAdmin):
+    list_display = ('node_id', 'parent', 'choice', 'menu_key', 'action', 'action_value')
+    list_filter = ('action',)
+    search_fields = ('menu_key', 'action_value')
+
+
+@admin.register(PaymentAttempt)
+class PaymentAttemptAdmin(admin.ModelAdmin):
+    list_display = ('attempt_id', 'case', 'status', 'amount', 'checkout_request_id', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('checkout_request_id', 'phone_number')
+    raw_id_fields = ('case', 'requested_by')
+
+
+@admin.register(DarajaCallback)
+class DarajaCallbackAdmin(admin.ModelAdmin):
+    list_display = ('callback_id', 'checkout_request_id', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status',)
+    search_fields = ('checkout_request_id',)
+    readonly_fields = ('received_at', 'processed_at')
+
+
+@admin.register(SmsMessage)
+class SmsMessageAdmin(admin.ModelAdmin):
+    list_display = ('message_id', 'phone_number', 'kind', 'status', 'attempts', 'provider_status', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('phone_number', 'provider_message_id')
+
+    def get_queryset(self, request):
+        # Login codes are not for staff eyes, even while still queued.
+        return super().get_queryset(request).exclude(kind=SmsMessage.Kind.OTP)
+
+
 # ✅ Hide Agent from side panel (managed via User admin)
 @admin.register(Agent)
 class HiddenAgentAdmin(admin.ModelAdmin):
+    readonly_fields = ('open_cases',)
+
     def has_module_permission(self, request):
         return False
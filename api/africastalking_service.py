@@ -1,38 +1,57 @@
 # In api/africastalking_service.py
 
-import africastalking
 import os
+import threading
 
-# --- Initialize the SDK ---
-# Fetch credentials from your .env file
-username = os.getenv('AT_USERNAME')
-api_key = os.getenv('AT_API_KEY')
+from .metrics import timed
 
-# Initialize the SDK
-africastalking.initialize(username, api_key)
+_sms_service = None
+_sms_service_lock = threading.Lock()
+
+
+def get_sms_service():
+    """
+    Returns the Africa's Talking SMS service, created on first use so that
+    importing this module needs neither credentials nor the network.
+    """
+    global _sms_service
+    if _sms_service is None:
+        with _sms_service_lock:
+            if _sms_service is None:
+                from africastalking.SMS import SMSService
+
+                # Fetch credentials from your .env file
+                username = os.getenv('AT_USERNAME')
+                api_key = os.getenv('AT_API_KEY')
+                if not username or not api_key:
+                    raise RuntimeError("AT_USERNAME and AT_API_KEY must be set to send SMS.")
+                _sms_service = SMSService(username, api_key)
+    return _sms_service
+
+
+def send_bulk_sms(message, recipients, sender=None):
+    """
+    Sends one message to many recipients in a single API call and returns the
+    per-recipient results from Africa's Talking.
+
+    If you do not have a shortCode or senderId, Africa's Talking sends from
+    "AFRICASTKNG" by default.
+    """
+    service = get_sms_service()
+    with timed('upstream.africastalking'):
+        response = service.send(message, recipients, sender_id=sender)
+    return response.get('SMSMessageData', {}).get('Recipients', [])
 
-# Initialize the SMS service, which we will use to send the OTP
-sms = africastalking.SMS
 
 def send_otp_sms(phone_number, otp_code):
     """
-    Sends the OTP code to a user's phone number using Africa's Talking.
+    Queues the OTP code for a user's phone number; the SMS worker sends it.
     """
-    # Set the recipient's phone number in the correct international format
-    recipients = [phone_number]
+    from .sms import queue_sms
+    from .models import SmsMessage
+    from .otp import OTP_TTL
 
     # Set your message
-    message = f"Your AfyaLink verification code is {otp_code}. It is valid for 5 minutes."
-
-    # Set your shortCode or senderId.
-    # If you do not have one, this will be "AFRICASTKNG" by default.
-    sender = "AFRICASTKNG"
-
-    try:
-        # Send the message
-        response = sms.send(message, recipients, sender)
-        print("✅ SMS SENT: ", response)
-        return True
-    except Exception as e:
-        print(f"❌ SMS FAILED: Something went wrong and we could not send the message. Error: {e}")
-        return False
\ No newline at end of file
+    message = f"Your AfyaLink verification code is {otp_code}. It is valid for {OTP_TTL // 60} minutes."
+    queue_sms([phone_number], message, kind=SmsMessage.Kind.OTP)
+    return True
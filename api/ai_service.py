@@ -1,46 +1,125 @@
 
-
 import random
+import re
 
-def get_ai_triage_for_symptoms(symptom_text):
+# --- Keyword Lists ---
+
+# ✅ MODIFIED: Added severity modifiers
+severity_modifiers = ["severe", "unbearable", "extreme", "intense"]
+
+# Symptoms that become high urgency when paired with a severity modifier
+severity_targets = ["pain", "headache", "bleeding"]
+
+high_urgency_keywords = [
+    "can't breathe", "breathing difficulty", "chest pain", "bleeding",
+    "unconscious", "choking", "seizure", "head injury", "swallowing"
+]
+
+moderate_urgency_keywords = [
+    "fever", "vomiting", "headache", "dizzy", "migraine",
+    "cough", "rash", "stomach cramps", "back pain"
+]
+
+# Category Keywords (can be expanded similarly)
+respiratory_keywords = ["cough", "fever", "cold", "flu", "sore throat", "breathing"]
+digestive_keywords = ["stomach", "nausea", "vomiting", "diarrhea"]
+injury_keywords = ["cut", "bleeding", "wound", "bruise", "injury", "pain"]
+
+KEYWORD_GROUPS = {
+    'severity_modifier': severity_modifiers,
+    'severity_target': severity_targets,
+    'high': high_urgency_keywords,
+    'moderate': moderate_urgency_keywords,
+    'respiratory': respiratory_keywords,
+    'digestive': digestive_keywords,
+    'injury': injury_keywords,
+}
+
+
+# --- Compiled Matcher ---
+
+def _trie_pattern(words):
     """
-    Simulates an AI model with improved logic to check for severity modifiers.
+    Builds a regex alternation shaped like a trie, so the engine follows a
+    single branch per character and prefers the longest keyword.
     """
-    symptom_lower = symptom_text.lower()
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    def build(node):
+        is_end = '' in node
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if is_end:
+            return '(?:' + body + ')?'
+        return body
+
+    return build(trie)
+
+
+def _compile_matcher(groups):
+    """
+    Compiles every keyword into one pattern. The lookahead lets finditer
+    report the longest keyword starting at each position of the text in a
+    single scan; the shorter keywords that are prefixes of it are recovered
+    from a precomputed table, so overlapping hits are never lost.
+    """
+    tags = {}
+    for group, words in groups.items():
+        for word in words:
+            tags.setdefault(word, set()).add(group)
+
+    keywords = sorted(tags)
+    hits = {}
+    for word in keywords:
+        found = set()
+        for other in keywords:
+            if word.startswith(other):
+                found.update(tags[other])
+        hits[word] = frozenset(found)
+
+    return re.compile('(?=(' + _trie_pattern(keywords) + '))'), hits
 
-    urgency = "Low"  # Default urgency
-    category = "General Inquiry"
-    summary = f"Patient reports: {symptom_text}"
 
-    # --- Expanded Keyword-Based Logic ---
+_MATCHER, _KEYWORD_HITS = _compile_matcher(KEYWORD_GROUPS)
 
-    # ✅ MODIFIED: Added severity modifiers
-    severity_modifiers = ["severe", "unbearable", "extreme", "intense"]
 
-    high_urgency_keywords = [
-        "can't breathe", "breathing difficulty", "chest pain", "bleeding",
-        "unconscious", "choking", "seizure", "head injury", "swallowing"
-    ]
+def match_keyword_groups(symptom_lower):
+    """Returns the set of keyword groups found in an already lowercased text."""
+    found = set()
+    for match in _MATCHER.finditer(symptom_lower):
+        found |= _KEYWORD_HITS[match.group(1)]
+    return found
 
-    moderate_urgency_keywords = [
-        "fever", "vomiting", "headache", "dizzy", "migraine",
-        "cough", "rash", "stomach cramps", "back pain"
-    ]
+
+def get_ai_triage_for_symptoms(symptom_text):
+    """
+    Simulates an AI model with improved logic to check for severity modifiers.
+    """
+    found = match_keyword_groups(symptom_text.lower())
+
+    urgency = "Low"  # Default urgency
+    category = "General Inquiry"
 
     # ✅ IMPROVED LOGIC: Check for severity modifiers first
-    if any(modifier in symptom_lower for modifier in severity_modifiers) and any(keyword in symptom_lower for keyword in ["pain", "headache", "bleeding"]):
+    if 'severity_modifier' in found and 'severity_target' in found:
         urgency = "High"
-    elif any(word in symptom_lower for word in high_urgency_keywords):
+    elif 'high' in found:
         urgency = "High"
-    elif any(word in symptom_lower for word in moderate_urgency_keywords):
+    elif 'moderate' in found:
         urgency = "Moderate"
 
-    # Category Keywords (can be expanded similarly)
-    if any(word in symptom_lower for word in ["cough", "fever", "cold", "flu", "sore throat", "breathing"]):
+    if 'respiratory' in found:
         category = "Respiratory Issue"
-    elif any(word in symptom_lower for word in ["stomach", "nausea", "vomiting", "diarrhea"]):
+    elif 'digestive' in found:
         category = "Digestive Issue"
-    elif any(word in symptom_lower for word in ["cut", "bleeding", "wound", "bruise", "injury", "pain"]):
+    elif 'injury' in found:
         category = "Injury / Pain"
 
     summary = f"Patient reports symptoms consistent with a {category.lower()}, including: {symptom_text}. Urgency has been assessed as {urgency}."
@@ -49,4 +128,20 @@ def get_ai_triage_for_symptoms(symptom_text):
         "ai_urgency": urgency,
         "ai_category": category,
         "ai_summary": summary
-    }
\ No newline at end of file
+    }
+
+
+def triage_many(texts):
+    """
+    Triage for a batch of symptom texts, e.g. a backfill of historical cases.
+    Returns one result per input, in order. Repeated texts are only matched
+    once and share the same result dict, so treat the results as read-only.
+    """
+    seen = {}
+    results = []
+    for symptom_text in texts:
+        result = seen.get(symptom_text)
+        if result is None:
+            result = seen[symptom_text] = get_ai_triage_for_symptoms(symptom_text)
+        results.append(result)
+    return results
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connect the signal receivers (cache invalidation etc.)
+        from . import signals  # noqa: F401
+        # Build the event broker now so a misconfigured one (e.g. CacheBroker
+        # on a per-process cache) stops startup instead of dropping events.
+        from .events import get_event_broker
+        get_event_broker()
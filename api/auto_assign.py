@@ -1,46 +1,159 @@
 # In api/auto_assign.py
 
-from .models import Agent, Case
-from django.db.models import Count, Q
+import heapq
+import logging
 
-def auto_assign_case(case):
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Value, When, expressions
+from django.utils import timezone
+
+from .events import CaseEvent, publish_case_event
+from .models import Agent, Case, CaseHistory, OPEN_CASE_STATUSES
+from .sms import notify_case_assigned
+
+logger = logging.getLogger(__name__)
+
+
+def adjust_open_cases(agent_id, delta):
+    """Atomically moves an agent's open case counter by `delta`, never below zero."""
+    if agent_id is None or not delta:
+        return
+    agent = Agent.objects.filter(pk=agent_id)
+    if delta > 0:
+        agent.update(open_cases=F('open_cases') + delta)
+    # The column is unsigned: taking a drifted counter below zero would make
+    # MySQL reject the UPDATE, and with it the case save that fired the signal.
+    elif not agent.filter(open_cases__gte=abs(delta)).update(open_cases=F('open_cases') - abs(delta)):
+        agent.filter(open_cases__lt=abs(delta)).update(open_cases=0)
+
+
+def auto_assign_case(case_id):
     """
     Finds the active agent with the fewest open cases and assigns
     the new case to them. If there's a tie, it assigns to the agent
-    who was created earliest to ensure fair distribution.
+    who was created earliest to ensure fair distribution. A case that
+    already has an agent is left alone.
     """
     try:
-        # Define which statuses are considered "open" for counting workload
-        open_statuses = [
-            Case.CaseStatus.NEW,
-            Case.CaseStatus.ASSIGNED,
-            Case.CaseStatus.VIEWED,
-            Case.CaseStatus.NEEDS_FOLLOW_UP
-        ]
-
-        # Get active agents and count their open cases efficiently.
-        active_agents = Agent.objects.filter(user__is_active=True).annotate(
-            open_cases=Count('assigned_cases', filter=Q(assigned_cases__status__in=open_statuses))
+        with transaction.atomic():
+            # Re-read and lock the case: the caller's copy may be stale, and an
+            # agent may have taken it (or another worker assigned it) meanwhile.
+            case = Case.objects.select_for_update().filter(pk=case_id).first()
+            if case is None or case.agent_id is not None:
+                return
+
+            # The maintained open_cases counter makes this an indexed lookup
+            # instead of counting every agent's cases.
+            agents = Agent.objects.filter(user__is_active=True).order_by('open_cases', 'created_at')
+
+            # Skip agents another request is assigning to right now, so a burst
+            # of new cases spreads out instead of piling onto one agent.
+            least_busy_agent = agents.select_for_update(skip_locked=True, of=('self',)).first()
+            if least_busy_agent is None:
+                least_busy_agent = agents.select_for_update(of=('self',)).first()
+
+            if least_busy_agent is None:
+                logger.warning("No active agents available; case %s stays unassigned.", case_id)
+                return
+
+            # Assign the 'Agent' object itself to the case's agent field.
+            # The workload signal bumps the agent's counter in this transaction.
+            case.agent = least_busy_agent
+            case.status = Case.CaseStatus.ASSIGNED
+            case.save(update_fields=['agent', 'status', 'updated_at'])
+
+            # Log the assignment for the case history
+            CaseHistory.objects.create(case=case, description=f"Case automatically assigned to agent {least_busy_agent.full_name}.")
+            notify_case_assigned([(case_id, least_busy_agent.phone_number)])
+
+        logger.info("Case %s assigned to agent %s.", case_id, least_busy_agent.pk)
+
+    except Exception:
+        logger.exception("Auto-assignment of case %s failed.", case_id)
+
+
+# Most urgent first; untriaged cases go after every triaged one.
+URGENCY_RANK = {'High': 0, 'Moderate': 1, 'Low': 2}
+# Cases assigned per transaction, so the agent rows are only locked briefly.
+ASSIGN_BATCH_SIZE = getattr(settings, 'ASSIGN_BATCH_SIZE', 200)
+
+
+def assign_pending_cases(batch_size=ASSIGN_BATCH_SIZE):
+    """
+    Assigns up to `batch_size` unassigned open cases in one transaction, most
+    urgent and then oldest first, each to the currently least-loaded active
+    agent (a heap keyed on open_cases, then agent age). Returns the number of
+    cases assigned; call again until it returns 0 to clear a backlog.
+    """
+    urgency_rank = expressions.Case(
+        *[When(ai_urgency=urgency, then=Value(rank)) for urgency, rank in URGENCY_RANK.items()],
+        default=Value(len(URGENCY_RANK)),
+    )
+    with transaction.atomic():
+        # Cases before agents, the same lock order as auto_assign_case().
+        cases = list(
+            Case.objects.select_for_update(skip_locked=True)
+            .filter(agent__isnull=True, status__in=OPEN_CASE_STATUSES)
+            .alias(urgency_rank=urgency_rank)
+            .order_by('urgency_rank', 'created_at', 'case_id')
+            .only('case_id', 'user', 'ai_urgency', 'created_at')[:batch_size]
+        )
+        if not cases:
+            return 0
+        agents = list(
+            Agent.objects.select_for_update(of=('self',))
+            .filter(user__is_active=True)
+            .order_by('open_cases', 'created_at')
         )
+        if not agents:
+            logger.warning("No active agents available; queued cases stay unassigned.")
+            return 0
 
-        if not active_agents:
-            print("AUTO-ASSIGN: No active agents available.")
-            return
+        workload = [(agent.open_cases, agent.created_at, index) for index, agent in enumerate(agents)]
+        heapq.heapify(workload)
 
-        # ✅ IMPROVED: First, order by the number of open cases (fewest first).
-        # Then, use the agent's creation date as a tie-breaker for a fair round-robin style.
-        least_busy_agent = active_agents.order_by('open_cases', 'created_at').first()
+        now = timezone.now()
+        history = []
+        for case in cases:
+            open_cases, created_at, index = heapq.heappop(workload)
+            agent = agents[index]
+            case.agent = agent
+            case.status = Case.CaseStatus.ASSIGNED
+            case.updated_at = now
+            history.append(CaseHistory(case=case, description=f"Case automatically assigned to agent {agent.full_name}."))
+            agent.open_cases = open_cases + 1
+            heapq.heappush(workload, (agent.open_cases, created_at, index))
 
-        # Assign the 'Agent' object itself to the case's agent field.
-        case.agent = least_busy_agent
-        case.status = Case.CaseStatus.ASSIGNED
-        case.save()
+        # bulk_update skips the workload signal, so the (locked) agent rows
+        # get their new counters written directly.
+        Case.objects.bulk_update(cases, ['agent', 'status', 'updated_at'])
+        CaseHistory.objects.bulk_create(history)
+        Agent.objects.bulk_update(agents, ['open_cases'])
+        # bulk_update skips the signal that announces assignments, too.
+        for case in cases:
+            publish_case_event(CaseEvent.CASE_ASSIGNED, case.case_id, case.user_id, case.agent_id, status=case.status)
+        notify_case_assigned([(case.case_id, case.agent.phone_number) for case in cases])
 
-        # Log the assignment for the case history
-        from .models import CaseHistory
-        CaseHistory.objects.create(case=case, description=f"Case automatically assigned to agent {least_busy_agent.full_name}.")
+    logger.info("Assigned %s queued case(s) across %s agent(s).", len(cases), len(agents))
+    return len(cases)
 
-        print(f"AUTO-ASSIGN: Case {case.case_id} assigned to agent {least_busy_agent.full_name}.")
 
-    except Exception as e:
-        print(f"AUTO-ASSIGN: An error occurred during auto-assignment: {e}")
\ No newline at end of file
+def rebuild_open_case_counters():
+    """
+    Recomputes every agent's open_cases from the cases table, e.g. after
+    bulk edits that bypassed the signals. Returns the number of agents fixed.
+    """
+    with transaction.atomic():
+        counts = dict(
+            Case.objects.filter(agent__isnull=False, status__in=OPEN_CASE_STATUSES)
+            .values_list('agent')
+            .annotate(total=Count('case_id'))
+            .order_by()
+        )
+        agents = list(Agent.objects.select_for_update().only('pk', 'open_cases'))
+        changed = [agent for agent in agents if agent.open_cases != counts.get(agent.pk, 0)]
+        for agent in changed:
+            agent.open_cases = counts.get(agent.pk, 0)
+        Agent.objects.bulk_update(changed, ['open_cases'])
+    return len(changed)
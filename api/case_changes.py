@@ -0,0 +1,91 @@
+# In api/case_changes.py
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from .models import CaseTombstone
+from .serializers import CaseListValues
+
+CHANGES_LIMIT = getattr(settings, 'CASE_CHANGES_LIMIT', 500)
+# Rows newer than this may still be joined by slower transactions with earlier
+# timestamps, so the feed only hands them out once they have settled.
+SETTLE_DELAY = timedelta(seconds=getattr(settings, 'CASE_CHANGES_SETTLE_DELAY', 2))
+TOMBSTONE_RETENTION = timedelta(days=getattr(settings, 'CASE_TOMBSTONE_RETENTION_DAYS', 7))
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class ChangeTokenExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = "This change token is too old; reload the case list and start again."
+    default_code = 'change_token_expired'
+
+
+def encode_token(updated_at, case_id, tombstone_id):
+    microseconds = (updated_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{microseconds}.{case_id}.{tombstone_id}"
+
+
+def decode_token(token):
+    try:
+        microseconds, case_id, tombstone_id = (int(part) for part in token.split('.'))
+    except ValueError:
+        raise ValidationError({'since': "Invalid change token."})
+    return _EPOCH + timedelta(microseconds=microseconds), case_id, tombstone_id
+
+
+def get_case_changes(cases, tombstones, token=None, limit=CHANGES_LIMIT):
+    """
+    Returns the cases from `cases` changed since `token`, the tombstones from
+    `tombstones` recorded since then, and the token to send next time.
+
+    Cases are read in (updated_at, case_id) order off case_updated_idx and
+    tombstones in id order, so each poll is a range scan whose size depends
+    on how much changed, not on how many cases there are. Without a token
+    nothing is returned, only a token for "now" to pair with a fresh list.
+    """
+    now = timezone.now()
+    cutoff = now - SETTLE_DELAY
+
+    if token is None:
+        last_tombstone_id = CaseTombstone.objects.order_by('-tombstone_id').values_list('tombstone_id', flat=True).first()
+        return {'token': encode_token(cutoff, 0, last_tombstone_id or 0), 'changes': [], 'tombstones': [], 'has_more': False}
+
+    since, last_case_id, last_tombstone_id = decode_token(token)
+    if since < now - TOMBSTONE_RETENTION:
+        raise ChangeTokenExpired()
+
+    rows = list(CaseListValues.values(
+        cases.filter(Q(updated_at__gt=since) | Q(updated_at=since, case_id__gt=last_case_id), updated_at__lt=cutoff)
+        .order_by('updated_at', 'case_id')
+    )[:limit + 1])
+    removed = list(
+        tombstones.filter(tombstone_id__gt=last_tombstone_id, created_at__lt=cutoff)
+        .order_by('tombstone_id')
+        .values('tombstone_id', 'case_id', 'reason', 'created_at')[:limit + 1]
+    )
+    has_more = len(rows) > limit or len(removed) > limit
+    rows, removed = rows[:limit], removed[:limit]
+
+    if len(rows) == limit:
+        since, last_case_id = rows[-1]['updated_at'], rows[-1]['case_id']
+    else:
+        # Everything before the cutoff has been handed out.
+        since, last_case_id = cutoff, 0
+    if removed:
+        last_tombstone_id = removed[-1]['tombstone_id']
+
+    return {
+        'token': encode_token(since, last_case_id, last_tombstone_id),
+        'changes': CaseListValues.to_representation(rows),
+        'tombstones': [
+            {'case_id': item['case_id'], 'reason': item['reason'], 'at': item['created_at']}
+            for item in removed
+        ],
+        'has_more': has_more,
+    }
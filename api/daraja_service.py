@@ -1,47 +1,151 @@
 # In api/daraja_service.py
 
+import logging
 import requests
 import os
+import threading
+import time
 from requests.auth import HTTPBasicAuth
 import base64
 from datetime import datetime
 
-def get_daraja_access_token():
+from django.conf import settings
+from django.core.cache import caches
+
+from .http_client import get_http_client
+
+logger = logging.getLogger(__name__)
+
+DARAJA_BASE_URL = getattr(settings, 'DARAJA_BASE_URL', 'https://sandbox.safaricom.co.ke').rstrip('/')
+
+# --- Access token cache ---
+# The token lives in a Django cache (DARAJA_TOKEN_CACHE_ALIAS) so every worker
+# process shares it. Once it is within DARAJA_TOKEN_REFRESH_MARGIN seconds of
+# expiry, one caller refreshes it while everyone else keeps using the old one.
+TOKEN_CACHE_KEY = 'daraja:access-token'
+TOKEN_LOCK_KEY = 'daraja:access-token:lock'
+TOKEN_REFRESH_MARGIN = getattr(settings, 'DARAJA_TOKEN_REFRESH_MARGIN', 300)
+# How long a refresh may hold the cross-process lock, and how long callers
+# with no usable token wait for it before fetching one themselves.
+TOKEN_LOCK_TIMEOUT = 10
+
+_token_lock = threading.Lock()
+
+
+def _token_cache():
+    return caches[getattr(settings, 'DARAJA_TOKEN_CACHE_ALIAS', 'shared')]
+
+
+def _request_access_token():
     """
-    Requests an access token from the Safaricom Daraja API.
+    Requests an access token from the Safaricom Daraja API and caches it
+    for its `expires_in` lifetime.
     """
     consumer_key = os.getenv('DARAJA_CONSUMER_KEY')
     consumer_secret = os.getenv('DARAJA_CONSUMER_SECRET')
-    api_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+    api_url = f"{DARAJA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
 
     try:
-        response = requests.get(api_url, auth=HTTPBasicAuth(consumer_key, consumer_secret))
+        response = get_http_client('daraja').get(api_url, 'oauth', auth=HTTPBasicAuth(consumer_key, consumer_secret))
         response.raise_for_status()
         json_response = response.json()
         access_token = json_response.get('access_token')
 
         if not access_token:
-            print("❌ DARAJA AUTH: Could not get access token.")
+            logger.error("Daraja returned no access token.")
             return None
 
-        print("✅ DARAJA AUTH: Successfully obtained access token.")
-        return access_token
+        logger.info("Obtained a Daraja access token.")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.error("Daraja access token request failed: %s", e)
+        return None
+
+    expires_in = int(json_response.get('expires_in') or 3599)
+    now = time.time()
+    entry = {
+        'token': access_token,
+        'refresh_at': now + max(expires_in - TOKEN_REFRESH_MARGIN, expires_in / 2),
+        'expires_at': now + expires_in,
+    }
+    try:
+        # Drop it from the cache a little before Daraja stops accepting it.
+        _token_cache().set(TOKEN_CACHE_KEY, entry, max(expires_in - 5, 1))
+    except Exception as e:
+        logger.warning("Could not cache the Daraja access token: %s", e)
+    return access_token
+
 
-    except requests.exceptions.RequestException as e:
-        print(f"❌ DARAJA AUTH: Request failed. Error: {e}")
+def _refresh_single_flight(wait):
+    """
+    Refreshes the token unless another thread or process already is. With
+    `wait`, blocks until that other refresh has cached a token (up to
+    TOKEN_LOCK_TIMEOUT) and returns it; otherwise returns None at once.
+    """
+    cache = _token_cache()
+    # The thread lock keeps this process to one caller at a time; the cache
+    # lock does the same across processes.
+    if not _token_lock.acquire(blocking=wait):
         return None
+    try:
+        entry = cache.get(TOKEN_CACHE_KEY)
+        if entry and time.time() < entry['refresh_at']:
+            return entry['token']
+        if cache.add(TOKEN_LOCK_KEY, True, TOKEN_LOCK_TIMEOUT):
+            try:
+                return _request_access_token()
+            finally:
+                cache.delete(TOKEN_LOCK_KEY)
+        if not wait:
+            return None
+        deadline = time.monotonic() + TOKEN_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(TOKEN_CACHE_KEY)
+            if entry and time.time() < entry['refresh_at']:
+                return entry['token']
+            if cache.get(TOKEN_LOCK_KEY) is None:
+                break
+        # The other refresh failed or is stuck; try ourselves.
+        return _request_access_token()
+    finally:
+        _token_lock.release()
+
+
+def get_daraja_access_token():
+    """
+    Returns a Daraja access token, requesting a new one only when the shared
+    cached token is missing or due for refresh.
+    """
+    try:
+        entry = _token_cache().get(TOKEN_CACHE_KEY)
+    except Exception as e:
+        # A missing cache table or an unreachable Redis must not stop payments.
+        logger.warning("Daraja token cache unavailable (%s); requesting a token directly.", e)
+        return _request_access_token()
+    now = time.time()
+    if entry and now < entry['refresh_at']:
+        return entry['token']
+    if entry and now < entry['expires_at']:
+        # Still valid: refresh early if nobody else is, but don't wait for it.
+        return _refresh_single_flight(wait=False) or entry['token']
+    return _refresh_single_flight(wait=True)
+
 
+def invalidate_daraja_access_token():
+    """Forgets the cached token, e.g. after Daraja rejected it."""
+    _token_cache().delete(TOKEN_CACHE_KEY)
 
-# MODIFIED: The function now accepts the 'case' object to update it
-def initiate_stk_push(case, phone_number, amount, account_reference, transaction_desc):
+
+def initiate_stk_push(phone_number, amount, account_reference, transaction_desc):
     """
-    Initiates an M-Pesa STK Push and saves the CheckoutRequestID to the case.
+    Initiates an M-Pesa STK Push and returns Daraja's response. The caller
+    records the CheckoutRequestID (see api/payment_queue.py).
     """
     access_token = get_daraja_access_token()
     if not access_token:
         return {"error": "Could not authenticate with Daraja."}
 
-    api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+    api_url = f"{DARAJA_BASE_URL}/mpesa/stkpush/v1/processrequest"
     headers = {"Authorization": f"Bearer {access_token}"}
 
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
@@ -68,18 +172,23 @@ def initiate_stk_push(case, phone_number, amount, account_reference, transaction
     }
 
     try:
-        response = requests.post(api_url, json=payload, headers=headers)
+        response = get_http_client('daraja').post(api_url, 'stk_push', json=payload, headers=headers)
+        if response.status_code == 401:
+            # Revoked before its expiry; fetch a fresh token and retry once.
+            invalidate_daraja_access_token()
+            access_token = get_daraja_access_token()
+            if not access_token:
+                return {"error": "Could not authenticate with Daraja."}
+            headers = {"Authorization": f"Bearer {access_token}"}
+            response = get_http_client('daraja').post(api_url, 'stk_push', json=payload, headers=headers)
         response.raise_for_status()
         response_json = response.json()
-
-        # ✅ SAVE THE ID: Get the CheckoutRequestID from the response
-        checkout_id = response_json.get('CheckoutRequestID')
-        if checkout_id:
-            case.checkout_request_id = checkout_id
-            case.save()
-
-        print("✅ STK PUSH: Request successful. Response:", response_json)
+        logger.info(
+            "STK push accepted for %s.", account_reference,
+            extra={'checkout_request_id': response_json.get('CheckoutRequestID'),
+                   'response_code': response_json.get('ResponseCode')},
+        )
         return response_json
-    except requests.exceptions.RequestException as e:
-        print(f"❌ STK PUSH: Request failed. Error: {e}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        logger.warning("STK push for %s failed: %s", account_reference, e)
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,226 @@
+# In api/events.py
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+from .shared_cache import has_atomic_counters
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = getattr(settings, 'EVENTS_HEARTBEAT_INTERVAL', 15)
+
+
+class CaseEvent:
+    CASE_ASSIGNED = 'case_assigned'
+    STATUS_CHANGED = 'status_changed'
+    PAYMENT_CONFIRMED = 'payment_confirmed'
+
+
+def agent_channel(agent_id):
+    return f'agent:{agent_id}'
+
+
+def patient_channel(user_id):
+    return f'user:{user_id}'
+
+
+STAFF_CHANNEL = 'staff'
+
+
+# --- Brokers ---
+# A broker fans events out to subscribers. publish() may be called from any
+# thread (sync views run in a thread pool under ASGI); subscribe() is an async
+# generator that yields events for the given channels, or None after
+# `heartbeat` seconds without one so the stream can send a keep-alive.
+
+class InProcessBroker:
+    """
+    Fans events out to subscribers in this process only. Events published by
+    another process (a worker command, a second web worker) never arrive, so
+    this is only for tests and single-process development servers.
+    """
+
+    queue_size = 100
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def publish(self, event_type, data, channels):
+        event = {'id': next(self._ids), 'type': event_type, 'data': data}
+        with self._lock:
+            targets = {subscriber for channel in channels for subscriber in self._subscribers.get(channel, ())}
+        for loop, queue in targets:
+            loop.call_soon_threadsafe(self._deliver, queue, event)
+
+    @staticmethod
+    def _deliver(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            logger.warning("Dropping %s event for a slow event stream subscriber.", event['type'])
+
+    async def subscribe(self, channels, last_event_id=None, heartbeat=HEARTBEAT_INTERVAL):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(maxsize=self.queue_size))
+        with self._lock:
+            for channel in channels:
+                self._subscribers.setdefault(channel, set()).add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscriber[1].get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers.get(channel, set()).discard(subscriber)
+                    if not self._subscribers.get(channel):
+                        self._subscribers.pop(channel, None)
+
+
+class DatabaseBroker:
+    """
+    Shares events between processes through the OutboxEvent table: publish()
+    inserts a row and subscribers poll for rows past the last one they saw.
+    Works wherever the database does, so the workers that save cases (the
+    triage, payment and SMS commands) reach streams held by the web process.
+    Events are kept for `retention` seconds, which also bounds how far
+    Last-Event-ID can resume.
+    """
+
+    def __init__(self, poll_interval=None, retention=None, batch_size=100):
+        self.poll_interval = poll_interval or getattr(settings, 'EVENTS_POLL_INTERVAL', 1)
+        self.retention = retention or getattr(settings, 'EVENTS_RETENTION', 120)
+        self.batch_size = batch_size
+        self._pruned_at = 0
+
+    def publish(self, event_type, data, channels):
+        OutboxEvent.objects.create(event_type=event_type, data=data, channels=list(channels))
+        # Pruning is a range delete on created_at; once per retention period
+        # per process is plenty.
+        if time.monotonic() - self._pruned_at >= self.retention:
+            self._pruned_at = time.monotonic()
+            OutboxEvent.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=self.retention)).delete()
+
+    async def subscribe(self, channels, last_event_id=None, heartbeat=HEARTBEAT_INTERVAL):
+        channels = set(channels)
+        current = await OutboxEvent.objects.order_by('-event_id').values_list('event_id', flat=True).afirst() or 0
+        last_seen = last_event_id if last_event_id is not None and last_event_id <= current else current
+        idle_since = time.monotonic()
+        while True:
+            rows = OutboxEvent.objects.filter(event_id__gt=last_seen).order_by('event_id')
+            async for event in rows.values('event_id', 'event_type', 'data', 'channels')[:self.batch_size]:
+                last_seen = event['event_id']
+                if channels.intersection(event['channels']):
+                    idle_since = time.monotonic()
+                    yield {'id': event['event_id'], 'type': event['event_type'], 'data': event['data']}
+            if time.monotonic() - idle_since >= heartbeat:
+                idle_since = time.monotonic()
+                yield None
+            await asyncio.sleep(self.poll_interval)
+
+
+class CacheBroker:
+    """
+    Shares events between workers through a Django cache (EVENTS_CACHE_ALIAS):
+    each event is stored under a sequence number and subscribers poll for new
+    ones. The cache must be Redis or Memcached: a per-process cache never
+    reaches other workers, and the database cache's non-atomic incr() would
+    hand two events the same number. Events are kept for `event_timeout`
+    seconds, which also bounds how far Last-Event-ID can resume.
+    """
+
+    key_prefix = 'case-events:'
+
+    def __init__(self, alias=None, poll_interval=None, event_timeout=None):
+        alias = alias or getattr(settings, 'EVENTS_CACHE_ALIAS', 'shared')
+        self.cache = caches[alias]
+        if not has_atomic_counters(self.cache):
+            raise ImproperlyConfigured(
+                f"CacheBroker needs a Redis or Memcached cache shared by every worker; "
+                f"the '{alias}' cache is {type(self.cache).__name__}. Use 'api.events.DatabaseBroker' instead."
+            )
+        self.poll_interval = poll_interval or getattr(settings, 'EVENTS_POLL_INTERVAL', 1)
+        self.event_timeout = event_timeout or getattr(settings, 'EVENTS_CACHE_TIMEOUT', 120)
+
+    def _next_id(self):
+        sequence_key = self.key_prefix + 'seq'
+        self.cache.add(sequence_key, 0, None)
+        return self.cache.incr(sequence_key)
+
+    def publish(self, event_type, data, channels):
+        event_id = self._next_id()
+        event = {'id': event_id, 'type': event_type, 'data': data, 'channels': list(channels)}
+        self.cache.set(f'{self.key_prefix}{event_id}', event, self.event_timeout)
+
+    async def subscribe(self, channels, last_event_id=None, heartbeat=HEARTBEAT_INTERVAL):
+        channels = set(channels)
+        current = await self.cache.aget(self.key_prefix + 'seq', 0)
+        last_seen = last_event_id if last_event_id is not None and last_event_id <= current else current
+        idle_since = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = await self.cache.aget(self.key_prefix + 'seq', 0)
+            if current > last_seen:
+                keys = [f'{self.key_prefix}{event_id}' for event_id in range(last_seen + 1, current + 1)]
+                found = await self.cache.aget_many(keys)
+                last_seen = current
+                for key in keys:
+                    event = found.get(key)
+                    if event and channels.intersection(event['channels']):
+                        idle_since = time.monotonic()
+                        yield {'id': event['id'], 'type': event['type'], 'data': event['data']}
+            if time.monotonic() - idle_since >= heartbeat:
+                idle_since = time.monotonic()
+                yield None
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_event_broker():
+    """Returns the configured broker (EVENTS_BROKER), built once."""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_path = getattr(settings, 'EVENTS_BROKER', 'api.events.DatabaseBroker')
+                _broker = import_string(broker_path)()
+    return _broker
+
+
+def publish_event(event_type, data, channels):
+    """
+    Publishes an event once the current transaction commits, so subscribers
+    never hear about a change they cannot read yet. Failures are logged, never
+    raised into the request that caused the event.
+    """
+    def send():
+        try:
+            get_event_broker().publish(event_type, data, channels)
+        except Exception:
+            logger.exception("Could not publish %s event.", event_type)
+    transaction.on_commit(send)
+
+
+def publish_case_event(event_type, case_id, user_id, agent_id, **data):
+    """Sends a case event to the case's patient, its agent and the staff channel."""
+    channels = [STAFF_CHANNEL, patient_channel(user_id)]
+    if agent_id is not None:
+        channels.append(agent_channel(agent_id))
+    publish_event(event_type, {'case_id': case_id, 'agent': agent_id, **data}, channels)
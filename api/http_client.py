@@ -0,0 +1,156 @@
+# In api/http_client.py
+
+import logging
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .metrics import histogram, timed
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (3.05, 15)  # (connect, read) seconds
+# Only these are retried after the request may have reached the server; a
+# POST such as an STK push is retried only when the connection never opened.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+request_duration = histogram(
+    'outbound_http_request_duration_seconds',
+    'Latency of outbound HTTP calls, retries included.',
+    labels=('client', 'endpoint', 'outcome'),
+)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without calling the upstream while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and then fails fast
+    for `reset_timeout` seconds. After that one trial call is let through:
+    success closes the circuit again, failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} is unavailable; not calling it for now.")
+            self._trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Circuit for %s opened after %s failure(s).", self.name, self._failures)
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+
+class HttpClient:
+    """
+    A pooled, keep-alive session for one upstream service. Every call names
+    an endpoint, which picks its (connect, read) timeout from
+    OUTBOUND_HTTP_TIMEOUTS ('<client>.<endpoint>') and labels its latency.
+    Idempotent calls are retried with exponential backoff on connection
+    errors and 502/503/504; 5xx responses and network errors count towards
+    the circuit breaker.
+    """
+
+    def __init__(self, name, retries=None, backoff_factor=None, pool_size=None,
+                 failure_threshold=None, reset_timeout=None):
+        self.name = name
+        retries = getattr(settings, 'OUTBOUND_HTTP_RETRIES', 2) if retries is None else retries
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=getattr(settings, 'OUTBOUND_HTTP_BACKOFF', 0.5) if backoff_factor is None else backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=IDEMPOTENT_METHODS,
+            raise_on_status=False,
+        )
+        pool_size = pool_size or getattr(settings, 'OUTBOUND_HTTP_POOL_SIZE', 10)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.breaker = CircuitBreaker(
+            name,
+            failure_threshold=failure_threshold or getattr(settings, 'OUTBOUND_HTTP_BREAKER_FAILURES', 5),
+            reset_timeout=reset_timeout or getattr(settings, 'OUTBOUND_HTTP_BREAKER_RESET', 30),
+        )
+
+    def timeout_for(self, endpoint):
+        timeouts = getattr(settings, 'OUTBOUND_HTTP_TIMEOUTS', {})
+        return timeouts.get(f'{self.name}.{endpoint}', timeouts.get(self.name, DEFAULT_TIMEOUT))
+
+    def request(self, method, url, endpoint, **kwargs):
+        self.breaker.before_call()
+        kwargs.setdefault('timeout', self.timeout_for(endpoint))
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            with timed(f'upstream.{self.name}'):
+                response = self.session.request(method, url, **kwargs)
+            outcome = str(response.status_code)
+        except Exception:
+            # Any exception counts, so a half-open trial is always settled.
+            self.breaker.record_failure()
+            raise
+        finally:
+            request_duration.observe(time.perf_counter() - started, client=self.name, endpoint=endpoint, outcome=outcome)
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request('GET', url, endpoint, **kwargs)
+
+    def post(self, url, endpoint, **kwargs):
+        return self.request('POST', url, endpoint, **kwargs)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_http_client(name):
+    """Returns this process's shared client for the upstream called `name`."""
+    client = _clients.get(name)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = HttpClient(name)
+    return client
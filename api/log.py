@@ -0,0 +1,102 @@
+# In api/log.py
+
+import atexit
+import json
+import logging
+import queue
+import re
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Logging pieces referenced from settings.LOGGING. This module is imported
+# while Django configures logging, before the app registry is ready, so it
+# must not import models or anything that does.
+
+REDACTED = '[REDACTED]'
+
+# key=value, key: value and 'key': 'value' pairs whose value is a secret.
+_SECRET_PAIR = re.compile(
+    r'''(?P<key>["']?\b(?:password|passwd|secret|api_key|apikey|access_token|refresh_token|token|'''
+    r'''authorization|consumer_secret|passkey|otp|otp_code|pin)\b["']?\s*[:=]\s*)'''
+    r'''(?P<value>"[^"]*"|'[^']*'|[^\s,}&]+)''',
+    re.IGNORECASE,
+)
+_BEARER = re.compile(r'\b(Bearer|Basic)\s+[A-Za-z0-9\-._~+/]+=*', re.IGNORECASE)
+# One-time codes in message text, e.g. "verification code is 123456".
+_OTP_TEXT = re.compile(r'\b((?:code|otp)\b\D{0,20}?)\d{4,8}\b', re.IGNORECASE)
+
+SENSITIVE_KEYS = frozenset([
+    'password', 'passwd', 'secret', 'api_key', 'apikey', 'access_token', 'refresh_token', 'token',
+    'authorization', 'consumer_secret', 'passkey', 'otp', 'otp_code', 'pin',
+])
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def redact(text):
+    """Masks secrets, bearer credentials and one-time codes in `text`."""
+    text = _BEARER.sub(lambda match: f'{match.group(1)} {REDACTED}', text)
+    text = _SECRET_PAIR.sub(lambda match: match.group('key') + REDACTED, text)
+    return _OTP_TEXT.sub(lambda match: match.group(1) + REDACTED, text)
+
+
+class RedactSecretsFilter(logging.Filter):
+    """
+    Rewrites each record's message (with its arguments merged in) and its
+    `extra` fields so that no secret or OTP reaches a handler.
+    """
+
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = redact(message)
+        if redacted != message:
+            record.msg, record.args = redacted, None
+        for key in vars(record).keys() - _RECORD_ATTRIBUTES:
+            if key.lower() in SENSITIVE_KEYS:
+                setattr(record, key, REDACTED)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, `extra` fields and any traceback."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in vars(record).keys() - _RECORD_ATTRIBUTES:
+            entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class QueueingStreamHandler(QueueHandler):
+    """
+    Formats records on the calling thread and hands the finished lines to a
+    background thread that writes them to `stream` (stderr by default), so a
+    slow or blocked stream never holds up a request.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        self.listener = QueueListener(self.queue, logging.StreamHandler(stream))
+        self.listener.start()
+        self._listening = True
+        # Write out whatever is still queued when the process exits.
+        atexit.register(self.stop_listener)
+
+    def stop_listener(self):
+        if self._listening:
+            self._listening = False
+            self.listener.stop()
+
+    def close(self):
+        self.stop_listener()
+        super().close()
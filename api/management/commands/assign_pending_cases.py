@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.auto_assign import ASSIGN_BATCH_SIZE, assign_pending_cases
+
+
+class Command(BaseCommand):
+    help = "Assigns all unassigned open cases to active agents, most urgent first, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ASSIGN_BATCH_SIZE, help='Cases assigned per transaction.')
+
+    def handle(self, *args, **options):
+        assigned = 0
+        while True:
+            batch = assign_pending_cases(options['batch_size'])
+            if not batch:
+                break
+            assigned += batch
+        self.stdout.write(self.style.SUCCESS(f"Assigned {assigned} case(s)."))
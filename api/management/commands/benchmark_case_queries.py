@@ -0,0 +1,108 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User as AuthUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.auto_assign import rebuild_open_case_counters
+from api.models import Agent, Case, CaseHistory, User
+
+
+class Command(BaseCommand):
+    help = (
+        "Shows query plans and latencies for the case dashboard's hot queries. "
+        "To compare before/after the indexes, run it once after "
+        "'migrate api 0016' and again after 'migrate api'. "
+        "Use --seed on a scratch database to create synthetic cases first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Create this many synthetic cases before measuring.')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query.')
+        parser.add_argument('--no-explain', action='store_true', help='Only print latencies.')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self._seed(options['seed'])
+
+        sample = Case.objects.exclude(agent__isnull=True).exclude(checkout_request_id__isnull=True).order_by('-case_id').first() \
+            or Case.objects.order_by('-case_id').first()
+        if sample is None:
+            self.stderr.write("No cases to benchmark; use --seed.")
+            return
+
+        queries = [
+            ("staff case list", lambda: Case.objects.order_by('-created_at')[:50]),
+            ("patient case list", lambda: Case.objects.filter(user_id=sample.user_id).order_by('-created_at')[:50]),
+            ("agent dashboard", lambda: Case.objects.filter(agent_id=sample.agent_id, status=sample.status).order_by('-created_at')[:50]),
+            ("callback lookup", lambda: Case.objects.filter(checkout_request_id=sample.checkout_request_id)[:1]),
+            ("case timeline", lambda: CaseHistory.objects.filter(case_id=sample.case_id)[:50]),
+        ]
+
+        self.stdout.write(f"{Case.objects.count()} case(s) on {connection.vendor}.\n")
+        for label, build in queries:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(build())
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+            self.stdout.write(
+                f"  median {statistics.median(timings):.2f} ms, "
+                f"p95 {sorted(timings)[int(len(timings) * 0.95) - 1]:.2f} ms, "
+                f"max {max(timings):.2f} ms"
+            )
+            if not options['no_explain']:
+                for line in build().explain().splitlines():
+                    self.stdout.write(f"    {line}")
+
+    def _seed(self, total, batch_size=10000):
+        """Creates `total` cases spread over synthetic patients and agents."""
+        run = timezone.now().strftime('%Y%m%d%H%M%S')
+        statuses = [choice for choice, _ in Case.CaseStatus.choices]
+        with transaction.atomic():
+            User.objects.bulk_create(
+                [User(phone_number=f"bench{run}{i:06d}") for i in range(max(1, total // 20))]
+            )
+            users = list(User.objects.filter(phone_number__startswith=f"bench{run}"))
+            agents = []
+            for i in range(max(1, total // 2000)):
+                auth_user = AuthUser.objects.create(username=f"bench{run}agent{i}", is_active=True)
+                agents.append(Agent.objects.create(user=auth_user, full_name=f"Bench Agent {i}"))
+
+        start = timezone.now() - timedelta(days=365)
+        created_at_field = Case._meta.get_field('created_at')
+        created = 0
+        # Spread creation dates over a year; auto_now_add would stamp them all "now".
+        created_at_field.auto_now_add = False
+        try:
+            while created < total:
+                count = min(batch_size, total - created)
+                cases = [
+                    Case(
+                        user=random.choice(users),
+                        agent=random.choice(agents) if random.random() < 0.8 else None,
+                        symptom_input="benchmark case",
+                        status=random.choice(statuses),
+                        checkout_request_id=f"ws_CO_{run}_{created + i}" if random.random() < 0.3 else None,
+                        created_at=start + timedelta(seconds=(created + i) * 30),
+                    )
+                    for i in range(count)
+                ]
+                with transaction.atomic():
+                    Case.objects.bulk_create(cases)
+                    # MySQL does not return the new ids from bulk_create.
+                    case_ids = Case.objects.order_by('-case_id').values_list('case_id', flat=True)[:count]
+                    CaseHistory.objects.bulk_create(
+                        [CaseHistory(case_id=case_id, description="Benchmark event.") for case_id in case_ids]
+                    )
+                created += count
+                self.stdout.write(f"Seeded {created}/{total} case(s).")
+        finally:
+            created_at_field.auto_now_add = True
+        # bulk_create skips the workload signal.
+        rebuild_open_case_counters()
@@ -0,0 +1,53 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.models import Case, User
+from api.serializers import CaseListValues, CaseSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares CaseSerializer with the .values()-based CaseListValues on the "
+        "same rows. Missing rows are created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of cases to render.')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per implementation.')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with transaction.atomic():
+            missing = rows - Case.objects.count()
+            if missing > 0:
+                user = User.objects.create(phone_number='benchmark-serializers')
+                Case.objects.bulk_create(
+                    [Case(user=user, symptom_input=f"benchmark case {i}", ai_urgency='Low') for i in range(missing)]
+                )
+            queryset = Case.objects.order_by('-created_at', '-case_id')[:rows]
+
+            def serializer():
+                return CaseSerializer(CaseSerializer.setup_eager_loading(queryset), many=True).data
+
+            def values():
+                return CaseListValues.to_representation(CaseListValues.values(queryset))
+
+            if list(map(dict, serializer())) != values():
+                raise CommandError("CaseListValues output differs from CaseSerializer.")
+
+            results = {}
+            for label, render in (("CaseSerializer", serializer), ("CaseListValues", values)):
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    render()
+                    timings.append(time.perf_counter() - started)
+                results[label] = statistics.median(timings)
+                self.stdout.write(f"{label:<15} median {results[label] * 1000:.1f} ms for {rows} rows")
+            transaction.set_rollback(True)
+
+        speedup = results["CaseSerializer"] / results["CaseListValues"]
+        self.stdout.write(self.style.SUCCESS(f"Outputs match; CaseListValues is {speedup:.1f}x faster."))
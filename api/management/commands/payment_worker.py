@@ -0,0 +1,42 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.payment_queue import claim_payment_attempts, process_callbacks, send_payment_attempts
+
+
+class Command(BaseCommand):
+    help = (
+        "Applies stored Daraja callbacks and sends queued M-Pesa STK pushes, "
+        "in batches, using a thread pool for the pushes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20, help='Attempts claimed per batch.')
+        parser.add_argument('--callback-batch-size', type=int, default=200, help='Callbacks applied per batch.')
+        parser.add_argument('--workers', type=int, default=4, help='Threads used to call Daraja.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"Payment worker started ({options['workers']} threads, batch size {batch_size}).")
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                # Callbacks first: they settle payments patients already made.
+                started = time.monotonic()
+                callbacks = process_callbacks(options['callback_batch_size'])
+                if callbacks:
+                    self.stdout.write(f"Applied {callbacks} Daraja callback(s) in {time.monotonic() - started:.2f}s.")
+                attempts = claim_payment_attempts(batch_size)
+                if attempts:
+                    started = time.monotonic()
+                    sent = send_payment_attempts(attempts, executor)
+                    self.stdout.write(f"Sent {sent}/{len(attempts)} STK push(es) in {time.monotonic() - started:.2f}s.")
+                if callbacks or attempts:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS("Payment queues drained."))
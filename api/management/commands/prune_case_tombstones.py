@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.case_changes import TOMBSTONE_RETENTION
+from api.models import CaseTombstone
+
+
+class Command(BaseCommand):
+    help = "Deletes case tombstones older than CASE_TOMBSTONE_RETENTION_DAYS; run it daily."
+
+    def handle(self, *args, **options):
+        deleted, _ = CaseTombstone.objects.filter(created_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} tombstone(s)."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.auto_assign import rebuild_open_case_counters
+
+
+class Command(BaseCommand):
+    help = "Rebuilds every agent's open_cases counter from the cases table."
+
+    def handle(self, *args, **options):
+        changed = rebuild_open_case_counters()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt workload counters; {changed} agent(s) corrected."))
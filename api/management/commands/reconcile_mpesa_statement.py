@@ -0,0 +1,221 @@
+import csv
+import re
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.models import Case, CaseHistory, Payment, PaymentAttempt
+
+ACCOUNT_REFERENCE = re.compile(r'^\s*AFYLNK(\d+)\s*$', re.IGNORECASE)
+STATEMENT_TIME_FORMATS = ('%d-%m-%Y %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y%m%d%H%M%S')
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks Payment rows and case statuses against an M-Pesa statement CSV "
+        "export. The file is streamed in chunks, so memory stays flat however "
+        "long the statement is. Reports mismatches; --repair records settled "
+        "payments that are missing and marks their cases paid."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help='Path to the statement CSV export.')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Statement rows checked per batch of queries.')
+        parser.add_argument('--repair', action='store_true', help='Create missing payments and mark their cases paid.')
+        parser.add_argument('--skip-rows', type=int, default=0, help='Lines before the header row (statement preamble).')
+        parser.add_argument('--receipt-column', default='Receipt No.')
+        parser.add_argument('--account-column', default='A/C No.')
+        parser.add_argument('--amount-column', default='Paid In')
+        parser.add_argument('--time-column', default='Completion Time')
+        parser.add_argument('--status-column', default='Transaction Status')
+        parser.add_argument('--examples', type=int, default=20, help='Mismatches printed per kind.')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.counts = {}
+        self.examples = {}
+        self.statement_window = [None, None]
+        # Receipts in the statement that match a Payment row. Bounded by the
+        # number of payments we hold, not by the statement's length.
+        self.matched_receipts = set()
+        started = time.monotonic()
+
+        try:
+            statement = open(options['statement'], newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f"Cannot read statement: {e}")
+        with statement:
+            for _ in range(options['skip_rows']):
+                next(statement, None)
+            reader = csv.DictReader(statement)
+            required = {options[key] for key in ('receipt_column', 'account_column', 'amount_column', 'time_column')}
+            missing = required - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Statement has no column(s) {', '.join(sorted(missing))}; found {reader.fieldnames}.")
+            rows_read = 0
+            while True:
+                chunk = list(islice(reader, options['chunk_size']))
+                if not chunk:
+                    break
+                rows_read += len(chunk)
+                self._reconcile_chunk(chunk)
+                self.stdout.write(f"{rows_read} statement row(s) checked.")
+
+        self._find_payments_missing_from_statement()
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.MIGRATE_HEADING(f"Reconciled {rows_read} row(s) in {elapsed:.1f}s."))
+        for kind, count in sorted(self.counts.items()):
+            self.stdout.write(f"  {kind}: {count}")
+            for example in self.examples.get(kind, ()):
+                self.stdout.write(f"    {example}")
+        if not self.counts:
+            self.stdout.write(self.style.SUCCESS("No mismatches."))
+
+    def _record(self, kind, example):
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.options['examples']:
+            examples.append(example)
+
+    def _parse_row(self, row):
+        """Returns (receipt, case_id, amount, completed_at) for a settled AfyaLink payment, else None."""
+        options = self.options
+        status = (row.get(options['status_column']) or 'Completed').strip()
+        match = ACCOUNT_REFERENCE.match(row.get(options['account_column']) or '')
+        if status.lower() != 'completed' or not match:
+            return None
+        receipt = (row.get(options['receipt_column']) or '').strip()
+        try:
+            amount = Decimal((row.get(options['amount_column']) or '').replace(',', '').strip())
+        except InvalidOperation:
+            self._record('unreadable_rows', receipt or row)
+            return None
+        completed_at = self._parse_time(row.get(options['time_column']) or '')
+        if not receipt or amount <= 0 or completed_at is None:
+            self._record('unreadable_rows', receipt or row)
+            return None
+        return receipt, int(match.group(1)), amount, completed_at
+
+    @staticmethod
+    def _parse_time(value):
+        value = value.strip()
+        parsed = parse_datetime(value)
+        if parsed is None:
+            for time_format in STATEMENT_TIME_FORMATS:
+                try:
+                    parsed = datetime.strptime(value, time_format)
+                    break
+                except ValueError:
+                    continue
+        if parsed is not None and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def _widen_window(self, moments):
+        earliest, latest = self.statement_window
+        for moment in moments:
+            if moment is not None:
+                earliest = moment if earliest is None else min(earliest, moment)
+                latest = moment if latest is None else max(latest, moment)
+        self.statement_window = [earliest, latest]
+
+    def _reconcile_chunk(self, chunk):
+        entries = {}
+        for row in chunk:
+            parsed = self._parse_row(row)
+            if parsed is not None:
+                entries[parsed[0]] = parsed
+        # Statements are in time order (either way round), so a chunk's first
+        # and last rows bound the period it covers.
+        time_column = self.options['time_column']
+        self._widen_window(self._parse_time(row.get(time_column) or '') for row in (chunk[0], chunk[-1]))
+        self._widen_window(completed_at for _, _, _, completed_at in entries.values())
+        if not entries:
+            return
+
+        # Two indexed lookups per chunk: by receipt (unique) and by case id.
+        payments = {
+            receipt: (case_id, amount)
+            for receipt, case_id, amount in Payment.objects.filter(mpesa_receipt_number__in=list(entries))
+            .values_list('mpesa_receipt_number', 'case_id', 'amount')
+        }
+        case_statuses = dict(
+            Case.objects.filter(case_id__in={case_id for _, case_id, _, _ in entries.values()})
+            .values_list('case_id', 'status')
+        )
+
+        to_create, to_mark_paid = [], set()
+        for receipt, case_id, amount, completed_at in entries.values():
+            if case_id not in case_statuses:
+                self._record('unknown_case', f"{receipt}: AFYLNK{case_id} has no case")
+                continue
+            payment = payments.get(receipt)
+            if payment is None:
+                self._record('missing_payment', f"{receipt}: {amount} for case {case_id} settled but not recorded")
+                to_create.append(Payment(case_id=case_id, amount=amount, mpesa_receipt_number=receipt, transaction_date=completed_at))
+            else:
+                self.matched_receipts.add(receipt)
+                if payment[0] != case_id:
+                    self._record('case_mismatch', f"{receipt}: statement says case {case_id}, Payment says case {payment[0]}")
+                    continue
+                if payment[1] != amount:
+                    self._record('amount_mismatch', f"{receipt}: statement {amount}, Payment {payment[1]}")
+            if case_statuses[case_id] == Case.CaseStatus.PAYMENT_PENDING:
+                self._record('case_not_marked_paid', f"case {case_id} is still payment_pending ({receipt})")
+                to_mark_paid.add(case_id)
+
+        if self.options['repair'] and (to_create or to_mark_paid):
+            self._repair(to_create, to_mark_paid)
+
+    def _repair(self, to_create, to_mark_paid):
+        now = timezone.now()
+        with transaction.atomic():
+            # A Daraja callback may have recorded some of these since the chunk
+            # was read. ignore_conflicts skips those rows, so only what is
+            # absent now is inserted and counted, by re-reading the receipts.
+            receipts = {payment.mpesa_receipt_number for payment in to_create}
+            receipts -= set(
+                Payment.objects.filter(mpesa_receipt_number__in=receipts).values_list('mpesa_receipt_number', flat=True)
+            )
+            Payment.objects.bulk_create(
+                [payment for payment in to_create if payment.mpesa_receipt_number in receipts], ignore_conflicts=True
+            )
+            created = Payment.objects.filter(mpesa_receipt_number__in=receipts).count() if receipts else 0
+            self.matched_receipts.update(payment.mpesa_receipt_number for payment in to_create)
+            # Neither status counts towards agent workload, so the counters
+            # need no adjustment for this bulk update.
+            paid = list(
+                Case.objects.select_for_update()
+                .filter(case_id__in=to_mark_paid, status=Case.CaseStatus.PAYMENT_PENDING)
+                .values_list('case_id', flat=True)
+            )
+            Case.objects.filter(case_id__in=paid).update(status=Case.CaseStatus.PAID, updated_at=now)
+            CaseHistory.objects.bulk_create(
+                [CaseHistory(case_id=case_id, description="Payment confirmed by statement reconciliation.") for case_id in paid]
+            )
+            PaymentAttempt.objects.filter(case_id__in=paid, status=PaymentAttempt.AttemptStatus.SENT).update(
+                status=PaymentAttempt.AttemptStatus.CONFIRMED, finished_at=now
+            )
+        self.counts['repaired_payments'] = self.counts.get('repaired_payments', 0) + created
+        self.counts['repaired_cases'] = self.counts.get('repaired_cases', 0) + len(paid)
+
+    def _find_payments_missing_from_statement(self):
+        """Payments dated inside the statement's time span that it does not list."""
+        earliest, latest = self.statement_window
+        if earliest is None:
+            return
+        payments = (
+            Payment.objects.filter(transaction_date__range=(earliest, latest))
+            .values_list('mpesa_receipt_number', 'case_id', 'amount')
+            .iterator(chunk_size=self.options['chunk_size'])
+        )
+        for receipt, case_id, amount in payments:
+            if receipt not in self.matched_receipts:
+                self._record('payment_not_in_statement', f"{receipt}: {amount} for case {case_id}")
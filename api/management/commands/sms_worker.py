@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.sms import RateLimiter, claim_sms, get_sms_transport, send_sms_batch
+
+
+class Command(BaseCommand):
+    help = "Sends queued SMS in bulk gateway calls, at most SMS_SEND_RATE messages per second."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages claimed per batch.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when nothing is due.')
+        parser.add_argument('--once', action='store_true', help='Send everything due once and exit.')
+
+    def handle(self, *args, **options):
+        transport = get_sms_transport()
+        rate = getattr(settings, 'SMS_SEND_RATE', 10)
+        rate_limiter = RateLimiter(rate)
+        self.stdout.write(f"SMS worker started ({type(transport).__name__}, {rate} message(s)/s).")
+        while True:
+            messages = claim_sms(options['batch_size'])
+            if messages:
+                started = time.monotonic()
+                sent = send_sms_batch(messages, transport, rate_limiter)
+                self.stdout.write(f"Sent {sent}/{len(messages)} SMS in {time.monotonic() - started:.2f}s.")
+                continue
+            if options['once']:
+                break
+            time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS("SMS queue drained."))
@@ -0,0 +1,94 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.ai_service import triage_many
+from api.models import Case
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills in ai_urgency/ai_category/ai_summary for cases that have none, "
+        "triaging chunks on a process pool. Resumable with --after-case-id."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Cases read, triaged and written per chunk.')
+        parser.add_argument('--workers', type=int, default=None, help='Triage processes (default: CPU count).')
+        parser.add_argument('--after-case-id', type=int, default=0, help='Resume after this case_id watermark.')
+        parser.add_argument('--dry-run', action='store_true', help='Triage but do not write anything.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        self.dry_run = options['dry_run']
+        self.watermark = options['after_case_id']
+        self.processed = 0
+        self.started = time.monotonic()
+
+        workers = options['workers'] or os.cpu_count() or 1
+        # Keep a couple of chunks per process in flight so memory stays bounded
+        # no matter how large the table is.
+        max_in_flight = 2 * workers
+
+        # The pool forks; don't hand the children an open database connection.
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            in_flight = deque()
+            for chunk in self._chunks(chunk_size):
+                texts = [symptom_input or '' for _, symptom_input in chunk]
+                in_flight.append((chunk, executor.submit(triage_many, texts)))
+                if len(in_flight) >= max_in_flight:
+                    self._write(*in_flight.popleft())
+            while in_flight:
+                self._write(*in_flight.popleft())
+
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Backfilled {self.processed} case(s) in {elapsed:.1f}s ({rate:.0f}/s). Last case_id: {self.watermark}."
+        ))
+
+    def _chunks(self, chunk_size):
+        """
+        Yields (case_id, symptom_input) chunks in case_id order. Each chunk is a
+        keyset query, since MySQL cannot stream one large result set.
+        """
+        needs_triage = Q(ai_urgency__isnull=True) | Q(ai_category__isnull=True) | Q(ai_summary__isnull=True)
+        last_case_id = self.watermark
+        while True:
+            chunk = list(
+                Case.objects.filter(needs_triage, case_id__gt=last_case_id)
+                .order_by('case_id')
+                .values_list('case_id', 'symptom_input')[:chunk_size]
+            )
+            if not chunk:
+                return
+            last_case_id = chunk[-1][0]
+            yield chunk
+
+    def _write(self, chunk, future):
+        results = future.result()
+        # bulk_update skips auto_now; without updated_at the change feed would
+        # never hand these cases to dashboards.
+        now = timezone.now()
+        cases = [
+            Case(case_id=case_id, ai_urgency=result['ai_urgency'], ai_category=result['ai_category'],
+                 ai_summary=result['ai_summary'], updated_at=now)
+            for (case_id, _), result in zip(chunk, results)
+        ]
+        if not self.dry_run:
+            with transaction.atomic():
+                Case.objects.bulk_update(cases, ['ai_urgency', 'ai_category', 'ai_summary', 'updated_at'])
+
+        # Chunks are written in order, so everything up to here is done.
+        self.watermark = chunk[-1][0]
+        self.processed += len(cases)
+        elapsed = time.monotonic() - self.started
+        rate = self.processed / elapsed if elapsed else 0
+        self.stdout.write(f"{self.processed} case(s) backfilled, {rate:.0f}/s, watermark case_id={self.watermark}")
@@ -0,0 +1,37 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.auto_assign import assign_pending_cases
+from api.triage_queue import claim_triage_jobs, process_triage_jobs
+
+
+class Command(BaseCommand):
+    help = "Processes queued AI triage jobs in batches using a thread pool, then assigns any queued cases."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Jobs claimed per batch.')
+        parser.add_argument('--workers', type=int, default=4, help='Threads used to run triage.')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"Triage worker started ({options['workers']} threads, batch size {batch_size}).")
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            while True:
+                jobs = claim_triage_jobs(batch_size)
+                if jobs:
+                    started = time.monotonic()
+                    triaged = process_triage_jobs(jobs, executor)
+                    self.stdout.write(f"Triaged {triaged}/{len(jobs)} case(s) in {time.monotonic() - started:.2f}s.")
+                    continue
+                # While idle, hand out cases that queued up with no agent
+                # available (e.g. until an agent was approved).
+                while assign_pending_cases(batch_size):
+                    pass
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        self.stdout.write(self.style.SUCCESS("Triage queue drained."))
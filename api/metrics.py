@@ -0,0 +1,185 @@
+# In api/metrics.py
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import nullcontext
+
+# Metrics are kept in memory per process and exposed in the Prometheus text
+# format by MetricsView; with several workers, scrape each one.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """A labelled latency histogram with fixed bucket bounds, in seconds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # One count per bucket plus +Inf, then the running sum.
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield f'{self.name}_bucket', {**labels, 'le': _format_bound(bound)}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, cumulative
+
+
+class Counter:
+    """A labelled monotonically increasing count."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[label]) for label in self.labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            yield f'{self.name}_total', dict(zip(self.labels, key)), value
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _register(metric_class, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = metric_class(name, *args, **kwargs)
+        return metric
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    """Returns the process-wide histogram called `name`, creating it on first use."""
+    return _register(Histogram, name, documentation, labels=labels, buckets=buckets)
+
+
+def counter(name, documentation, labels=()):
+    """Returns the process-wide counter called `name`, creating it on first use."""
+    return _register(Counter, name, documentation, labels=labels)
+
+
+def render_metrics():
+    """Every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = sorted(_registry.values(), key=lambda metric: metric.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for sample_name, labels, value in metric.samples():
+            label_text = ','.join(f'{key}="{_escape(value_)}"' for key, value_ in labels.items())
+            lines.append(f'{sample_name}{{{label_text}}} {value}' if label_text else f'{sample_name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+# --- Per-request timings ---
+# RequestMetricsMiddleware starts a RequestTimings for each sampled request.
+# Code doing measurable work (serializers, outbound HTTP) reports into it with
+# timed(); outside a sampled request that is a single context variable lookup.
+
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_NOT_TIMED = nullcontext()
+
+
+class RequestTimings:
+    """Time spent per phase ('db', 'serialize', 'upstream.<client>') during one request."""
+
+    __slots__ = ('db_queries', 'phases', 'active')
+
+    def __init__(self):
+        self.db_queries = 0
+        self.phases = {}
+        self.active = set()
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """For connection.execute_wrapper(): counts queries and their time."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.add('db', time.perf_counter() - started)
+
+
+class _PhaseTimer:
+    __slots__ = ('timings', 'phase', 'started')
+
+    def __init__(self, timings, phase):
+        self.timings = timings
+        self.phase = phase
+
+    def __enter__(self):
+        self.timings.active.add(self.phase)
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.phase, time.perf_counter() - self.started)
+        self.timings.active.discard(self.phase)
+
+
+def start_request_timings():
+    """Starts collecting timings for the current request; returns (timings, reset token)."""
+    timings = RequestTimings()
+    return timings, _request_timings.set(timings)
+
+
+def stop_request_timings(token):
+    _request_timings.reset(token)
+
+
+def timed(phase):
+    """
+    Context manager adding the time spent inside it to `phase` of the current
+    request. Nested use of the same phase is counted once, by the outermost.
+    """
+    timings = _request_timings.get()
+    if timings is None or phase in timings.active:
+        return _NOT_TIMED
+    return _PhaseTimer(timings, phase)
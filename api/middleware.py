@@ -0,0 +1,104 @@
+# In api/middleware.py
+
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .metrics import histogram, start_request_timings, stop_request_timings
+
+request_duration = histogram(
+    'http_request_duration_seconds',
+    'Wall time to produce a response, by URL name.',
+    labels=('view', 'method', 'status'),
+)
+request_phase_duration = histogram(
+    'http_request_phase_duration_seconds',
+    'Time spent per request in the database, serializers and upstream calls, by URL name.',
+    labels=('view', 'phase'),
+)
+request_db_queries = histogram(
+    'http_request_db_queries',
+    'Database queries per request, by URL name.',
+    labels=('view',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records wall time, database queries and time, serializer time and
+    upstream (Daraja, Africa's Talking) time for a sample of requests, per
+    URL name, into the histograms served by MetricsView. With
+    REQUEST_METRICS_SERVER_TIMING the same figures go back to the client in
+    a Server-Timing header.
+
+    REQUEST_METRICS_SAMPLE_RATE is the fraction of requests measured; at 0
+    the middleware removes itself. Database figures are collected for sync
+    views only: async views run their queries on other threads' connections.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0)
+        self.server_timing = getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', False)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed()
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._sampled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        timings, token = start_request_timings()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            stop_request_timings(token)
+        return self._record(request, response, timings, time.perf_counter() - started, with_db=True)
+
+    async def __acall__(self, request):
+        if not self._sampled():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        timings, token = start_request_timings()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_request_timings(token)
+        return self._record(request, response, timings, time.perf_counter() - started, with_db=False)
+
+    def _record(self, request, response, timings, elapsed, with_db):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.route) if match else 'unmatched'
+        request_duration.observe(elapsed, view=view, method=request.method, status=response.status_code)
+        if with_db:
+            request_db_queries.observe(timings.db_queries, view=view)
+        for phase, seconds in timings.phases.items():
+            request_phase_duration.observe(seconds, view=view, phase=phase)
+
+        if self.server_timing:
+            entries = [f'total;dur={elapsed * 1000:.1f}']
+            for phase, seconds in sorted(timings.phases.items()):
+                entry = f'{phase.replace(".", "-")};dur={seconds * 1000:.1f}'
+                if phase == 'db':
+                    entry += f';desc="{timings.db_queries} queries"'
+                entries.append(entry)
+            response['Server-Timing'] = ', '.join(entries)
+        return response
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_alter_case_status_casehistory_payment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UssdMenuNode',
+            fields=[
+                ('node_id', models.AutoField(primary_key=True, serialize=False)),
+                ('choice', models.CharField(blank=True, help_text='Input that selects this node from its parent, or "*" for free text', max_length=20)),
+                ('menu_key', models.CharField(help_text='The UssdMenuText key shown when this node is reached', max_length=50)),
+                ('action', models.CharField(blank=True, choices=[('', 'None'), ('set_language', 'Set language'), ('set_declaration', 'Set payment declaration'), ('create_case', 'Create case')], default='', max_length=20)),
+                ('action_value', models.CharField(blank=True, help_text='e.g., "sw" for set_language, "small_fee" for set_declaration', max_length=50)),
+                ('menu_language', models.CharField(blank=True, help_text='Always show this screen in one language, e.g., "en" for the welcome menu', max_length=5)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='api.ussdmenunode')),
+            ],
+            options={
+                'unique_together': {('parent', 'choice')},
+            },
+        ),
+    ]
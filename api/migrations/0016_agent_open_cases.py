@@ -0,0 +1,42 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+OPEN_STATUSES = ['new', 'assigned_to_agent', 'agent_viewed', 'needs_follow_up']
+
+
+def populate_open_cases(apps, schema_editor):
+    """Seeds the new counter from the existing cases."""
+    Agent = apps.get_model('api', 'Agent')
+    Case = apps.get_model('api', 'Case')
+    counts = (
+        Case.objects.filter(agent__isnull=False, status__in=OPEN_STATUSES)
+        .values_list('agent')
+        .annotate(total=Count('case_id'))
+        .order_by()
+    )
+    for agent_id, total in counts:
+        Agent.objects.filter(pk=agent_id).update(open_cases=total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_triagejob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='open_cases',
+            field=models.PositiveIntegerField(default=0, help_text='Number of open cases assigned; maintained by signals'),
+        ),
+        migrations.AddIndex(
+            model_name='agent',
+            index=models.Index(fields=['open_cases', 'created_at'], name='agent_workload_idx'),
+        ),
+        migrations.RunPython(populate_open_cases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_agent_open_cases'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='case',
+            name='checkout_request_id',
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['agent', 'status', '-created_at'], name='case_agent_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['user', '-created_at'], name='case_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['-created_at'], name='case_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='casehistory',
+            index=models.Index(fields=['case', '-timestamp'], name='casehistory_case_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_case_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CaseTombstone',
+            fields=[
+                ('tombstone_id', models.AutoField(primary_key=True, serialize=False)),
+                ('case_id', models.IntegerField()),
+                ('user_id', models.IntegerField(blank=True, null=True)),
+                ('agent_id', models.IntegerField(blank=True, help_text='The agent the case was taken from', null=True)),
+                ('reason', models.CharField(choices=[('deleted', 'Deleted'), ('reassigned', 'Reassigned')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='case',
+            index=models.Index(fields=['updated_at', 'case_id'], name='case_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='casetombstone',
+            index=models.Index(fields=['created_at'], name='casetombstone_created_idx'),
+        ),
+    ]
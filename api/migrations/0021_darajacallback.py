@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-17 17:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_paymentattempt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DarajaCallback',
+            fields=[
+                ('callback_id', models.AutoField(primary_key=True, serialize=False)),
+                ('checkout_request_id', models.CharField(blank=True, db_index=True, max_length=100, null=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('duplicate', 'Duplicate'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'callback_id'], name='darajacallback_status_idx')],
+            },
+        ),
+    ]
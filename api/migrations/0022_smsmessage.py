@@ -0,0 +1,34 @@
+# Generated by Django 5.1.3 on 2026-10-17 18:00
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_darajacallback'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SmsMessage',
+            fields=[
+                ('message_id', models.AutoField(primary_key=True, serialize=False)),
+                ('phone_number', models.CharField(max_length=20)),
+                ('body', models.CharField(max_length=480)),
+                ('kind', models.CharField(choices=[('otp', 'Login code'), ('case_assigned', 'Case assigned'), ('payment_reminder', 'Payment reminder'), ('other', 'Other')], default='other', max_length=20)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('provider_message_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('provider_status', models.CharField(blank=True, help_text="The gateway's status for this recipient", max_length=50, null=True)),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Not sent before this time; pushed back after a transient failure')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'send_after'], name='smsmessage_status_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.3 on 2026-10-17 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_smsmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OtpCode',
+            fields=[
+                ('phone_number', models.CharField(max_length=20, primary_key=True, serialize=False)),
+                ('code_hash', models.CharField(max_length=64)),
+                ('expires_at', models.DateTimeField()),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('requests', models.PositiveSmallIntegerField(default=0, help_text='Codes requested in the current window')),
+                ('window_started_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='user',
+            name='otp_expiry',
+        ),
+    ]
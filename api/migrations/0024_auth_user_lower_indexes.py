@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+# auth_user belongs to django.contrib.auth, so these indexes cannot be declared
+# in a model's Meta and are added to the table directly. They serve lookups of
+# the form WHERE LOWER(username) = ... (see api/account_lookup.py). Backends
+# without expression indexes (MariaDB, MySQL before 8.0.13) skip them.
+INDEXES = [
+    models.Index(Lower('username'), name='auth_user_username_lower_idx'),
+    models.Index(Lower('email'), name='auth_user_email_lower_idx'),
+]
+
+
+def add_indexes(apps, schema_editor):
+    AuthUser = apps.get_model('auth', 'User')
+    for index in INDEXES:
+        schema_editor.add_index(AuthUser, index)
+
+
+def remove_indexes(apps, schema_editor):
+    AuthUser = apps.get_model('auth', 'User')
+    for index in INDEXES:
+        schema_editor.remove_index(AuthUser, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_otp_store'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
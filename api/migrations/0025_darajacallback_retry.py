@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-17 18:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_auth_user_lower_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='darajacallback',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='darajacallback',
+            name='process_after',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='Not applied before this time; pushed back while its payment attempt is unknown'),
+        ),
+    ]
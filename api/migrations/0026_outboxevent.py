@@ -0,0 +1,24 @@
+# Generated by Django 5.1.3 on 2026-10-17 18:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_darajacallback_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('event_id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_type', models.CharField(max_length=32)),
+                ('data', models.JSONField()),
+                ('channels', models.JSONField(help_text='Channel names the event is sent to')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
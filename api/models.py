@@ -31,8 +31,6 @@ class User(models.Model):
     phone_number = models.CharField(max_length=20, unique=True, help_text='User phone number, primary identifier from USSD')
     default_language = models.ForeignKey(Language, on_delete=models.SET_NULL, null=True, blank=True)
     payment_declaration = models.ForeignKey(PaymentDeclaration, on_delete=models.SET_NULL, null=True, blank=True)
-    otp = models.CharField(max_length=6, null=True, blank=True)
-    otp_expiry = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -46,9 +44,15 @@ class Agent(models.Model):
     user = models.OneToOneField(AuthUser, on_delete=models.CASCADE, primary_key=True, related_name='agent')
     full_name = models.CharField(max_length=100)
     phone_number = models.CharField(max_length=20, unique=True, null=True, blank=True)
+    open_cases = models.PositiveIntegerField(default=0, help_text='Number of open cases assigned; maintained by signals')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['open_cases', 'created_at'], name='agent_workload_idx'),
+        ]
+
     def __str__(self):
         return self.full_name
 
@@ -85,16 +89,51 @@ class Case(models.Model):
         default=CaseStatus.NEW
     )
     agent_notes = models.TextField(blank=True, null=True, help_text='Notes added by the agent via dashboard')
-    checkout_request_id = models.CharField(max_length=100, blank=True, null=True)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
     ai_summary = models.TextField(blank=True, null=True, help_text='AI-generated summary of symptoms')
     ai_urgency = models.CharField(max_length=20, blank=True, null=True, help_text='AI-assigned urgency label')
     ai_category = models.CharField(max_length=50, blank=True, null=True, help_text='AI-assigned health category')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Agent dashboard: an agent's cases by status, newest first
+            models.Index(fields=['agent', 'status', '-created_at'], name='case_agent_status_created_idx'),
+            # Patient dashboard: a user's cases, newest first
+            models.Index(fields=['user', '-created_at'], name='case_user_created_idx'),
+            # Staff case list, newest first
+            models.Index(fields=['-created_at'], name='case_created_idx'),
+            # Case list filters
+            models.Index(fields=['status', '-created_at'], name='case_status_created_idx'),
+            models.Index(fields=['ai_urgency', '-created_at'], name='case_urgency_created_idx'),
+            # Change feed: cases touched since a watermark
+            models.Index(fields=['updated_at', 'case_id'], name='case_updated_idx'),
+        ]
+
     def __str__(self):
         return f"Case {self.case_id} for {self.user.phone_number}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this case contributed to its agent's open_cases, so
+        # the workload signal can adjust the counter when it is saved.
+        if 'agent_id' in instance.__dict__ and 'status' in instance.__dict__:
+            instance._loaded_workload = (instance.agent_id, instance.status in OPEN_CASE_STATUSES)
+            # ...and the status the live event stream compares against.
+            instance._loaded_status = instance.status
+        return instance
+
+
+# Statuses counted towards an agent's workload
+OPEN_CASE_STATUSES = frozenset([
+    Case.CaseStatus.NEW,
+    Case.CaseStatus.ASSIGNED,
+    Case.CaseStatus.VIEWED,
+    Case.CaseStatus.FOLLOW_UP,
+])
+
 # --- NEW MODELS FOR DASHBOARD FEATURES ---
 
 class Payment(models.Model):
@@ -111,6 +150,32 @@ class Payment(models.Model):
     def __str__(self):
         return f"Payment {self.mpesa_receipt_number} for Case {self.case.case_id}"
 
+class CaseTombstone(models.Model):
+    """
+    Records a case leaving a dashboard, either because it was deleted or
+    because it moved to another agent, so the change feed can report it.
+    """
+
+    class Reason(models.TextChoices):
+        DELETED = 'deleted', 'Deleted'
+        REASSIGNED = 'reassigned', 'Reassigned'
+
+    tombstone_id = models.AutoField(primary_key=True)
+    # Plain ids, not foreign keys: the case may no longer exist.
+    case_id = models.IntegerField()
+    user_id = models.IntegerField(null=True, blank=True)
+    agent_id = models.IntegerField(null=True, blank=True, help_text='The agent the case was taken from')
+    reason = models.CharField(max_length=10, choices=Reason.choices)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at'], name='casetombstone_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Case {self.case_id} {self.reason} at {self.created_at}"
+
 class CaseHistory(models.Model):
     """
     Creates a timestamped log of all significant actions taken on a case.
@@ -122,6 +187,9 @@ class CaseHistory(models.Model):
 
     class Meta:
         ordering = ['-timestamp'] # Show the most recent events first
+        indexes = [
+            models.Index(fields=['case', '-timestamp'], name='casehistory_case_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.case.case_id} at {self.timestamp}: {self.description}"
@@ -140,4 +208,199 @@ class UssdMenuText(models.Model):
         unique_together = ('menu_key', 'language')
 
     def __str__(self):
-        return f"{self.menu_key} ({self.language.language_code})"
\ No newline at end of file
+        return f"{self.menu_key} ({self.language.language_code})"
+
+class UssdMenuNode(models.Model):
+    """
+    One screen of the USSD menu graph. The graph is compiled into a dispatch
+    table keyed by path; when no rows exist the bundled fixture is used.
+    """
+
+    class Action(models.TextChoices):
+        NONE = '', 'None'
+        SET_LANGUAGE = 'set_language', 'Set language'
+        SET_DECLARATION = 'set_declaration', 'Set payment declaration'
+        CREATE_CASE = 'create_case', 'Create case'
+
+    node_id = models.AutoField(primary_key=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    choice = models.CharField(max_length=20, blank=True, help_text='Input that selects this node from its parent, or "*" for free text')
+    menu_key = models.CharField(max_length=50, help_text='The UssdMenuText key shown when this node is reached')
+    action = models.CharField(max_length=20, choices=Action.choices, blank=True, default=Action.NONE)
+    action_value = models.CharField(max_length=50, blank=True, help_text='e.g., "sw" for set_language, "small_fee" for set_declaration')
+    menu_language = models.CharField(max_length=5, blank=True, help_text='Always show this screen in one language, e.g., "en" for the welcome menu')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('parent', 'choice')
+
+    def __str__(self):
+        return f"{self.menu_key} ({self.choice or 'root'})"
+
+
+class TriageJob(models.Model):
+    """
+    A queued AI triage request for a case. Jobs are picked up in batches by
+    the `triage_worker` management command.
+    """
+
+    class JobStatus(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    job_id = models.AutoField(primary_key=True)
+    case = models.ForeignKey(Case, on_delete=models.CASCADE, related_name='triage_jobs')
+    status = models.CharField(max_length=10, choices=JobStatus.choices, default=JobStatus.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    enqueued_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'enqueued_at'], name='triagejob_status_enqueued_idx'),
+        ]
+
+    def __str__(self):
+        return f"Triage job {self.job_id} for Case {self.case_id} ({self.status})"
+
+
+class PaymentAttempt(models.Model):
+    """
+    One M-Pesa STK push requested for a case. The request returns at once;
+    the `payment_worker` management command sends the push, and the Daraja
+    callback marks the attempt confirmed or failed.
+    """
+
+    class AttemptStatus(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        SENDING = 'sending', 'Sending'
+        SENT = 'sent', 'Sent to phone'
+        FAILED = 'failed', 'Failed'
+        CONFIRMED = 'confirmed', 'Confirmed'
+
+    attempt_id = models.AutoField(primary_key=True)
+    case = models.ForeignKey(Case, on_delete=models.CASCADE, related_name='payment_attempts')
+    requested_by = models.ForeignKey(AuthUser, on_delete=models.SET_NULL, null=True, blank=True)
+    phone_number = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=10, choices=AttemptStatus.choices, default=AttemptStatus.PENDING)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, unique=True)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='paymentattempt_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Payment attempt {self.attempt_id} for Case {self.case_id} ({self.status})"
+
+
+class DarajaCallback(models.Model):
+    """
+    A raw STK push result as Safaricom posted it. The callback view only
+    inserts this row; the `payment_worker` command applies it to the case.
+    """
+
+    class CallbackStatus(models.TextChoices):
+        PENDING = 'pending', 'Pending'
+        DONE = 'done', 'Done'
+        DUPLICATE = 'duplicate', 'Duplicate'
+        FAILED = 'failed', 'Failed'
+
+    callback_id = models.AutoField(primary_key=True)
+    checkout_request_id = models.CharField(max_length=100, blank=True, null=True, db_index=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=CallbackStatus.choices, default=CallbackStatus.PENDING)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    process_after = models.DateTimeField(default=timezone.now, help_text='Not applied before this time; pushed back while its payment attempt is unknown')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'callback_id'], name='darajacallback_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Daraja callback {self.callback_id} for {self.checkout_request_id} ({self.status})"
+
+
+class SmsMessage(models.Model):
+    """
+    An outgoing SMS. Messages are queued here and sent in bulk by the
+    `sms_worker` management command, so no request waits on the SMS gateway.
+    """
+
+    class Kind(models.TextChoices):
+        OTP = 'otp', 'Login code'
+        CASE_ASSIGNED = 'case_assigned', 'Case assigned'
+        PAYMENT_REMINDER = 'payment_reminder', 'Payment reminder'
+        OTHER = 'other', 'Other'
+
+    class SmsStatus(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        SENDING = 'sending', 'Sending'
+        SENT = 'sent', 'Sent'
+        FAILED = 'failed', 'Failed'
+
+    message_id = models.AutoField(primary_key=True)
+    phone_number = models.CharField(max_length=20)
+    body = models.CharField(max_length=480)
+    kind = models.CharField(max_length=20, choices=Kind.choices, default=Kind.OTHER)
+    status = models.CharField(max_length=10, choices=SmsStatus.choices, default=SmsStatus.QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    provider_message_id = models.CharField(max_length=100, blank=True, null=True)
+    provider_status = models.CharField(max_length=50, blank=True, null=True, help_text="The gateway's status for this recipient")
+    send_after = models.DateTimeField(default=timezone.now, help_text='Not sent before this time; pushed back after a transient failure')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='smsmessage_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"SMS {self.message_id} to {self.phone_number} ({self.status})"
+
+
+class OtpCode(models.Model):
+    """
+    Fallback storage for login codes while the cache (the normal OTP store,
+    see api/otp.py) is unavailable. Only a hash of the code is kept.
+    """
+    phone_number = models.CharField(max_length=20, primary_key=True)
+    code_hash = models.CharField(max_length=64)
+    expires_at = models.DateTimeField()
+    attempts = models.PositiveSmallIntegerField(default=0)
+    requests = models.PositiveSmallIntegerField(default=0, help_text='Codes requested in the current window')
+    window_started_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"OTP for {self.phone_number} (expires {self.expires_at})"
+
+
+class OutboxEvent(models.Model):
+    """
+    A live event (see api/events.py) written by the process that caused it
+    and read by whichever process holds the subscriber's stream. Rows are
+    pruned after EVENTS_RETENTION seconds.
+    """
+    event_id = models.BigAutoField(primary_key=True)
+    event_type = models.CharField(max_length=32)
+    data = models.JSONField()
+    channels = models.JSONField(help_text='Channel names the event is sent to')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.event_type} event {self.event_id}"
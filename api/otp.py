@@ -0,0 +1,150 @@
+# In api/otp.py
+
+import logging
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import OtpCode
+from .shared_cache import has_atomic_counters
+
+logger = logging.getLogger(__name__)
+
+OTP_TTL = getattr(settings, 'OTP_TTL', 300)  # seconds a code stays valid
+MAX_ATTEMPTS = getattr(settings, 'OTP_MAX_ATTEMPTS', 5)  # wrong guesses before the code is burned
+MAX_REQUESTS = getattr(settings, 'OTP_MAX_REQUESTS', 3)  # codes per phone per window
+REQUEST_WINDOW = getattr(settings, 'OTP_REQUEST_WINDOW', 600)  # seconds
+
+_CODE_KEY = 'otp:code:'
+_ATTEMPTS_KEY = 'otp:attempts:'
+_REQUESTS_KEY = 'otp:requests:'
+
+
+class OtpThrottled(Exception):
+    """Too many codes requested for one phone number; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many codes requested; try again in {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class OtpLocked(Exception):
+    """Too many wrong codes entered; a new code has to be requested."""
+
+
+def _hash(phone_number, code):
+    return salted_hmac('api.otp', f'{phone_number}:{code}').hexdigest()
+
+
+def _cache():
+    """
+    The OTP cache, or None if it cannot hold codes safely. A code issued by
+    one worker must verify on any other, and the attempt and request limits
+    need atomic counters, so anything but Redis or Memcached (a per-process
+    LocMemCache, the database cache) sends codes to the OtpCode table.
+    """
+    cache = caches[getattr(settings, 'OTP_CACHE_ALIAS', 'shared')]
+    return cache if has_atomic_counters(cache) else None
+
+
+def _incr(cache, key, timeout):
+    """Atomically counts up `key`, starting a new count that lives `timeout` seconds."""
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired between add() and incr().
+        cache.add(key, 1, timeout)
+        return 1
+
+
+def issue_otp(phone_number):
+    """
+    Creates and stores a new login code for `phone_number` and returns it.
+    Raises OtpThrottled past MAX_REQUESTS codes per REQUEST_WINDOW. Any
+    earlier code for the number stops working.
+    """
+    code = f'{secrets.randbelow(1000000):06d}'
+    cache = _cache()
+    if cache is not None:
+        try:
+            if _incr(cache, _REQUESTS_KEY + phone_number, REQUEST_WINDOW) > MAX_REQUESTS:
+                raise OtpThrottled(REQUEST_WINDOW)
+            cache.set(_CODE_KEY + phone_number, _hash(phone_number, code), OTP_TTL)
+            cache.delete(_ATTEMPTS_KEY + phone_number)
+            return code
+        except OtpThrottled:
+            raise
+        except Exception as e:
+            logger.warning("OTP cache unavailable (%s); storing the code in the database.", e)
+    _issue_in_database(phone_number, code)
+    return code
+
+
+def verify_otp(phone_number, code):
+    """
+    Checks a login code. A correct code works once. Raises OtpLocked after
+    MAX_ATTEMPTS wrong guesses, which also burns the current code.
+    """
+    code = str(code or '')
+    cache = _cache()
+    if cache is not None:
+        try:
+            if _incr(cache, _ATTEMPTS_KEY + phone_number, OTP_TTL) > MAX_ATTEMPTS:
+                cache.delete(_CODE_KEY + phone_number)
+                raise OtpLocked()
+            stored = cache.get(_CODE_KEY + phone_number)
+            if stored is not None:
+                # delete() reports whether this call removed the key, so only one
+                # of two simultaneous logins with the same code gets through.
+                if constant_time_compare(stored, _hash(phone_number, code)) and cache.delete(_CODE_KEY + phone_number):
+                    cache.delete(_ATTEMPTS_KEY + phone_number)
+                    return True
+                return False
+        except OtpLocked:
+            raise
+        except Exception as e:
+            logger.warning("OTP cache unavailable (%s); checking the database.", e)
+    # No usable cache, or nothing in it: the code may have been issued while it was down.
+    return _verify_in_database(phone_number, code)
+
+
+# --- Database store ---
+# Used whenever the cache is not shared or down. Counters are moved with
+# UPDATE ... SET x = x + 1, never with a full save.
+
+def _issue_in_database(phone_number, code):
+    now = timezone.now()
+    with transaction.atomic():
+        row, created = OtpCode.objects.select_for_update().get_or_create(
+            phone_number=phone_number,
+            defaults={'code_hash': _hash(phone_number, code), 'expires_at': now + timedelta(seconds=OTP_TTL),
+                      'requests': 1, 'window_started_at': now},
+        )
+        if created:
+            return
+        if row.window_started_at < now - timedelta(seconds=REQUEST_WINDOW):
+            row.requests, row.window_started_at = 0, now
+        if row.requests >= MAX_REQUESTS:
+            raise OtpThrottled(REQUEST_WINDOW)
+        OtpCode.objects.filter(pk=phone_number).update(
+            code_hash=_hash(phone_number, code), expires_at=now + timedelta(seconds=OTP_TTL), attempts=0,
+            requests=row.requests + 1, window_started_at=row.window_started_at,
+        )
+
+
+def _verify_in_database(phone_number, code):
+    now = timezone.now()
+    live = OtpCode.objects.filter(phone_number=phone_number, expires_at__gt=now)
+    if not live.filter(attempts__lt=MAX_ATTEMPTS).update(attempts=F('attempts') + 1):
+        if live.exists():
+            raise OtpLocked()
+        return False
+    # Expiring the row is the one-time use: only the request whose update matched wins.
+    return bool(live.filter(code_hash=_hash(phone_number, code)).update(expires_at=now))
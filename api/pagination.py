@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+
+
+class CaseCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the case list. Each page is an indexed range scan
+    from the cursor position, so deep pages cost the same as the first one.
+
+    DRF positions a cursor on the first ordering field only and falls back
+    to offsets when several cases share a created_at. Here the position is
+    the (created_at, case_id) pair, which is unique, so a page always starts
+    strictly after the last case of the previous one.
+    """
+    ordering = ('-created_at', '-case_id')
+    page_size = getattr(settings, 'CASE_LIST_PAGE_SIZE', 50)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'CASE_LIST_MAX_PAGE_SIZE', 200)
+
+    def get_ordering(self, request, queryset, view):
+        # The position encodes exactly these two fields.
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Mirrors CursorPagination.paginate_queryset(), filtering on the
+        # (created_at, case_id) position instead of created_at alone.
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'case_id')
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(self._after(current_position, reverse))
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def _after(self, position, reverse):
+        """Cases past `position` in the page direction, newest first unless `reverse`."""
+        created_at, _, case_id = position.rpartition('|')
+        created_at = parse_datetime(created_at)
+        if created_at is None or not case_id.isdigit():
+            raise NotFound(self.invalid_cursor_message)
+        # created_at bounds the range scan on case_created_idx; case_id breaks ties.
+        if reverse:
+            return Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(case_id__gt=case_id))
+        return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(case_id__lt=case_id))
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            created_at, case_id = instance['created_at'], instance['case_id']
+        else:
+            created_at, case_id = instance.created_at, instance.case_id
+        return f'{created_at.isoformat()}|{case_id}'
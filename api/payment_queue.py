@@ -0,0 +1,250 @@
+# In api/payment_queue.py
+
+import logging
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .daraja_service import initiate_stk_push
+from .models import Case, CaseHistory, DarajaCallback, Payment, PaymentAttempt
+
+logger = logging.getLogger(__name__)
+
+# An attempt left 'sending' longer than this belongs to a worker that died
+# mid-push. The push may have reached the phone, so it is failed rather than
+# sent again; the agent can request a new one.
+STALE_AFTER = timedelta(seconds=getattr(settings, 'PAYMENT_STALE_AFTER', 120))
+
+CALLBACK_MAX_ATTEMPTS = getattr(settings, 'DARAJA_CALLBACK_MAX_ATTEMPTS', 8)
+CALLBACK_RETRY_BACKOFF = getattr(settings, 'DARAJA_CALLBACK_RETRY_BACKOFF', 15)  # seconds, doubled per attempt
+
+IN_FLIGHT_STATUSES = (PaymentAttempt.AttemptStatus.PENDING, PaymentAttempt.AttemptStatus.SENDING)
+
+
+def enqueue_payment(case, amount, requested_by=None):
+    """
+    Queues an STK push for `case` and returns (attempt, created). A case with
+    an attempt still queued or being sent gets that attempt back instead of a
+    second push to the patient's phone.
+    """
+    with transaction.atomic():
+        # Serialises concurrent requests for the same case.
+        Case.objects.select_for_update().filter(pk=case.pk).values_list('pk').first()
+        existing = PaymentAttempt.objects.filter(case=case, status__in=IN_FLIGHT_STATUSES).first()
+        if existing is not None:
+            return existing, False
+        attempt = PaymentAttempt.objects.create(
+            case=case, requested_by=requested_by, phone_number=case.user.phone_number, amount=amount,
+        )
+    return attempt, True
+
+
+def claim_payment_attempts(batch_size):
+    """
+    Marks up to `batch_size` pending attempts as sending and returns them with
+    their cases. Rows locked by another worker are skipped.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        PaymentAttempt.objects.filter(
+            status=PaymentAttempt.AttemptStatus.SENDING, sent_at__lt=now - STALE_AFTER
+        ).update(status=PaymentAttempt.AttemptStatus.FAILED, error="Worker stopped while sending.", finished_at=now)
+
+        attempt_ids = list(
+            PaymentAttempt.objects.select_for_update(skip_locked=True)
+            .filter(status=PaymentAttempt.AttemptStatus.PENDING)
+            .order_by('created_at')
+            .values_list('attempt_id', flat=True)[:batch_size]
+        )
+        if not attempt_ids:
+            return []
+        # sent_at doubles as the claim time until the push goes out.
+        PaymentAttempt.objects.filter(attempt_id__in=attempt_ids).update(
+            status=PaymentAttempt.AttemptStatus.SENDING, sent_at=now
+        )
+    return list(PaymentAttempt.objects.filter(attempt_id__in=attempt_ids).select_related('case'))
+
+
+def send_payment_attempts(attempts, executor):
+    """
+    Sends the STK pushes for claimed attempts concurrently on `executor` and
+    records each outcome. Returns the number of pushes Daraja accepted.
+    """
+    futures = [
+        (attempt, executor.submit(
+            initiate_stk_push,
+            phone_number=attempt.phone_number,
+            # M-Pesa only takes whole shillings.
+            amount=int(attempt.amount),
+            account_reference=f"AFYLNK{attempt.case_id}",
+            transaction_desc=f"Payment for Case #{attempt.case_id}",
+        ))
+        for attempt in attempts
+    ]
+    sent = 0
+    for attempt, future in futures:
+        try:
+            daraja_response = future.result()
+        except Exception as e:
+            daraja_response = {"error": str(e)}
+        if record_push_result(attempt, daraja_response):
+            sent += 1
+    return sent
+
+
+def record_push_result(attempt, daraja_response):
+    """Saves Daraja's answer to a push on the attempt and, if accepted, on its case."""
+    now = timezone.now()
+    checkout_id = daraja_response.get('CheckoutRequestID')
+    if daraja_response.get('ResponseCode') != '0' or not checkout_id:
+        attempt.status = PaymentAttempt.AttemptStatus.FAILED
+        attempt.error = (
+            daraja_response.get('error') or daraja_response.get('errorMessage')
+            or daraja_response.get('ResponseDescription') or "STK push was not accepted."
+        )
+        attempt.finished_at = now
+        attempt.save(update_fields=['status', 'error', 'finished_at'])
+        logger.warning("STK push for case %s failed: %s", attempt.case_id, attempt.error)
+        return False
+
+    with transaction.atomic():
+        attempt.status = PaymentAttempt.AttemptStatus.SENT
+        attempt.checkout_request_id = checkout_id
+        attempt.sent_at = now
+        attempt.save(update_fields=['status', 'checkout_request_id', 'sent_at'])
+        # One write for the case. Callbacks find it through the attempt's id;
+        # the case keeps the latest one for display.
+        case = attempt.case
+        case.checkout_request_id = checkout_id
+        case.status = Case.CaseStatus.PAYMENT_PENDING
+        case.save(update_fields=['checkout_request_id', 'status', 'updated_at'])
+        CaseHistory.objects.create(case=case, description="Payment requested from patient.")
+    return True
+
+
+# --- Daraja callbacks ---
+
+class CallbackError(Exception):
+    """A callback that cannot be applied."""
+
+
+class UnknownCheckoutRequest(CallbackError):
+    """
+    No payment attempt has the callback's CheckoutRequestID (yet). Safaricom
+    can call back before record_push_result() has committed the id, so the
+    callback is retried later rather than failed.
+    """
+
+
+def claim_callbacks(batch_size):
+    """Returns up to `batch_size` pending callbacks that are due, locked; call inside a transaction."""
+    return list(
+        DarajaCallback.objects.select_for_update(skip_locked=True)
+        .filter(status=DarajaCallback.CallbackStatus.PENDING, process_after__lte=timezone.now())
+        .order_by('callback_id')[:batch_size]
+    )
+
+
+def process_callbacks(batch_size):
+    """
+    Applies a batch of stored Daraja callbacks, each in its own savepoint so
+    one bad payload cannot hold up the rest. Returns how many were claimed.
+    """
+    with transaction.atomic():
+        callbacks = claim_callbacks(batch_size)
+        for callback in callbacks:
+            try:
+                with transaction.atomic():
+                    callback.status = apply_callback(callback)
+                    callback.error = None
+                    callback.processed_at = timezone.now()
+                    # Saved straight away: Safaricom's retries often land in the
+                    # same batch, and apply_callback() spots them by this status.
+                    callback.save(update_fields=['status', 'error', 'processed_at'])
+            except UnknownCheckoutRequest as e:
+                now = timezone.now()
+                callback.attempts += 1
+                callback.error = str(e)
+                if callback.attempts < CALLBACK_MAX_ATTEMPTS:
+                    callback.process_after = now + timedelta(
+                        seconds=CALLBACK_RETRY_BACKOFF * 2 ** (callback.attempts - 1)
+                    )
+                else:
+                    logger.warning("Giving up on Daraja callback %s: %s", callback.callback_id, e)
+                    callback.status = DarajaCallback.CallbackStatus.FAILED
+                    callback.processed_at = now
+                callback.save(update_fields=['status', 'error', 'attempts', 'process_after', 'processed_at'])
+            except Exception as e:
+                if isinstance(e, CallbackError):
+                    logger.warning("Could not apply Daraja callback %s: %s", callback.callback_id, e)
+                else:
+                    logger.exception("Could not apply Daraja callback %s.", callback.callback_id)
+                callback.status = DarajaCallback.CallbackStatus.FAILED
+                callback.error = str(e)
+                callback.processed_at = timezone.now()
+                callback.save(update_fields=['status', 'error', 'processed_at'])
+    return len(callbacks)
+
+
+def parse_stk_callback(payload):
+    """Reads everything needed from an STK callback body in one pass."""
+    stk_callback = (payload.get('Body') or {}).get('stkCallback') or {}
+    items = (stk_callback.get('CallbackMetadata') or {}).get('Item') or []
+    metadata = {item.get('Name'): item.get('Value') for item in items}
+    return stk_callback, metadata
+
+
+def apply_callback(callback):
+    """
+    Records one STK result on its case and returns the callback's new status.
+    Safaricom retries a callback until it is acknowledged, so a result that
+    was already applied for the same CheckoutRequestID is a no-op.
+    """
+    stk_callback, metadata = parse_stk_callback(callback.payload)
+    checkout_request_id = stk_callback.get('CheckoutRequestID')
+    if not checkout_request_id:
+        raise CallbackError("Callback has no CheckoutRequestID.")
+    # The attempt, not the case, owns the id: a later push for the same case
+    # replaces case.checkout_request_id, but the earlier push can still be paid.
+    case_id = (
+        PaymentAttempt.objects.filter(checkout_request_id=checkout_request_id).values_list('case_id', flat=True).first()
+        or Case.objects.filter(checkout_request_id=checkout_request_id).values_list('pk', flat=True).first()
+    )
+    if case_id is None:
+        raise UnknownCheckoutRequest(f"No payment attempt with CheckoutRequestID {checkout_request_id}.")
+    # Locking the case serialises duplicates being applied concurrently.
+    case = Case.objects.select_for_update().get(pk=case_id)
+    already_applied = DarajaCallback.objects.filter(
+        checkout_request_id=checkout_request_id, status=DarajaCallback.CallbackStatus.DONE,
+    ).exclude(pk=callback.pk).exists()
+    if already_applied:
+        return DarajaCallback.CallbackStatus.DUPLICATE
+
+    now = timezone.now()
+    if stk_callback.get('ResultCode') == 0:
+        receipt_number = metadata.get('MpesaReceiptNumber')
+        if metadata.get('Amount') and receipt_number and metadata.get('TransactionDate'):
+            transaction_date = timezone.make_aware(datetime.strptime(str(metadata['TransactionDate']), '%Y%m%d%H%M%S'))
+            _, created = Payment.objects.get_or_create(
+                mpesa_receipt_number=receipt_number,
+                defaults={'case': case, 'amount': metadata['Amount'], 'transaction_date': transaction_date},
+            )
+            if not created:
+                return DarajaCallback.CallbackStatus.DUPLICATE
+        case.status = Case.CaseStatus.PAID
+        case.save(update_fields=['status', 'updated_at'])
+        CaseHistory.objects.create(case=case, description="Payment confirmed successfully.")
+        PaymentAttempt.objects.filter(checkout_request_id=checkout_request_id).update(
+            status=PaymentAttempt.AttemptStatus.CONFIRMED, finished_at=now
+        )
+    else:
+        result_desc = stk_callback.get('ResultDesc')
+        # The case itself is unchanged, but its new history entry belongs in the change feed.
+        Case.objects.filter(pk=case.pk).update(updated_at=now)
+        CaseHistory.objects.create(case=case, description=f"Payment failed: {result_desc}"[:255])
+        PaymentAttempt.objects.filter(checkout_request_id=checkout_request_id).update(
+            status=PaymentAttempt.AttemptStatus.FAILED, error=result_desc, finished_at=now
+        )
+    return DarajaCallback.CallbackStatus.DONE
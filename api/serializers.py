@@ -1,9 +1,29 @@
-from rest_framework import serializers
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .account_lookup import matching_accounts
+from .metrics import timed
 # MODIFIED: Import the new models
-from .models import Case, User, Agent, Payment, CaseHistory
-from .auto_assign import auto_assign_case
+from .models import Case, User, Agent, Payment, PaymentAttempt, CaseHistory
 from django.contrib.auth.models import User as AuthUser
-from .ai_service import get_ai_triage_for_symptoms
+from .triage_queue import enqueue_triage
+
+logger = logging.getLogger(__name__)
+
+
+class TimedSerializerMixin:
+    """
+    Counts rendering as the request's 'serialize' phase for
+    RequestMetricsMiddleware. Queries for lazily loaded relations run inside
+    it, so they show up under 'db' as well.
+    """
+
+    def to_representation(self, instance):
+        with timed('serialize'):
+            return super().to_representation(instance)
 
 
 # --- User Serializer ---
@@ -24,7 +44,7 @@ class AgentSerializer(serializers.ModelSerializer):
 
 # In api/serializers.py
 
-class CaseSerializer(serializers.ModelSerializer):
+class CaseSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer to represent the Case model. Now handles creation from the web correctly.
     """
@@ -49,27 +69,97 @@ class CaseSerializer(serializers.ModelSerializer):
             'ai_category', 'ai_summary',
         ]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Joins the related rows rendered by the string fields and loads only
+        the columns this serializer needs, so a list costs one query.
+        """
+        return queryset.select_related('agent', 'case_language', 'case_payment_declaration').only(
+            'case_id', 'user', 'agent', 'case_language', 'case_payment_declaration',
+            'symptom_input', 'status', 'agent_notes', 'created_at', 'updated_at',
+            'ai_urgency', 'ai_category', 'ai_summary',
+            'agent__full_name', 'case_language__language_name', 'case_payment_declaration__description',
+        )
+
     def create(self, validated_data):
         """
-        Creates the case, then calls the AI service to generate triage data,
-        and finally calls the auto-assign function.
+        Creates the case and queues it for AI triage. The triage worker fills
+        in the AI fields and auto-assigns the case, so the request returns as
+        soon as the row exists.
         """
-        # First, create the case object
         case = super().create(validated_data)
+        enqueue_triage(case)
+        return case
+
+
+class CaseListValues:
+    """
+    Fast read-only rendering of the case list. Works on plain `.values()` rows
+    through a precomputed field mapping, skipping model instances and
+    per-object serializer fields. Output is identical to CaseSerializer; the
+    related names mirror Agent/Language/PaymentDeclaration.__str__.
+    """
+    field_map = (
+        ('case_id', 'case_id'),
+        ('user', 'user_id'),
+        ('agent', 'agent__full_name'),
+        ('symptom_input', 'symptom_input'),
+        ('case_language', 'case_language__language_name'),
+        ('case_payment_declaration', 'case_payment_declaration__description'),
+        ('status', 'status'),
+        ('agent_notes', 'agent_notes'),
+        ('created_at', 'created_at'),
+        ('updated_at', 'updated_at'),
+        ('ai_urgency', 'ai_urgency'),
+        ('ai_category', 'ai_category'),
+        ('ai_summary', 'ai_summary'),
+    )
+    value_fields = tuple(source for _, source in field_map)
+    datetime_fields = ('created_at', 'updated_at')
+    _datetime_field = serializers.DateTimeField()
+
+    @classmethod
+    def values(cls, queryset):
+        """Turns a Case queryset into the rows this class renders (one query)."""
+        return queryset.values(*cls.value_fields)
+
+    @classmethod
+    def _datetime_formatter(cls):
+        """
+        DRF's DateTimeField looks up the current timezone for every value;
+        resolve it once per response instead and format the same way.
+        """
+        output_format = api_settings.DATETIME_FORMAT
+        if not settings.USE_TZ or output_format is None or output_format.lower() != ISO_8601:
+            return cls._datetime_field.to_representation
+        current_timezone = timezone.get_current_timezone()
+
+        def format_datetime(value):
+            value = value.astimezone(current_timezone).isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+        return format_datetime
+
+    @classmethod
+    def to_representation(cls, rows):
+        field_map = cls.field_map
+        datetime_fields = cls.datetime_fields
+        format_datetime = cls._datetime_formatter()
+        data = []
+        with timed('serialize'):
+            for row in rows:
+                item = {key: row[source] for key, source in field_map}
+                for key in datetime_fields:
+                    if item[key] is not None:
+                        item[key] = format_datetime(item[key])
+                data.append(item)
+        return data
 
-        # ✅ NEW: Call the AI service with the symptom input
-        if case.symptom_input:
-            ai_data = get_ai_triage_for_symptoms(case.symptom_input)
-            case.ai_urgency = ai_data.get("ai_urgency")
-            case.ai_category = ai_data.get("ai_category")
-            case.ai_summary = ai_data.get("ai_summary")
-            case.save()
 
-        # Then, auto-assign the case to an agent
-        auto_assign_case(case)
-        return case
 # --- Current User Serializer ---
-class CurrentUserSerializer(serializers.ModelSerializer):
+class CurrentUserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the current user. Safely includes agent-specific details.
     """
@@ -99,13 +189,14 @@ class AgentRegisterSerializer(serializers.ModelSerializer):
 
     def validate_email(self, value):
         """Check that the email is not already in use (case-insensitive)."""
-        if AuthUser.objects.filter(email__iexact=value).exists():
+        # Uncached: the availability cache may be a few seconds behind.
+        if matching_accounts('email', value).exists():
             raise serializers.ValidationError("An account with this email already exists.")
         return value
 
     def create(self, validated_data):
         """Creates the AuthUser and the linked Agent profile."""
-        print("✅ REGISTRATION DATA RECEIVED BY SERVER:", validated_data)
+        logger.info("Registering agent %s.", validated_data.get('username'))
 
         try:
             full_name = validated_data.pop('full_name')
@@ -125,7 +216,7 @@ class AgentRegisterSerializer(serializers.ModelSerializer):
 
 # --- NEW SERIALIZERS FOR DASHBOARD FEATURES ---
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the Payment model, for the payment history tab.
     """
@@ -133,7 +224,15 @@ class PaymentSerializer(serializers.ModelSerializer):
         model = Payment
         fields = ['case', 'amount', 'mpesa_receipt_number', 'transaction_date']
 
-class CaseHistorySerializer(serializers.ModelSerializer):
+class PaymentAttemptSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    Serializer for the PaymentAttempt model, for polling an STK push's progress.
+    """
+    class Meta:
+        model = PaymentAttempt
+        fields = ['attempt_id', 'case', 'status', 'checkout_request_id', 'error', 'created_at', 'sent_at', 'finished_at']
+
+class CaseHistorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for the CaseHistory model, for the case timeline feature.
     """
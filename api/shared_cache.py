@@ -0,0 +1,21 @@
+# In api/shared_cache.py
+
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+
+# What a cache backend can be trusted with. State that must be the same in
+# every worker (login codes, the Daraja token, live events) cannot live in a
+# per-process cache, and counters that enforce limits need an atomic incr(),
+# which Django's database cache does not have (it reads, then writes).
+
+
+def is_process_local(cache):
+    """Whether each worker process has its own copy of `cache`."""
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def has_atomic_counters(cache):
+    """Whether `cache` is shared by every worker and its incr() is atomic."""
+    return isinstance(cache, (RedisCache, BaseMemcachedCache))
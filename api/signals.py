@@ -0,0 +1,111 @@
+# In api/signals.py
+
+from django.contrib.auth.models import User as AuthUser
+from django.db.models.signals import post_delete, post_save
+
+from .account_lookup import invalidate_account_lookup
+from .auto_assign import adjust_open_cases
+from .events import CaseEvent, publish_case_event
+from .models import (
+    Case, CaseTombstone, Language, Payment, PaymentDeclaration, UssdMenuText, UssdMenuNode,
+    OPEN_CASE_STATUSES,
+)
+from .ussd_menu import invalidate_menu_cache
+
+# --- USSD menu cache invalidation ---
+# Admin edits (including bulk deletes from UssdMenuTextAdmin) go through
+# model save/delete, so these receivers cover them as well.
+for model in (UssdMenuText, UssdMenuNode, Language, PaymentDeclaration):
+    post_save.connect(invalidate_menu_cache, sender=model, dispatch_uid=f'ussd_menu_cache_save_{model.__name__}')
+    post_delete.connect(invalidate_menu_cache, sender=model, dispatch_uid=f'ussd_menu_cache_delete_{model.__name__}')
+
+# --- Username/email availability cache ---
+post_save.connect(invalidate_account_lookup, sender=AuthUser, dispatch_uid='account_lookup_save')
+post_delete.connect(invalidate_account_lookup, sender=AuthUser, dispatch_uid='account_lookup_delete')
+
+
+# --- Case change feed and live events ---
+# These read Case._loaded_workload before the workload receivers below
+# overwrite it, so they must stay connected first.
+#
+# A new history entry is a change to its case in the feed. History is almost
+# always written next to a save of the case, which already moves updated_at,
+# so there is no receiver touching the case per entry: code that adds history
+# without saving the case bumps updated_at itself, once per operation.
+
+def record_reassignment(sender, instance, created, raw=False, **kwargs):
+    if raw or created:
+        return
+    old_agent_id, _ = getattr(instance, '_loaded_workload', (None, False))
+    if old_agent_id is not None and old_agent_id != instance.agent_id:
+        CaseTombstone.objects.create(
+            case_id=instance.case_id, user_id=instance.user_id, agent_id=old_agent_id,
+            reason=CaseTombstone.Reason.REASSIGNED,
+        )
+
+
+def record_deletion(sender, instance, **kwargs):
+    agent_id, _ = getattr(instance, '_loaded_workload', (instance.agent_id, False))
+    CaseTombstone.objects.create(
+        case_id=instance.case_id, user_id=instance.user_id, agent_id=agent_id,
+        reason=CaseTombstone.Reason.DELETED,
+    )
+
+
+def publish_case_changes(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_agent_id, _ = (None, False) if created else getattr(instance, '_loaded_workload', (None, False))
+    old_status = None if created else getattr(instance, '_loaded_status', None)
+    if instance.agent_id is not None and instance.agent_id != old_agent_id:
+        publish_case_event(
+            CaseEvent.CASE_ASSIGNED, instance.case_id, instance.user_id, instance.agent_id, status=instance.status,
+        )
+    elif not created and old_status is not None and instance.status != old_status:
+        publish_case_event(
+            CaseEvent.STATUS_CHANGED, instance.case_id, instance.user_id, instance.agent_id, status=instance.status,
+        )
+    instance._loaded_status = instance.status
+
+
+def publish_payment_confirmed(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        case = instance.case
+        publish_case_event(
+            CaseEvent.PAYMENT_CONFIRMED, case.case_id, case.user_id, case.agent_id,
+            amount=str(instance.amount), receipt=instance.mpesa_receipt_number,
+        )
+
+
+post_save.connect(record_reassignment, sender=Case, dispatch_uid='case_feed_reassignment')
+post_save.connect(publish_case_changes, sender=Case, dispatch_uid='case_events_save')
+post_save.connect(publish_payment_confirmed, sender=Payment, dispatch_uid='case_events_payment')
+post_delete.connect(record_deletion, sender=Case, dispatch_uid='case_feed_deletion')
+
+
+# --- Agent workload counter ---
+# Keeps Agent.open_cases in step with case saves and deletes. QuerySet.update()
+# and bulk_update() bypass these, so code using them adjusts the counter itself;
+# `manage.py rebuild_agent_workload` repairs any drift.
+
+def update_agent_workload(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_agent_id, was_open = (None, False) if created else getattr(instance, '_loaded_workload', (None, False))
+    new_agent_id, is_open = instance.agent_id, instance.status in OPEN_CASE_STATUSES
+    if (old_agent_id, was_open) != (new_agent_id, is_open):
+        if was_open:
+            adjust_open_cases(old_agent_id, -1)
+        if is_open:
+            adjust_open_cases(new_agent_id, 1)
+    instance._loaded_workload = (new_agent_id, is_open)
+
+
+def release_agent_workload(sender, instance, **kwargs):
+    agent_id, was_open = getattr(instance, '_loaded_workload', (instance.agent_id, instance.status in OPEN_CASE_STATUSES))
+    if was_open:
+        adjust_open_cases(agent_id, -1)
+
+
+post_save.connect(update_agent_workload, sender=Case, dispatch_uid='agent_workload_save')
+post_delete.connect(release_agent_workload, sender=Case, dispatch_uid='agent_workload_delete')
@@ -0,0 +1,247 @@
+# In api/sms.py
+
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .africastalking_service import send_bulk_sms
+from .log import REDACTED
+from .models import SmsMessage
+
+logger = logging.getLogger(__name__)
+
+BULK_SIZE = getattr(settings, 'SMS_BULK_SIZE', 100)
+MAX_ATTEMPTS = getattr(settings, 'SMS_MAX_ATTEMPTS', 5)
+RETRY_BACKOFF = getattr(settings, 'SMS_RETRY_BACKOFF', 30)  # seconds, doubled per attempt
+# A message left 'sending' longer than this belongs to a worker that died.
+STALE_AFTER = timedelta(seconds=getattr(settings, 'SMS_STALE_AFTER', 300))
+
+
+def normalize_phone_number(phone_number):
+    """Kenyan numbers in international format, as the gateway expects."""
+    phone_number = phone_number.strip().replace(' ', '')
+    if phone_number.startswith('0'):
+        return '+254' + phone_number[1:]
+    if phone_number.startswith('254'):
+        return '+' + phone_number
+    return phone_number
+
+
+def queue_sms(phone_numbers, body, kind=SmsMessage.Kind.OTHER):
+    """Queues `body` for each phone number; the `sms_worker` command sends them."""
+    return SmsMessage.objects.bulk_create(
+        [SmsMessage(phone_number=normalize_phone_number(number), body=body, kind=kind) for number in phone_numbers]
+    )
+
+
+def notify_case_assigned(assignments):
+    """
+    Texts agents about cases assigned to them automatically. `assignments` is
+    a list of (case_id, agent phone number); agents without a number are skipped.
+    """
+    if not getattr(settings, 'SMS_NOTIFY_CASE_ASSIGNED', True):
+        return
+    messages = [
+        SmsMessage(
+            phone_number=normalize_phone_number(phone_number),
+            body=f"AfyaLink: case #{case_id} has been assigned to you. Open your dashboard to review it.",
+            kind=SmsMessage.Kind.CASE_ASSIGNED,
+        )
+        for case_id, phone_number in assignments if phone_number
+    ]
+    SmsMessage.objects.bulk_create(messages)
+
+
+# --- Transports ---
+# A transport sends one body to many recipients and returns a dict of
+# phone number -> SendResult. Exceptions count as transient for every recipient.
+
+class SendResult:
+    __slots__ = ('sent', 'transient', 'status', 'provider_message_id')
+
+    def __init__(self, sent, status, provider_message_id=None, transient=False):
+        self.sent = sent
+        self.status = status
+        self.provider_message_id = provider_message_id
+        self.transient = transient
+
+
+class AfricasTalkingTransport:
+    # https://developers.africastalking.com/docs/sms/sending/bulk
+    SENT_CODES = frozenset([100, 101, 102])  # processed, sent, queued
+    TRANSIENT_CODES = frozenset([405, 407, 500, 501, 502])  # balance, routing and gateway errors
+    # The SDK raises ValueError for the whole call if one number fails this
+    # check, so numbers are checked here first and only the bad ones fail.
+    VALID_NUMBER = re.compile(r'^\+\d{1,3}\d{3,}$')
+    INVALID_NUMBER = 'InvalidPhoneNumber'
+
+    def __init__(self, sender=None):
+        self.sender = sender or getattr(settings, 'SMS_SENDER_ID', None)
+
+    def send(self, body, recipients):
+        results = {}
+        valid = []
+        for number in recipients:
+            if self.VALID_NUMBER.match(number):
+                valid.append(number)
+            else:
+                results[number] = SendResult(sent=False, status=self.INVALID_NUMBER)
+        if not valid:
+            return results
+        try:
+            responses = send_bulk_sms(body, valid, sender=self.sender)
+        except ValueError:
+            # Rejected by a check not mirrored above: send one by one so
+            # only the numbers the SDK refuses are failed.
+            responses = []
+            for number in valid:
+                try:
+                    responses.extend(send_bulk_sms(body, [number], sender=self.sender))
+                except ValueError as e:
+                    logger.warning("SMS to %s rejected: %s", number, e)
+                    results[number] = SendResult(sent=False, status=self.INVALID_NUMBER)
+        for recipient in responses:
+            code = recipient.get('statusCode')
+            results[recipient.get('number')] = SendResult(
+                sent=code in self.SENT_CODES,
+                status=recipient.get('status'),
+                provider_message_id=recipient.get('messageId'),
+                transient=code in self.TRANSIENT_CODES,
+            )
+        return results
+
+
+class LocalTransport:
+    """
+    Records messages in memory instead of sending them, for development and
+    tests. Numbers in `fail` get that (status, transient) result instead.
+    """
+
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = dict(fail or {})
+
+    def send(self, body, recipients):
+        self.sent.append((body, list(recipients)))
+        results = {}
+        for number in recipients:
+            if number in self.fail:
+                status, transient = self.fail[number]
+                results[number] = SendResult(sent=False, status=status, transient=transient)
+            else:
+                results[number] = SendResult(sent=True, status='Success', provider_message_id=f'local-{len(self.sent)}-{number}')
+        logger.info("SMS (local) to %s: %s", ', '.join(recipients), body)
+        return results
+
+
+def get_sms_transport():
+    return import_string(getattr(settings, 'SMS_TRANSPORT', 'api.sms.AfricasTalkingTransport'))()
+
+
+class RateLimiter:
+    """Blocking token bucket: at most `rate` messages per second, bursts up to one second's worth."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # A batch bigger than the bucket waits for a full bucket and overdraws it.
+                needed = min(count, self.rate)
+                if self.tokens >= needed:
+                    self.tokens -= count
+                    return
+                time.sleep((needed - self.tokens) / self.rate)
+
+
+# --- Sending ---
+
+def claim_sms(batch_size):
+    """
+    Marks up to `batch_size` due messages as sending and returns them.
+    Rows locked by another worker are skipped.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        SmsMessage.objects.filter(
+            status=SmsMessage.SmsStatus.SENDING, send_after__lt=now - STALE_AFTER
+        ).update(status=SmsMessage.SmsStatus.QUEUED)
+
+        message_ids = list(
+            SmsMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=SmsMessage.SmsStatus.QUEUED, send_after__lte=now)
+            .order_by('send_after')
+            .values_list('message_id', flat=True)[:batch_size]
+        )
+        if not message_ids:
+            return []
+        # send_after doubles as the claim time while a message is sending.
+        SmsMessage.objects.filter(message_id__in=message_ids).update(status=SmsMessage.SmsStatus.SENDING, send_after=now)
+    return list(SmsMessage.objects.filter(message_id__in=message_ids))
+
+
+def send_sms_batch(messages, transport, rate_limiter=None):
+    """
+    Sends claimed messages with one gateway call per distinct body (up to
+    SMS_BULK_SIZE recipients each) and records every recipient's outcome.
+    Transient failures are requeued with exponential backoff until
+    SMS_MAX_ATTEMPTS. Returns the number of messages sent.
+    """
+    now = timezone.now()
+    sent = 0
+    messages = sorted(messages, key=lambda message: (message.body, message.message_id))
+    for body, group in groupby(messages, key=lambda message: message.body):
+        group = list(group)
+        for start in range(0, len(group), BULK_SIZE):
+            chunk = group[start:start + BULK_SIZE]
+            if rate_limiter is not None:
+                rate_limiter.acquire(len(chunk))
+            recipients = list(dict.fromkeys(message.phone_number for message in chunk))
+            try:
+                results = transport.send(body, recipients)
+            except Exception as e:
+                logger.warning("SMS gateway call for %s recipient(s) failed: %s", len(recipients), e)
+                results = {number: SendResult(sent=False, status=str(e)[:50], transient=True) for number in recipients}
+
+            for message in chunk:
+                message.attempts += 1
+                result = results.get(message.phone_number) or SendResult(sent=False, status='No result', transient=True)
+                message.provider_status = (result.status or '')[:50]
+                if result.sent:
+                    message.status = SmsMessage.SmsStatus.SENT
+                    message.provider_message_id = result.provider_message_id
+                    message.sent_at = now
+                    message.error = None
+                    sent += 1
+                elif result.transient and message.attempts < MAX_ATTEMPTS:
+                    message.status = SmsMessage.SmsStatus.QUEUED
+                    message.send_after = now + timedelta(seconds=RETRY_BACKOFF * 2 ** (message.attempts - 1))
+                    message.error = result.status
+                else:
+                    message.status = SmsMessage.SmsStatus.FAILED
+                    message.error = result.status
+                if message.kind == SmsMessage.Kind.OTP and message.status != SmsMessage.SmsStatus.QUEUED:
+                    # A login code is only needed until it is sent for the last time.
+                    message.body = REDACTED
+
+    SmsMessage.objects.bulk_update(
+        messages, ['status', 'attempts', 'error', 'provider_message_id', 'provider_status', 'send_after', 'sent_at', 'body']
+    )
+    return sent
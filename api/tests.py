@@ -1,3 +1,1232 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+from urllib.parse import unquote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib import admin
+from django.contrib.auth.models import User as AuthUser
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import ProgrammingError, connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import ai_service, daraja_service
+from .auto_assign import assign_pending_cases, auto_assign_case
+from .case_changes import CHANGES_LIMIT, ChangeTokenExpired, encode_token, get_case_changes
+from .events import CacheBroker, DatabaseBroker
+from .http_client import DEFAULT_TIMEOUT, CircuitOpenError, HttpClient
+from .models import (
+    Agent, Case, CaseHistory, CaseTombstone, DarajaCallback, Language, OtpCode, Payment, PaymentAttempt,
+    PaymentDeclaration, SmsMessage, TriageJob, User, UssdMenuNode,
+)
+from .log import REDACTED, JsonFormatter, RedactSecretsFilter, redact
+from .management.commands.reconcile_mpesa_statement import Command as ReconcileCommand
+from .metrics import render_metrics
+from .otp import OtpLocked, OtpThrottled, issue_otp, verify_otp
+from .payment_queue import CALLBACK_MAX_ATTEMPTS, process_callbacks, record_push_result
+from .sms import AfricasTalkingTransport, LocalTransport, RateLimiter, claim_sms, queue_sms, send_sms_batch
+from .triage_queue import MAX_ATTEMPTS as TRIAGE_MAX_ATTEMPTS, claim_triage_jobs
+from .ussd_menu import ANY_INPUT, compile_menu_graph, get_menu_text, invalidate_menu_cache
+from .ussd_session import LocalMemorySessionStore, UssdSession
+
+
+class CaseListQueryCountTests(TestCase):
+    """The case endpoints must not issue extra queries per case rendered."""
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.get_or_create(language_code='en', defaults={'language_name': 'English'})[0]
+        declaration = PaymentDeclaration.objects.get_or_create(
+            status_code='standard', defaults={'description': 'Can pay standard fee'}
+        )[0]
+        cls.patient = User.objects.create(phone_number='0700000001', default_language=language)
+        agents = [
+            Agent.objects.create(user=AuthUser.objects.create_user(f'agent{i}'), full_name=f'Agent {i}')
+            for i in range(3)
+        ]
+        for i in range(30):
+            Case.objects.create(
+                user=cls.patient,
+                agent=agents[i % 3],
+                symptom_input=f'symptom {i}',
+                case_language=language,
+                case_payment_declaration=declaration,
+            )
+        cls.staff = AuthUser.objects.create_user('staff', is_staff=True)
+        cls.patient_login = AuthUser.objects.create_user(cls.patient.phone_number)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_staff_case_list_query_count_is_independent_of_page_size(self):
+        self.client.force_authenticate(self.staff)
+        for page_size in (1, 10, 30):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/cases/', {'page_size': page_size})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), page_size)
+            self.assertTrue(all(case['agent'] and case['case_language'] for case in response.data['results']))
+
+    def test_patient_case_list_query_count_is_independent_of_page_size(self):
+        self.client.force_authenticate(self.patient_login)
+        for page_size in (1, 30):
+            # Patient profile lookup plus the page itself
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/cases/', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+
+    @override_settings(REQUEST_METRICS_SERVER_TIMING=True)
+    def test_request_metrics_report_queries_and_serializer_time(self):
+        client = APIClient()
+        client.force_authenticate(self.staff)
+        response = client.get('/api/cases/', {'page_size': 10})
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        metrics = render_metrics()
+        self.assertIn('http_request_duration_seconds_count{view="case-list",method="GET",status="200"}', metrics)
+        self.assertIn('http_request_phase_duration_seconds_count{view="case-list",phase="serialize"}', metrics)
+
+    def test_case_detail_is_a_single_query(self):
+        self.client.force_authenticate(self.staff)
+        case = Case.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/cases/{case.pk}/')
+        self.assertEqual(response.data['case_payment_declaration'], 'Can pay standard fee')
+
+
+class CasePaginationTests(TestCase):
+    """Case list cursors page through cases that share a created_at without skipping or repeating any."""
+
+    @classmethod
+    def setUpTestData(cls):
+        patient = User.objects.create(phone_number='0700000002')
+        cls.cases = [Case.objects.create(user=patient, symptom_input=f'symptom {i}') for i in range(7)]
+        # Three cases created in the same instant straddle the page boundaries.
+        tied = timezone.now() - timedelta(minutes=5)
+        Case.objects.filter(pk__in=[case.pk for case in cls.cases[2:5]]).update(created_at=tied)
+        cls.staff = AuthUser.objects.create_user('staff', is_staff=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def walk(self, url, link):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([case['case_id'] for case in response.data['results']])
+            url = response.data[link]
+            if url:
+                # Positions are unique, so no cursor needs an offset.
+                cursor = re.search(r'cursor=([^&]+)', url).group(1)
+                self.assertNotIn('o=', base64.b64decode(unquote(cursor)).decode())
+        return pages
+
+    def test_next_and_previous_links_cover_every_case_once(self):
+        expected = list(Case.objects.order_by('-created_at', '-case_id').values_list('case_id', flat=True))
+        forward = self.walk('/api/cases/?page_size=2', 'next')
+        self.assertEqual(sum(forward, []), expected)
+
+        last_page = self.client.get('/api/cases/?page_size=2')
+        while last_page.data['next']:
+            last_page = self.client.get(last_page.data['next'])
+        backward = self.walk(last_page.data['previous'], 'previous')
+        self.assertEqual(sum(reversed(backward), []) + forward[-1], expected)
+
+    def test_tampered_cursor_is_rejected(self):
+        cursor = base64.b64encode(b'p=yesterday').decode()
+        self.assertEqual(self.client.get('/api/cases/', {'cursor': cursor}).status_code, 404)
+
+
+class FakeDaraja(BaseHTTPRequestHandler):
+    """A local stand-in for the Safaricom endpoints the service calls."""
+
+    token_hits = 0
+    push_hits = 0
+    token_delay = 0
+    expires_in = '3599'
+    hits_lock = threading.Lock()
+
+    def do_GET(self):
+        if not self.path.startswith('/oauth/v1/generate'):
+            return self._reply(404, {})
+        with self.hits_lock:
+            FakeDaraja.token_hits += 1
+            token = f'token-{FakeDaraja.token_hits}'
+        time.sleep(self.token_delay)
+        self._reply(200, {'access_token': token, 'expires_in': self.expires_in})
+
+    def do_POST(self):
+        if self.path != '/mpesa/stkpush/v1/processrequest':
+            return self._reply(404, {})
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.hits_lock:
+            FakeDaraja.push_hits += 1
+            checkout_id = f'ws_CO_{FakeDaraja.push_hits}'
+        self._reply(200, {'ResponseCode': '0', 'CheckoutRequestID': checkout_id, 'token': self.headers['Authorization']})
+
+    def _reply(self, status_code, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+# Threads stand in for workers here; SQLite's table locks inside a test
+# transaction would block them on the database cache.
+@override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'shared'},
+})
+class DarajaTokenCacheTests(TestCase):
+    """The Daraja OAuth token is fetched once and shared until it is due for refresh."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeDaraja)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.cache = caches['shared']
+        self.cache.clear()
+        FakeDaraja.token_hits = FakeDaraja.push_hits = 0
+        FakeDaraja.token_delay = 0
+        FakeDaraja.expires_in = '3599'
+        patcher = mock.patch.object(daraja_service, 'DARAJA_BASE_URL', self.base_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_is_reused_between_calls(self):
+        self.assertEqual(daraja_service.get_daraja_access_token(), 'token-1')
+        self.assertEqual(daraja_service.get_daraja_access_token(), 'token-1')
+        self.assertEqual(FakeDaraja.token_hits, 1)
+
+    def test_concurrent_callers_share_one_token_request(self):
+        FakeDaraja.token_delay = 0.2
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(daraja_service.get_daraja_access_token())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['token-1'] * 10)
+        self.assertEqual(FakeDaraja.token_hits, 1)
+
+    def test_token_is_refreshed_before_it_expires(self):
+        daraja_service.get_daraja_access_token()
+        entry = self.cache.get(daraja_service.TOKEN_CACHE_KEY)
+        entry['refresh_at'] = time.time() - 1
+        self.cache.set(daraja_service.TOKEN_CACHE_KEY, entry)
+        self.assertEqual(daraja_service.get_daraja_access_token(), 'token-2')
+        self.assertEqual(daraja_service.get_daraja_access_token(), 'token-2')
+        self.assertEqual(FakeDaraja.token_hits, 2)
+
+    def test_refresh_margin_follows_expires_in(self):
+        FakeDaraja.expires_in = '600'
+        started = time.time()
+        daraja_service.get_daraja_access_token()
+        entry = self.cache.get(daraja_service.TOKEN_CACHE_KEY)
+        self.assertAlmostEqual(entry['expires_at'] - started, 600, delta=2)
+        self.assertAlmostEqual(entry['refresh_at'] - started, 600 - daraja_service.TOKEN_REFRESH_MARGIN, delta=2)
+
+    def test_token_is_fetched_directly_when_the_cache_is_unavailable(self):
+        # E.g. the shared cache's table was never created.
+        broken = mock.Mock(**{'get.side_effect': ProgrammingError, 'set.side_effect': ProgrammingError})
+        with mock.patch.object(daraja_service, '_token_cache', return_value=broken):
+            self.assertEqual(daraja_service.get_daraja_access_token(), 'token-1')
+
+    def test_stk_pushes_share_the_cached_token(self):
+        for _ in range(3):
+            response = daraja_service.initiate_stk_push('0700000002', 1, 'AFYLNK1', 'Test')
+            self.assertEqual(response['token'], 'Bearer token-1')
+        self.assertEqual(FakeDaraja.push_hits, 3)
+        self.assertEqual(FakeDaraja.token_hits, 1)
+
+
+class FlakyUpstream(BaseHTTPRequestHandler):
+    """An upstream that answers every call with 503 and counts how often it was hit."""
+
+    hits = 0
+
+    def do_GET(self):
+        self._unavailable()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self._unavailable()
+
+    def _unavailable(self):
+        FlakyUpstream.hits += 1
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpClientTests(TestCase):
+    """Outbound calls retry only when safe, use per-endpoint timeouts and fail fast while an upstream is down."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyUpstream)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_port}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FlakyUpstream.hits = 0
+        self.clock = mock.patch('api.http_client.time.monotonic', return_value=1000.0).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def make_client(self, name='upstream'):
+        return HttpClient(name, retries=2, backoff_factor=0, failure_threshold=2, reset_timeout=30)
+
+    def test_only_idempotent_calls_are_retried(self):
+        client = HttpClient('upstream', retries=2, backoff_factor=0, failure_threshold=100)
+        self.assertEqual(client.get(self.url, 'status').status_code, 503)
+        self.assertEqual(FlakyUpstream.hits, 3)
+        FlakyUpstream.hits = 0
+        self.assertEqual(client.post(self.url, 'push', json={}).status_code, 503)
+        self.assertEqual(FlakyUpstream.hits, 1)
+
+    @override_settings(OUTBOUND_HTTP_TIMEOUTS={'upstream.slow': (3.05, 30), 'upstream': (3.05, 5)})
+    def test_timeouts_are_picked_per_endpoint(self):
+        client = self.make_client()
+        with mock.patch.object(client.session, 'request', return_value=mock.Mock(status_code=200)) as request:
+            client.get(self.url, 'slow')
+            client.get(self.url, 'fast')
+            client.get(self.url, 'fast', timeout=1)
+        self.assertEqual([call.kwargs['timeout'] for call in request.call_args_list], [(3.05, 30), (3.05, 5), 1])
+        self.assertEqual(self.make_client('other').timeout_for('slow'), DEFAULT_TIMEOUT)
+
+    def test_circuit_opens_then_lets_one_trial_through(self):
+        client = self.make_client()
+        client.post(self.url, 'push')
+        self.assertFalse(client.breaker.is_open)
+        client.post(self.url, 'push')
+        self.assertTrue(client.breaker.is_open)
+        with self.assertRaises(CircuitOpenError):
+            client.post(self.url, 'push')
+        self.assertEqual(FlakyUpstream.hits, 2)
+
+        # Half-open: the trial fails, so the circuit re-opens for another reset_timeout.
+        self.clock.return_value += 30
+        client.post(self.url, 'push')
+        self.assertEqual(FlakyUpstream.hits, 3)
+        with self.assertRaises(CircuitOpenError):
+            client.post(self.url, 'push')
+
+        # Half-open again: the trial succeeds and the circuit closes.
+        self.clock.return_value += 30
+        with mock.patch.object(client.session, 'request', return_value=mock.Mock(status_code=200)):
+            client.post(self.url, 'push')
+        self.assertFalse(client.breaker.is_open)
+
+    def test_trial_that_raises_unexpectedly_does_not_wedge_the_circuit(self):
+        client = self.make_client()
+        client.post(self.url, 'push')
+        client.post(self.url, 'push')
+        self.clock.return_value += 30
+        with mock.patch.object(client.session, 'request', side_effect=ValueError('bad header')):
+            with self.assertRaises(ValueError):
+                client.post(self.url, 'push')
+        self.clock.return_value += 30
+        client.post(self.url, 'push')
+        self.assertEqual(FlakyUpstream.hits, 3)
+
+
+class SmsOutboxTests(TestCase):
+    """Queued SMS go out in bulk calls per message body, with retries for transient failures."""
+
+    def test_recipients_sharing_a_body_go_out_in_one_call(self):
+        queue_sms(['0700000010', '0700000011', '0700000012'], 'Clinic closed today.')
+        queue_sms(['0700000013'], 'Your code is 123456.', kind=SmsMessage.Kind.OTP)
+        transport = LocalTransport()
+        self.assertEqual(send_sms_batch(claim_sms(100), transport), 4)
+        self.assertEqual(sorted(len(recipients) for _, recipients in transport.sent), [1, 3])
+        self.assertIn('+254700000010', transport.sent[0][1] + transport.sent[1][1])
+        self.assertFalse(SmsMessage.objects.exclude(status=SmsMessage.SmsStatus.SENT).exists())
+
+    def test_transient_failures_are_retried_and_permanent_ones_recorded(self):
+        queue_sms(['0700000020', '0700000021', '0700000022'], 'Reminder')
+        transport = LocalTransport(fail={'+254700000021': ('GatewayError', True), '+254700000022': ('InvalidPhoneNumber', False)})
+        send_sms_batch(claim_sms(100), transport)
+        statuses = dict(SmsMessage.objects.values_list('phone_number', 'status'))
+        self.assertEqual(statuses, {
+            '+254700000020': SmsMessage.SmsStatus.SENT,
+            '+254700000021': SmsMessage.SmsStatus.QUEUED,
+            '+254700000022': SmsMessage.SmsStatus.FAILED,
+        })
+        retry = SmsMessage.objects.get(phone_number='+254700000021')
+        self.assertGreater(retry.send_after, retry.created_at)
+        # Not due yet, so nothing is claimed.
+        self.assertEqual(claim_sms(100), [])
+
+    def test_one_malformed_number_does_not_fail_the_bulk_call(self):
+        def fake_send_bulk_sms(message, recipients, sender=None):
+            # Like the SDK, refuse the whole call over one number it dislikes.
+            if '+254799999999' in recipients:
+                raise ValueError('Invalid phone number: +254799999999')
+            return [{'number': number, 'statusCode': 101, 'status': 'Success', 'messageId': 'ATX'} for number in recipients]
+
+        queue_sms(['0700000030', 'not-a-number', '0799999999'], 'Reminder')
+        with mock.patch('api.sms.send_bulk_sms', side_effect=fake_send_bulk_sms) as send:
+            self.assertEqual(send_sms_batch(claim_sms(100), AfricasTalkingTransport()), 1)
+        self.assertNotIn('not-a-number', send.call_args_list[0].args[1])
+        statuses = dict(SmsMessage.objects.values_list('phone_number', 'status'))
+        self.assertEqual(statuses, {
+            '+254700000030': SmsMessage.SmsStatus.SENT,
+            'not-a-number': SmsMessage.SmsStatus.FAILED,
+            '+254799999999': SmsMessage.SmsStatus.FAILED,
+        })
+
+    def test_login_codes_are_redacted_once_sent_and_hidden_from_the_admin(self):
+        queue_sms(['0700000040'], 'Your code is 123456.', kind=SmsMessage.Kind.OTP)
+        queue_sms(['0700000041'], 'Reminder')
+        send_sms_batch(claim_sms(100), LocalTransport())
+        self.assertEqual(SmsMessage.objects.get(kind=SmsMessage.Kind.OTP).body, REDACTED)
+        self.assertEqual(SmsMessage.objects.get(kind=SmsMessage.Kind.OTHER).body, 'Reminder')
+        request = RequestFactory().get('/admin/api/smsmessage/')
+        self.assertQuerySetEqual(
+            admin.site._registry[SmsMessage].get_queryset(request).values_list('kind', flat=True), ['other'],
+        )
+
+    def test_rate_limiter_spaces_out_batches(self):
+        limiter = RateLimiter(50)
+        started = time.monotonic()
+        for _ in range(3):
+            limiter.acquire(50)
+        self.assertGreaterEqual(time.monotonic() - started, 1.9)
+
+
+class OtpLoginTests(TestCase):
+    """Login codes live hashed outside the User table, work once and are rate limited."""
+
+    phone_number = '0700000030'
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create(phone_number=cls.phone_number)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_request_and_verify_do_not_write_the_user_row(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/user/request-login/', {'phone_number': self.phone_number})
+            self.assertEqual(response.status_code, 200)
+            code = re.search(r'\d{6}', SmsMessage.objects.get(kind=SmsMessage.Kind.OTP).body).group()
+            self.assertNotIn(code, OtpCode.objects.get(phone_number=self.phone_number).code_hash)
+            response = self.client.post('/api/user/verify-login/', {'phone_number': self.phone_number, 'otp': code})
+        user_updates = re.compile(rf'^UPDATE\W+{User._meta.db_table}\W')
+        self.assertFalse([query for query in queries if user_updates.match(query['sql'])])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        # One time only.
+        response = self.client.post('/api/user/verify-login/', {'phone_number': self.phone_number, 'otp': code})
+        self.assertEqual(response.status_code, 400)
+
+    def test_wrong_codes_lock_the_code(self):
+        code = issue_otp(self.phone_number)
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(5):
+            self.assertFalse(verify_otp(self.phone_number, wrong))
+        with self.assertRaises(OtpLocked):
+            verify_otp(self.phone_number, code)
+
+    def test_requests_are_throttled_per_phone_number(self):
+        for _ in range(3):
+            issue_otp(self.phone_number)
+        with self.assertRaises(OtpThrottled):
+            issue_otp(self.phone_number)
+        response = self.client.post('/api/user/request-login/', {'phone_number': self.phone_number})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '600')
+
+    def test_database_fallback_when_the_cache_is_down(self):
+        broken = mock.Mock(**{'add.side_effect': ConnectionError('cache down')})
+        with mock.patch('api.otp._cache', return_value=broken):
+            code = issue_otp(self.phone_number)
+            self.assertTrue(OtpCode.objects.filter(phone_number=self.phone_number).exists())
+            self.assertTrue(verify_otp(self.phone_number, code))
+            self.assertFalse(verify_otp(self.phone_number, code))
+
+    @override_settings(CACHES={
+        'worker1': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker1'},
+        'worker2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'worker2'},
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    })
+    def test_code_issued_by_one_worker_verifies_on_another(self):
+        # Two per-process caches stand in for two workers; neither can hold
+        # codes both see, so the database is used.
+        with self.settings(OTP_CACHE_ALIAS='worker1'):
+            code = issue_otp(self.phone_number)
+        with self.settings(OTP_CACHE_ALIAS='worker2'):
+            self.assertTrue(verify_otp(self.phone_number, code))
+        self.assertIsNone(caches['worker1'].get(f'otp:code:{self.phone_number}'))
+
+
+class ThrottlingTests(TestCase):
+    """Public endpoints spend tokens per client and reject the excess before touching the database."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_lookup_is_rejected_without_queries_once_the_bucket_is_empty(self):
+        for _ in range(30):
+            self.assertEqual(self.client.get('/api/check-username/', {'username': 'nurse'}).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/check-username/', {'username': 'nurse'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertIn('throttle_checks_total{scope="lookup",result="throttled"}', render_metrics())
+
+    def test_forged_forwarded_for_entries_share_the_client_bucket(self):
+        # The proxy appends the address it saw; anything before that is the client's to invent.
+        for i in range(30):
+            self.client.get('/api/check-username/', {'username': 'nurse'}, HTTP_X_FORWARDED_FOR=f'10.9.9.{i}, 10.0.0.1')
+        response = self.client.get('/api/check-username/', {'username': 'nurse'}, HTTP_X_FORWARDED_FOR='10.9.9.99, 10.0.0.1')
+        self.assertEqual(response.status_code, 429)
+        response = self.client.get('/api/check-username/', {'username': 'nurse'}, HTTP_X_FORWARDED_FOR='10.0.0.2')
+        self.assertEqual(response.status_code, 200)
+
+    def test_ussd_buckets_are_per_phone_number(self):
+        with mock.patch('api.views.UssdSession') as session:
+            session.return_value.handle.return_value = 'CON Welcome'
+            for _ in range(30):
+                self.client.post('/api/ussd/', {'sessionId': 's1', 'phoneNumber': '+254700000040', 'text': ''})
+            response = self.client.post('/api/ussd/', {'sessionId': 's1', 'phoneNumber': '+254700000040', 'text': ''})
+            self.assertTrue(response.data.startswith('END'))
+            response = self.client.post('/api/ussd/', {'sessionId': 's2', 'phoneNumber': '+254700000041', 'text': ''})
+            self.assertEqual(response.data, 'CON Welcome')
+
+
+class AccountLookupTests(TestCase):
+    """Availability checks ignore case, are cached, and see new registrations straight away."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_repeated_checks_are_served_from_the_cache(self):
+        AuthUser.objects.create_user('Wanjiku', email='Wanjiku@example.com')
+        with self.assertNumQueries(1):
+            for _ in range(3):
+                response = self.client.get('/api/check-username/', {'username': 'wanjiku'})
+                self.assertTrue(response.data['exists'])
+        self.assertTrue(self.client.get('/api/check-email/', {'email': 'WANJIKU@example.com'}).data['exists'])
+
+    def test_registration_clears_a_cached_miss(self):
+        self.assertFalse(self.client.get('/api/check-username/', {'username': 'otieno'}).data['exists'])
+        AuthUser.objects.create_user('Otieno')
+        self.assertTrue(self.client.get('/api/check-username/', {'username': 'otieno'}).data['exists'])
+
+
+class LogRedactionTests(TestCase):
+    """Secrets and one-time codes are masked before a log record reaches any handler."""
+
+    def test_passwords_tokens_and_otps_are_masked(self):
+        record = logging.LogRecord(
+            'api', logging.INFO, __file__, 0, "Registering %s with %s", ('agent1', {'password': 'hunter2'}), None,
+        )
+        record.authorization = 'Bearer abc'
+        RedactSecretsFilter().filter(record)
+        self.assertEqual(record.getMessage(), "Registering agent1 with {'password': [REDACTED]}")
+        self.assertEqual(record.authorization, '[REDACTED]')
+        self.assertEqual(
+            redact("Your AfyaLink verification code is 123456. Header: Bearer eyJ.abc"),
+            "Your AfyaLink verification code is [REDACTED]. Header: Bearer [REDACTED]",
+        )
+        self.assertEqual(json.loads(JsonFormatter().format(record))['authorization'], '[REDACTED]')
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='RCP123', amount=100):
+    """An STK push callback body as Safaricom posts it."""
+    callback = {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code, 'ResultDesc': 'Result'}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'TransactionDate', 'Value': 20261017120000},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class DarajaCallbackTests(TestCase):
+    """Stored callbacks are applied once each, however often Safaricom repeats them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create(phone_number='0700000050')
+        cls.case = Case.objects.create(user=cls.patient, symptom_input='fever', checkout_request_id='ws_CO_1')
+        PaymentAttempt.objects.create(
+            case=cls.case, phone_number='0700000050', amount=100, checkout_request_id='ws_CO_1',
+            status=PaymentAttempt.AttemptStatus.SENT,
+        )
+
+    def receive(self, payload, copies=1):
+        for _ in range(copies):
+            DarajaCallback.objects.create(
+                checkout_request_id=payload['Body']['stkCallback']['CheckoutRequestID'], payload=payload,
+            )
+
+    def test_duplicates_in_one_batch_are_applied_once(self):
+        self.receive(stk_callback('ws_CO_1', result_code=1032), copies=3)
+        self.assertEqual(process_callbacks(10), 3)
+        self.assertEqual(CaseHistory.objects.filter(case=self.case, description__startswith='Payment failed').count(), 1)
+        self.assertEqual(
+            sorted(DarajaCallback.objects.values_list('status', flat=True)),
+            ['done', 'duplicate', 'duplicate'],
+        )
+
+    def test_callback_before_the_push_result_is_retried(self):
+        attempt = PaymentAttempt.objects.create(
+            case=self.case, phone_number='0700000050', amount=100, status=PaymentAttempt.AttemptStatus.SENDING,
+        )
+        self.receive(stk_callback('ws_CO_2', receipt='RCP200'))
+        process_callbacks(10)
+        callback = DarajaCallback.objects.get()
+        self.assertEqual((callback.status, callback.attempts), ('pending', 1))
+        self.assertGreater(callback.process_after, timezone.now())
+        self.assertEqual(process_callbacks(10), 0)  # not due yet
+
+        record_push_result(attempt, {'ResponseCode': '0', 'CheckoutRequestID': 'ws_CO_2'})
+        DarajaCallback.objects.update(process_after=timezone.now())
+        self.assertEqual(process_callbacks(10), 1)
+        self.assertEqual(DarajaCallback.objects.get().status, 'done')
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.status, Case.CaseStatus.PAID)
+
+    def test_unknown_checkout_request_fails_after_max_attempts(self):
+        self.receive(stk_callback('ws_CO_unknown'))
+        DarajaCallback.objects.update(attempts=CALLBACK_MAX_ATTEMPTS - 1)
+        process_callbacks(10)
+        self.assertEqual(DarajaCallback.objects.get().status, 'failed')
+
+    def test_earlier_push_is_applied_after_a_repush(self):
+        Case.objects.filter(pk=self.case.pk).update(checkout_request_id='ws_CO_3')
+        self.receive(stk_callback('ws_CO_1'))
+        process_callbacks(10)
+        self.assertEqual(DarajaCallback.objects.get().status, 'done')
+        self.assertTrue(self.case.payments.filter(mpesa_receipt_number='RCP123').exists())
+
+
+class PaymentApiTests(TestCase):
+    """Payments are queued with a 202 and polled through the attempt status endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create(phone_number='0700000052')
+        cls.case = Case.objects.create(user=cls.patient, symptom_input='fever')
+        cls.patient_login = AuthUser.objects.create_user('0700000052')
+        cls.other_login = AuthUser.objects.create_user('0700000053')
+        cls.staff_login = AuthUser.objects.create_user('staff', is_staff=True)
+
+    def api(self, login=None):
+        client = APIClient()
+        if login is not None:
+            client.force_authenticate(login)
+        return client
+
+    def test_initiating_a_payment_queues_an_attempt(self):
+        response = self.api(self.patient_login).post('/api/initiate-payment/', {'case_id': self.case.pk}, format='json')
+        self.assertEqual(response.status_code, 202)
+        attempt = PaymentAttempt.objects.get()
+        self.assertEqual(response.data, {
+            'attempt_id': attempt.attempt_id,
+            'status': 'pending',
+            'status_url': f'/api/payments/attempts/{attempt.attempt_id}/',
+        })
+        self.assertEqual(
+            (attempt.case, attempt.requested_by, attempt.phone_number, attempt.amount),
+            (self.case, self.patient_login, '0700000052', 1),
+        )
+
+    def test_in_flight_attempt_is_returned_instead_of_a_second_push(self):
+        client = self.api(self.patient_login)
+        first = client.post('/api/initiate-payment/', {'case_id': self.case.pk}, format='json')
+        PaymentAttempt.objects.update(status=PaymentAttempt.AttemptStatus.SENDING)
+        again = client.post('/api/initiate-payment/', {'case_id': self.case.pk}, format='json')
+        self.assertEqual(again.status_code, 202)
+        self.assertEqual((again.data['attempt_id'], again.data['status']), (first.data['attempt_id'], 'sending'))
+        self.assertEqual(PaymentAttempt.objects.count(), 1)
+
+        # Once that push has failed, the patient can try again.
+        PaymentAttempt.objects.update(status=PaymentAttempt.AttemptStatus.FAILED)
+        retry = client.post('/api/initiate-payment/', {'case_id': self.case.pk}, format='json')
+        self.assertNotEqual(retry.data['attempt_id'], first.data['attempt_id'])
+
+    def test_initiating_needs_a_known_case(self):
+        client = self.api(self.patient_login)
+        self.assertEqual(client.post('/api/initiate-payment/', {}, format='json').status_code, 400)
+        self.assertEqual(client.post('/api/initiate-payment/', {'case_id': 999999}, format='json').status_code, 404)
+        self.assertFalse(PaymentAttempt.objects.exists())
+
+    def test_attempt_status_is_visible_to_its_patient_and_staff_only(self):
+        attempt = PaymentAttempt.objects.create(
+            case=self.case, phone_number='0700000052', amount=1, checkout_request_id='ws_CO_9',
+            status=PaymentAttempt.AttemptStatus.SENT,
+        )
+        url = f'/api/payments/attempts/{attempt.attempt_id}/'
+        response = self.api(self.patient_login).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            set(response.data),
+            {'attempt_id', 'case', 'status', 'checkout_request_id', 'error', 'created_at', 'sent_at', 'finished_at'},
+        )
+        self.assertEqual(
+            (response.data['case'], response.data['status'], response.data['checkout_request_id']),
+            (self.case.pk, 'sent', 'ws_CO_9'),
+        )
+        self.assertEqual(self.api(self.staff_login).get(url).status_code, 200)
+        self.assertEqual(self.api(self.other_login).get(url).status_code, 404)
+        self.assertEqual(self.api().get(url).status_code, 401)
+
+
+class AutoAssignTests(TestCase):
+    """New cases go to the least busy agent, and never away from one who already has them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create(phone_number='0700000060')
+        cls.busy = Agent.objects.create(user=AuthUser.objects.create_user('busy'), full_name='Busy', open_cases=3)
+        cls.idle = Agent.objects.create(user=AuthUser.objects.create_user('idle'), full_name='Idle')
+
+    def test_case_goes_to_the_least_busy_agent(self):
+        case = Case.objects.create(user=self.patient, symptom_input='cough')
+        auto_assign_case(case.case_id)
+        case.refresh_from_db()
+        self.assertEqual((case.agent, case.status), (self.idle, Case.CaseStatus.ASSIGNED))
+        self.idle.refresh_from_db()
+        self.assertEqual(self.idle.open_cases, 1)
+
+    def test_closing_a_case_with_a_drifted_counter_still_saves(self):
+        case = Case.objects.create(user=self.patient, symptom_input='cough', agent=self.idle)
+        Agent.objects.filter(pk=self.idle.pk).update(open_cases=0)
+        case.status = Case.CaseStatus.CLOSED
+        case.save()
+        self.idle.refresh_from_db()
+        self.assertEqual(self.idle.open_cases, 0)
+
+    def test_admin_forms_cannot_write_the_workload_counter(self):
+        request = RequestFactory().get('/admin/')
+        request.user = AuthUser(is_staff=True, is_superuser=True)
+        inline = admin.site._registry[AuthUser].get_inline_instances(request)[0]
+        self.assertNotIn('open_cases', inline.get_formset(request).form.base_fields)
+        self.assertNotIn('open_cases', admin.site._registry[Agent].get_form(request).base_fields)
+
+    def test_case_assigned_meanwhile_is_left_alone(self):
+        case = Case.objects.create(user=self.patient, symptom_input='cough')
+        Case.objects.filter(pk=case.pk).update(agent=self.busy, status=Case.CaseStatus.ASSIGNED)
+        auto_assign_case(case.case_id)
+        case.refresh_from_db()
+        self.assertEqual(case.agent, self.busy)
+        self.assertFalse(case.history.exists())
+
+
+class AssignPendingCasesTests(TestCase):
+    """Queued cases go out most urgent and oldest first, each to the least loaded agent."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create(phone_number='0700000061')
+
+    def queue_case(self, urgency, minutes_ago):
+        case = Case.objects.create(user=self.patient, symptom_input='cough', ai_urgency=urgency)
+        Case.objects.filter(pk=case.pk).update(created_at=timezone.now() - timedelta(minutes=minutes_ago))
+        return case
+
+    def test_cases_go_out_by_urgency_then_age_to_the_least_loaded_agent(self):
+        low = self.queue_case('Low', 50)
+        untriaged = self.queue_case(None, 60)
+        high_new = self.queue_case('High', 5)
+        high_old = self.queue_case('High', 30)
+        moderate = self.queue_case('Moderate', 40)
+        busy = Agent.objects.create(user=AuthUser.objects.create_user('busy'), full_name='Busy', open_cases=2)
+        idle = Agent.objects.create(user=AuthUser.objects.create_user('idle'), full_name='Idle')
+        Agent.objects.create(user=AuthUser.objects.create_user('away', is_active=False), full_name='Away')
+
+        self.assertEqual(assign_pending_cases(), 5)
+
+        # Idle takes the first two (0 -> 1 -> 2), then ties with Busy go to
+        # the older agent: Busy, Idle, Busy.
+        expected = {high_old: idle, high_new: idle, moderate: busy, low: idle, untriaged: busy}
+        for case, agent in expected.items():
+            case.refresh_from_db()
+            self.assertEqual((case.agent, case.status), (agent, Case.CaseStatus.ASSIGNED), case.ai_urgency)
+            self.assertEqual(
+                list(case.history.values_list('description', flat=True)),
+                [f"Case automatically assigned to agent {agent.full_name}."],
+            )
+        busy.refresh_from_db()
+        idle.refresh_from_db()
+        self.assertEqual((busy.open_cases, idle.open_cases), (4, 3))
+
+    def test_backlog_is_assigned_in_batches(self):
+        low = self.queue_case('Low', 30)
+        high = self.queue_case('High', 10)
+        moderate = self.queue_case('Moderate', 20)
+        agent = Agent.objects.create(user=AuthUser.objects.create_user('solo'), full_name='Solo')
+
+        self.assertEqual(assign_pending_cases(batch_size=2), 2)
+        self.assertEqual(set(Case.objects.filter(agent=agent)), {high, moderate})
+        self.assertEqual(assign_pending_cases(batch_size=2), 1)
+        self.assertEqual(assign_pending_cases(batch_size=2), 0)
+        low.refresh_from_db()
+        agent.refresh_from_db()
+        self.assertEqual((low.agent, agent.open_cases), (agent, 3))
+
+    def test_cases_stay_queued_without_an_active_agent(self):
+        case = self.queue_case('High', 10)
+        with self.assertLogs('api.auto_assign', 'WARNING'):
+            self.assertEqual(assign_pending_cases(), 0)
+        case.refresh_from_db()
+        self.assertIsNone(case.agent)
+
+    def test_approving_an_agent_leaves_the_backlog_to_the_worker(self):
+        case = self.queue_case('High', 10)
+        auth_user = AuthUser.objects.create_user('new', is_active=False)
+        agent = Agent.objects.create(user=auth_user, full_name='New')
+        client = APIClient()
+        client.force_authenticate(AuthUser.objects.create_user('admin', is_staff=True))
+        response = client.post(f'/api/agents/{agent.pk}/approve/')
+        self.assertEqual(response.status_code, 200)
+        case.refresh_from_db()
+        self.assertIsNone(case.agent)
+
+        call_command('triage_worker', once=True, stdout=StringIO())
+        case.refresh_from_db()
+        self.assertEqual(case.agent, agent)
+
+
+class EventBrokerTests(TestCase):
+    """Live events reach subscribers whichever process published them."""
+
+    async def test_event_published_by_another_broker_reaches_the_subscriber(self):
+        # Two brokers stand in for two processes: a worker publishing, the web process streaming.
+        publisher, subscriber = DatabaseBroker(), DatabaseBroker(poll_interval=0.01)
+        await sync_to_async(publisher.publish)('status_changed', {'case_id': 1}, ['agent:2'])
+        await sync_to_async(publisher.publish)('case_assigned', {'case_id': 2}, ['agent:1', 'staff'])
+        stream = subscriber.subscribe(['agent:1'], last_event_id=0, heartbeat=60)
+        event = await asyncio.wait_for(anext(stream), 5)
+        await stream.aclose()
+        self.assertEqual((event['type'], event['data']), ('case_assigned', {'case_id': 2}))
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_cache_broker_refuses_a_per_process_cache(self):
+        with self.assertRaises(ImproperlyConfigured):
+            CacheBroker(alias='default')
+
+
+def keyword_loop_triage(symptom_text):
+    """The per-keyword substring checks the compiled matcher replaced, in their original rule order."""
+    text = symptom_text.lower()
+    urgency, category = "Low", "General Inquiry"
+    if any(word in text for word in ai_service.severity_modifiers) and any(word in text for word in ai_service.severity_targets):
+        urgency = "High"
+    elif any(word in text for word in ai_service.high_urgency_keywords):
+        urgency = "High"
+    elif any(word in text for word in ai_service.moderate_urgency_keywords):
+        urgency = "Moderate"
+    if any(word in text for word in ai_service.respiratory_keywords):
+        category = "Respiratory Issue"
+    elif any(word in text for word in ai_service.digestive_keywords):
+        category = "Digestive Issue"
+    elif any(word in text for word in ai_service.injury_keywords):
+        category = "Injury / Pain"
+    return urgency, category
+
+
+class AiTriageTests(TestCase):
+    """The compiled keyword matcher triages exactly as the per-keyword loop did."""
+
+    TEXTS = [
+        # Overlapping keywords: one is a prefix of, or inside, another.
+        'chest pain', 'breathing difficulty', 'breathing fine', 'stomach cramps', 'stomach ache',
+        'head injury', 'headache', 'a headache after a head injury', 'back pain and bleeding',
+        # No word boundaries, as before: keywords match inside other words.
+        'acute thirst', 'I was scolded', 'influenza', 'unbearablepain', 'painful knee', 'feverish',
+        "CAN'T BREATHE", 'coughcoughcough',
+        # Urgency precedence.
+        'severe headache', 'intense cough', 'extreme rash and choking', 'mild pain', 'unbearable bleeding',
+        'severe itching', 'dizzy with diarrhea',
+        # Nothing to match.
+        '', 'feeling tired', 'x' * 200,
+    ]
+
+    def test_matcher_agrees_with_the_keyword_loop(self):
+        for text in self.TEXTS:
+            with self.subTest(text=text):
+                result = ai_service.get_ai_triage_for_symptoms(text)
+                self.assertEqual((result['ai_urgency'], result['ai_category']), keyword_loop_triage(text))
+
+    def test_every_keyword_pair_agrees_with_the_keyword_loop(self):
+        keywords = sorted({word for words in ai_service.KEYWORD_GROUPS.values() for word in words})
+        for first in keywords:
+            for second in keywords:
+                text = f'{first} {second}'
+                result = ai_service.get_ai_triage_for_symptoms(text)
+                self.assertEqual((result['ai_urgency'], result['ai_category']), keyword_loop_triage(text), text)
+
+    def test_triage_many_matches_one_at_a_time(self):
+        texts = self.TEXTS + self.TEXTS[:5]
+        results = ai_service.triage_many(texts)
+        self.assertEqual(len(results), len(texts))
+        for text, result in zip(texts, results):
+            self.assertEqual(result, ai_service.get_ai_triage_for_symptoms(text))
+
+
+class TriageQueueTests(TestCase):
+    """Jobs abandoned by a dead worker are retried, but only up to TRIAGE_MAX_ATTEMPTS."""
+
+    def test_stale_jobs_use_up_an_attempt_when_reclaimed(self):
+        patient = User.objects.create(phone_number='0700000070')
+        long_ago = timezone.now() - timedelta(hours=1)
+        retried = TriageJob.objects.create(
+            case=Case.objects.create(user=patient, symptom_input='fever'),
+            status=TriageJob.JobStatus.RUNNING, started_at=long_ago,
+        )
+        exhausted = TriageJob.objects.create(
+            case=Case.objects.create(user=patient, symptom_input='cough'),
+            status=TriageJob.JobStatus.RUNNING, started_at=long_ago, attempts=TRIAGE_MAX_ATTEMPTS - 1,
+        )
+        self.assertEqual([job.pk for job in claim_triage_jobs(10)], [retried.pk])
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((retried.status, retried.attempts), (TriageJob.JobStatus.RUNNING, 1))
+        self.assertEqual((exhausted.status, exhausted.attempts), (TriageJob.JobStatus.FAILED, TRIAGE_MAX_ATTEMPTS))
+
+
+class UssdFlowTests(TestCase):
+    """Every path through the menu graph, invalid input, and gateway retries of a hop."""
+
+    def setUp(self):
+        invalidate_menu_cache()
+        self.store = LocalMemorySessionStore()
+
+    def hops(self, session_id, phone_number, *texts):
+        session = UssdSession(session_id, phone_number, store=self.store)
+        return [session.handle(text) for text in texts]
+
+    def test_every_menu_path_creates_a_case_with_its_choices(self):
+        for language_choice, language_code in (('1', 'en'), ('2', 'sw')):
+            for declaration_choice, status_code in (('1', 'standard'), ('2', 'small_fee'), ('3', 'cannot_pay')):
+                with self.subTest(language=language_code, declaration=status_code):
+                    phone_number = f'07000008{language_choice}{declaration_choice}'
+                    chain = f'{language_choice}*{declaration_choice}'
+                    screens = self.hops(
+                        f'path-{chain}', phone_number, '', language_choice, chain, f'{chain}*headache',
+                    )
+                    case = Case.objects.select_related('case_language', 'case_payment_declaration').get(
+                        user__phone_number=phone_number,
+                    )
+                    self.assertEqual(screens[:3], [
+                        get_menu_text('welcome_menu', 'en'),
+                        get_menu_text('payment_declaration_menu', language_code),
+                        get_menu_text('enter_symptom_menu', language_code),
+                    ])
+                    self.assertEqual(screens[3], get_menu_text('case_created_success', language_code).format(case_id=case.case_id))
+                    self.assertEqual(
+                        (case.symptom_input, case.case_language.language_code, case.case_payment_declaration.status_code),
+                        ('headache', language_code, status_code),
+                    )
+                    self.assertTrue(TriageJob.objects.filter(case=case).exists())
+
+    def test_invalid_selections_end_the_session_without_a_case(self):
+        self.assertEqual(self.hops('bad-root', '0700000901', '', '9'), [
+            get_menu_text('welcome_menu', 'en'), get_menu_text('invalid_selection_menu', 'en'),
+        ])
+        # Input after an invalid selection stays invalid, in the chosen language.
+        self.assertEqual(self.hops('bad-declaration', '0700000902', '2', '2*7', '2*7*fever')[1:], [
+            get_menu_text('invalid_selection_menu', 'sw'), get_menu_text('invalid_selection_menu', 'sw'),
+        ])
+        self.assertFalse(Case.objects.filter(user__phone_number__in=['0700000901', '0700000902']).exists())
+
+    def test_gateway_retry_of_a_hop_is_answered_again_without_side_effects(self):
+        screens = self.hops('retry', '0700000903', '', '1', '1', '1*1', '1*1*fever', '1*1*fever')
+        self.assertEqual(screens[1], screens[2])
+        self.assertEqual(screens[4], screens[5])
+        self.assertEqual(Case.objects.filter(user__phone_number='0700000903').count(), 1)
+
+    def test_lost_session_replays_the_chain_and_only_the_last_step_acts(self):
+        # E.g. another worker with its own store, or an expired session.
+        screen, = self.hops('lost', '0700000904', '1*3*cough')
+        case = Case.objects.get(user__phone_number='0700000904')
+        self.assertEqual(screen, get_menu_text('case_created_success', 'en').format(case_id=case.case_id))
+        self.assertEqual(case.case_payment_declaration.status_code, 'cannot_pay')
+
+    def test_gateway_request_gets_the_welcome_screen(self):
+        response = APIClient().post('/api/ussd/', {'sessionId': 'view', 'phoneNumber': '0700000905', 'text': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, get_menu_text('welcome_menu', 'en'))
+
+
+class UssdMenuGraphTests(TestCase):
+    """The menu graph compiler rejects graphs the session could not walk."""
+
+    def node(self, pk, parent, choice, menu_key='welcome_menu'):
+        return UssdMenuNode(pk=pk, parent_id=parent, choice=choice, menu_key=menu_key)
+
+    def test_paths_follow_the_choices_from_the_root(self):
+        graph = compile_menu_graph([self.node(3, 2, ANY_INPUT), self.node(2, 1, '1'), self.node(1, None, '')])
+        self.assertEqual(sorted(graph), [(), ('1',), ('1', ANY_INPUT)])
+
+    def test_broken_graphs_are_rejected(self):
+        broken = {
+            'no root': [],
+            'cycle': [self.node(1, None, ''), self.node(2, 3, '1'), self.node(3, 2, '1')],
+            'unknown parent': [self.node(1, None, ''), self.node(2, 9, '1')],
+            'duplicate path': [self.node(1, None, ''), self.node(2, 1, '1'), self.node(3, 1, '1')],
+        }
+        for problem, nodes in broken.items():
+            with self.subTest(problem), self.assertRaises(ImproperlyConfigured):
+                compile_menu_graph(nodes)
+
+
+@mock.patch('api.case_changes.SETTLE_DELAY', timedelta(0))
+class CaseChangesFeedTests(TestCase):
+    """The change feed hands out each change once, in (updated_at, case_id) order, across pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create(phone_number='0700000080')
+        cls.agents = [
+            Agent.objects.create(user=AuthUser.objects.create_user(f'feed-agent{i}'), full_name=f'Feed Agent {i}')
+            for i in range(2)
+        ]
+        cls.cases = [Case.objects.create(user=cls.patient, symptom_input=f'feed {i}') for i in range(3)]
+
+    def setUp(self):
+        # Start from a quiet feed: nothing changed in the last ten minutes.
+        self.start = timezone.now() - timedelta(minutes=10)
+        Case.objects.update(updated_at=self.start - timedelta(minutes=1))
+
+    def poll(self, token, limit=CHANGES_LIMIT):
+        return get_case_changes(Case.objects.all(), CaseTombstone.objects.all(), token, limit=limit)
+
+    def changed_ids(self, feed):
+        return [case['case_id'] for case in feed['changes']]
+
+    def test_first_call_returns_only_a_token_for_now(self):
+        feed = self.poll(None)
+        self.assertEqual((feed['changes'], feed['tombstones']), ([], []))
+        self.assertEqual(self.changed_ids(self.poll(feed['token'])), [])
+
+    def test_each_change_is_returned_once(self):
+        Case.objects.filter(pk=self.cases[1].pk).update(updated_at=self.start + timedelta(minutes=1))
+        feed = self.poll(encode_token(self.start, 0, 0))
+        self.assertEqual(self.changed_ids(feed), [self.cases[1].pk])
+        self.assertEqual(self.changed_ids(self.poll(feed['token'])), [])
+
+    def test_pages_do_not_skip_or_repeat_cases_sharing_a_timestamp(self):
+        Case.objects.update(updated_at=self.start + timedelta(minutes=1))
+        first = self.poll(encode_token(self.start, 0, 0), limit=2)
+        second = self.poll(first['token'], limit=2)
+        self.assertEqual((self.changed_ids(first), first['has_more']), ([case.pk for case in self.cases[:2]], True))
+        self.assertEqual((self.changed_ids(second), second['has_more']), ([self.cases[2].pk], False))
+
+    def test_unsettled_changes_wait_for_a_later_poll(self):
+        token = encode_token(self.start, 0, 0)
+        with mock.patch('api.case_changes.SETTLE_DELAY', timedelta(minutes=5)):
+            Case.objects.filter(pk=self.cases[0].pk).update(updated_at=timezone.now())
+            feed = self.poll(token)
+        self.assertEqual(self.changed_ids(feed), [])
+        self.assertEqual(self.changed_ids(self.poll(feed['token'])), [self.cases[0].pk])
+
+    def test_reassignments_and_new_history_are_changes(self):
+        token = self.poll(None)['token']
+        case = self.cases[0]
+        case.agent = self.agents[0]
+        case.save()
+        case.agent = self.agents[1]
+        case.save()
+        # A failed payment adds history without otherwise changing the case.
+        PaymentAttempt.objects.create(
+            case=self.cases[2], phone_number='0700000080', amount=100, checkout_request_id='ws_CO_feed',
+        )
+        DarajaCallback.objects.create(checkout_request_id='ws_CO_feed', payload=stk_callback('ws_CO_feed', result_code=1032))
+        process_callbacks(10)
+        feed = self.poll(token)
+        self.assertEqual(sorted(self.changed_ids(feed)), [self.cases[0].pk, self.cases[2].pk])
+        self.assertEqual(
+            [(item['case_id'], item['reason']) for item in feed['tombstones']],
+            [(case.pk, CaseTombstone.Reason.REASSIGNED)],
+        )
+
+    def test_expired_and_malformed_tokens_are_rejected(self):
+        with self.assertRaises(ChangeTokenExpired):
+            self.poll(encode_token(timezone.now() - timedelta(days=30), 0, 0))
+        client = APIClient()
+        client.force_authenticate(AuthUser.objects.create_user('feed-staff', is_staff=True))
+        self.assertEqual(client.get('/api/cases/changes/', {'since': 'not-a-token'}).status_code, 400)
+
+
+class ReconcileStatementTests(TestCase):
+    """reconcile_mpesa_statement against small statement exports."""
+
+    @classmethod
+    def setUpTestData(cls):
+        patient = User.objects.create(phone_number='0700000090')
+        cls.unrecorded, cls.underpaid, cls.recorded_case, cls.statement_case, cls.unlisted = [
+            Case.objects.create(user=patient, symptom_input=f'statement {i}', status=Case.CaseStatus.PAYMENT_PENDING)
+            for i in range(5)
+        ]
+        paid_at = timezone.make_aware(datetime(2026, 10, 17, 12, 30))
+        for case, receipt, amount in (
+            (cls.underpaid, 'RCP002', 100), (cls.recorded_case, 'RCP003', 100), (cls.unlisted, 'RCP004', 100),
+        ):
+            Payment.objects.create(case=case, mpesa_receipt_number=receipt, amount=amount, transaction_date=paid_at)
+
+    def statement(self, rows):
+        """Writes an M-Pesa statement export (with its preamble) and returns its path."""
+        statement = tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', encoding='utf-8', delete=False)
+        self.addCleanup(os.remove, statement.name)
+        with statement:
+            statement.write('M-PESA STATEMENT\nShortcode: 174379\n')
+            writer = csv.writer(statement)
+            writer.writerow(['Receipt No.', 'Completion Time', 'Paid In', 'A/C No.', 'Transaction Status'])
+            writer.writerows(rows)
+        return statement.name
+
+    def reconcile(self, path, **options):
+        out = StringIO()
+        call_command('reconcile_mpesa_statement', path, skip_rows=2, stdout=out, **options)
+        return {
+            match.group(1): int(match.group(2))
+            for match in re.finditer(r'^  (\w+): (\d+)$', out.getvalue(), re.MULTILINE)
+        }
+
+    def test_mismatches_are_reported_by_kind(self):
+        path = self.statement([
+            ['RCP001', '17-10-2026 12:00:00', '100.00', f'AFYLNK{self.unrecorded.pk}', 'Completed'],
+            ['RCP002', '17-10-2026 12:10:00', '1,150.00', f'AFYLNK{self.underpaid.pk}', 'Completed'],
+            ['RCP003', '17-10-2026 12:20:00', '100.00', f'AFYLNK{self.statement_case.pk}', 'Completed'],
+            ['RCP005', '17-10-2026 12:40:00', '100.00', f'AFYLNK{self.unrecorded.pk}', 'Failed'],
+            ['RCP006', '17-10-2026 13:00:00', '100.00', 'SOMEONE-ELSE', 'Completed'],
+        ])
+        self.assertEqual(self.reconcile(path), {
+            'missing_payment': 1, 'amount_mismatch': 1, 'case_mismatch': 1, 'payment_not_in_statement': 1,
+            'case_not_marked_paid': 2,
+        })
+        # Without --repair nothing is written.
+        self.assertFalse(Payment.objects.filter(mpesa_receipt_number='RCP001').exists())
+
+    def test_repair_records_missing_payments_once(self):
+        path = self.statement([['RCP001', '17-10-2026 12:00:00', '100.00', f'AFYLNK{self.unrecorded.pk}', 'Completed']])
+        self.assertEqual(self.reconcile(path, repair=True), {
+            'missing_payment': 1, 'case_not_marked_paid': 1, 'repaired_payments': 1, 'repaired_cases': 1,
+        })
+        payment = Payment.objects.get(mpesa_receipt_number='RCP001')
+        self.assertEqual((payment.case_id, payment.amount), (self.unrecorded.pk, 100))
+        self.unrecorded.refresh_from_db()
+        self.assertEqual(self.unrecorded.status, Case.CaseStatus.PAID)
+
+        # A second run finds nothing left to repair and writes nothing.
+        self.assertEqual(self.reconcile(path, repair=True), {})
+        self.assertEqual(Payment.objects.filter(mpesa_receipt_number='RCP001').count(), 1)
+        self.assertEqual(self.unrecorded.history.filter(description__contains='reconciliation').count(), 1)
+
+    def test_payment_recorded_meanwhile_is_not_counted_as_repaired(self):
+        path = self.statement([['RCP001', '17-10-2026 12:00:00', '100.00', f'AFYLNK{self.unrecorded.pk}', 'Completed']])
+        repair = ReconcileCommand._repair
+
+        def callback_lands_first(command, to_create, to_mark_paid):
+            Payment.objects.create(
+                case=self.unrecorded, mpesa_receipt_number='RCP001', amount=100, transaction_date=timezone.now(),
+            )
+            repair(command, to_create, to_mark_paid)
+
+        with mock.patch.object(ReconcileCommand, '_repair', callback_lands_first):
+            counts = self.reconcile(path, repair=True)
+        self.assertEqual(counts.get('repaired_payments', 0), 0)
+        self.assertEqual(counts['repaired_cases'], 1)
+        self.assertEqual(Payment.objects.filter(mpesa_receipt_number='RCP001').count(), 1)
+
+
+# The pool only runs pure triage functions; threads keep the test's database
+# connection (and its transaction) open where the real command closes it to fork.
+@mock.patch('api.management.commands.triage_backfill.ProcessPoolExecutor', ThreadPoolExecutor)
+@mock.patch('api.management.commands.triage_backfill.connections.close_all', lambda: None)
+class TriageBackfillTests(TestCase):
+    """triage_backfill fills in missing triage chunk by chunk and resumes from a watermark."""
+
+    @classmethod
+    def setUpTestData(cls):
+        patient = User.objects.create(phone_number='0700000100')
+        cls.untriaged = [Case.objects.create(user=patient, symptom_input=f'chest pain {i}') for i in range(5)]
+        cls.triaged = Case.objects.create(
+            user=patient, symptom_input='chest pain', ai_urgency='Low', ai_category='Manual', ai_summary='Checked',
+        )
+
+    def setUp(self):
+        self.before = timezone.now() - timedelta(hours=1)
+        Case.objects.update(updated_at=self.before)
+
+    def backfill(self, **options):
+        out = StringIO()
+        call_command('triage_backfill', chunk_size=2, workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def test_untriaged_cases_are_filled_in_chunks(self):
+        output = self.backfill()
+        self.assertEqual(re.findall(r'^(\d+) case\(s\) backfilled', output, re.MULTILINE), ['2', '4', '5'])
+        self.assertIn(f'Last case_id: {self.untriaged[-1].pk}.', output)
+        for case in Case.objects.filter(pk__in=[case.pk for case in self.untriaged]):
+            self.assertEqual(case.ai_urgency, 'High')
+            self.assertGreater(case.updated_at, self.before)  # so the change feed picks them up
+        self.triaged.refresh_from_db()
+        self.assertEqual((self.triaged.ai_category, self.triaged.updated_at), ('Manual', self.before))
+
+    def test_resumes_after_the_watermark(self):
+        output = self.backfill(after_case_id=self.untriaged[2].pk)
+        self.assertIn('2 case(s) backfilled', output)
+        self.assertEqual(
+            list(Case.objects.filter(ai_urgency__isnull=True).order_by('pk').values_list('pk', flat=True)),
+            [case.pk for case in self.untriaged[:3]],
+        )
+
+    def test_dry_run_writes_nothing(self):
+        self.backfill(dry_run=True)
+        self.assertEqual(Case.objects.filter(ai_urgency__isnull=True).count(), 5)
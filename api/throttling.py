@@ -0,0 +1,171 @@
+# In api/throttling.py
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import counter
+
+# Token buckets for the unauthenticated endpoints. Rates come from
+# REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] as 'count/period': a bucket holds
+# `count` tokens and refills at count-per-period. Throttles run in
+# APIView.initial(), before the handler, so a rejected request costs no query.
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+throttle_checks = counter(
+    'throttle_checks', 'Requests checked by a throttle, by scope and whether they were let through.',
+    labels=('scope', 'result'),
+)
+
+
+def parse_rate(rate):
+    """'20/min' -> (20, 60). The period is read from its first letter, as DRF does."""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+# --- Bucket stores ---
+# take(key, capacity, period) spends one token from the bucket `key` and
+# returns (allowed, seconds until a token is available).
+
+class LocalMemoryBucketStore:
+    """
+    Exact token buckets kept in a process-local cache (the default
+    LocMemCache), which also bounds how many buckets are remembered. With
+    several workers each keeps its own buckets, so the effective limit is
+    per worker.
+    """
+
+    key_prefix = 'throttle:'
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, period):
+        rate = capacity / period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.cache.get(self.key_prefix + key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            # An idle bucket is full again after one period; forget it then.
+            self.cache.set(self.key_prefix + key, (tokens, now), period)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+
+class SharedCacheBucketStore:
+    """
+    Buckets shared by every worker through a cache such as Redis or Memcached.
+    The cache API has no compare-and-set, so each bucket is refilled whole at
+    the start of every period and spent with an atomic incr(): the same
+    average rate and burst as a token bucket, with coarser refills.
+    """
+
+    key_prefix = 'throttle:'
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+    def take(self, key, capacity, period):
+        now = time.time()
+        window = int(now // period)
+        cache_key = f'{self.key_prefix}{key}:{window}'
+        self.cache.add(cache_key, 0, period + 1)
+        try:
+            spent = self.cache.incr(cache_key)
+        except ValueError:
+            # Evicted between add() and incr().
+            self.cache.add(cache_key, 1, period + 1)
+            spent = 1
+        allowed = spent <= capacity
+        return allowed, 0 if allowed else (window + 1) * period - now
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_bucket_store():
+    """Returns the configured bucket store (THROTTLE_STORE), built once."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_path = getattr(settings, 'THROTTLE_STORE', 'api.throttling.LocalMemoryBucketStore')
+                _store = import_string(store_path)()
+    return _store
+
+
+# --- Throttles ---
+
+class TokenBucketThrottle(BaseThrottle):
+    """Spends one token per request from the bucket named by get_key(); subclasses set `scope`."""
+
+    scope = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def allow_request(self, request, view):
+        self.wait_seconds = None
+        rates = api_settings.DEFAULT_THROTTLE_RATES
+        if self.scope not in rates:
+            raise ImproperlyConfigured(f"No throttle rate set for scope '{self.scope}'.")
+        key = self.get_key(request, view)
+        if rates[self.scope] is None or key is None:
+            return True
+        capacity, period = parse_rate(rates[self.scope])
+        allowed, self.wait_seconds = get_bucket_store().take(f'{self.scope}:{key}', capacity, period)
+        throttle_checks.inc(scope=self.scope, result='allowed' if allowed else 'throttled')
+        return allowed
+
+    def wait(self):
+        return math.ceil(self.wait_seconds) if self.wait_seconds else None
+
+
+class ClientIPThrottle(TokenBucketThrottle):
+    """One bucket per client address (honouring REST_FRAMEWORK['NUM_PROXIES'])."""
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+class PhoneNumberThrottle(TokenBucketThrottle):
+    """One bucket per phone number in the request body; requests without one are not counted."""
+
+    phone_field = 'phone_number'
+
+    def get_key(self, request, view):
+        phone_number = str(request.data.get(self.phone_field) or '').strip()
+        return phone_number or None
+
+
+class LookupThrottle(ClientIPThrottle):
+    """Username, email and approval-status checks."""
+    scope = 'lookup'
+
+
+class OtpClientThrottle(ClientIPThrottle):
+    scope = 'otp_ip'
+
+
+class OtpPhoneThrottle(PhoneNumberThrottle):
+    scope = 'otp_phone'
+
+
+class UssdPhoneThrottle(PhoneNumberThrottle):
+    # Every USSD request arrives from the gateway's addresses, so only the
+    # subscriber's number tells callers apart.
+    scope = 'ussd_phone'
+    phone_field = 'phoneNumber'
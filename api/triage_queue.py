@@ -0,0 +1,125 @@
+# In api/triage_queue.py
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .ai_service import get_ai_triage_for_symptoms
+from .auto_assign import auto_assign_case
+from .models import Case, TriageJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'TRIAGE_MAX_ATTEMPTS', 3)
+# A job left 'running' longer than this is assumed to belong to a dead worker.
+STALE_AFTER = timedelta(seconds=getattr(settings, 'TRIAGE_STALE_AFTER', 300))
+
+
+def enqueue_triage(case):
+    """Queues AI triage for a newly created case and returns immediately."""
+    return TriageJob.objects.create(case=case)
+
+
+def claim_triage_jobs(batch_size):
+    """
+    Marks up to `batch_size` pending jobs as running and returns them with
+    their cases. Rows locked by another worker are skipped.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # A reclaimed job used up an attempt, so a case that kills its worker
+        # every time (e.g. a payload the AI call chokes on) stops being retried.
+        stale = TriageJob.objects.filter(status=TriageJob.JobStatus.RUNNING, started_at__lt=now - STALE_AFTER)
+        stale.filter(attempts__gte=MAX_ATTEMPTS - 1).update(
+            status=TriageJob.JobStatus.FAILED, attempts=F('attempts') + 1,
+            error="Worker stopped while triaging.", finished_at=now,
+        )
+        stale.update(status=TriageJob.JobStatus.PENDING, attempts=F('attempts') + 1, error="Worker stopped while triaging.")
+
+        job_ids = list(
+            TriageJob.objects.select_for_update(skip_locked=True)
+            .filter(status=TriageJob.JobStatus.PENDING)
+            .order_by('enqueued_at')
+            .values_list('job_id', flat=True)[:batch_size]
+        )
+        if not job_ids:
+            return []
+        TriageJob.objects.filter(job_id__in=job_ids).update(status=TriageJob.JobStatus.RUNNING, started_at=now)
+    return list(TriageJob.objects.filter(job_id__in=job_ids).select_related('case'))
+
+
+def process_triage_jobs(jobs, executor):
+    """
+    Runs triage for a batch of claimed jobs on `executor` and writes the
+    results back with one bulk update for the cases and one for the jobs.
+    Newly triaged cases without an agent are then auto-assigned.
+    """
+    futures = [(job, executor.submit(get_ai_triage_for_symptoms, job.case.symptom_input or '')) for job in jobs]
+
+    now = timezone.now()
+    triaged_cases = []
+    for job, future in futures:
+        job.attempts += 1
+        try:
+            ai_data = future.result()
+        except Exception as e:
+            job.error = str(e)
+            job.status = TriageJob.JobStatus.FAILED if job.attempts >= MAX_ATTEMPTS else TriageJob.JobStatus.PENDING
+            logger.warning("Triage failed for case %s (attempt %s): %s", job.case_id, job.attempts, e)
+            continue
+        case = job.case
+        case.ai_urgency = ai_data.get("ai_urgency")
+        case.ai_category = ai_data.get("ai_category")
+        case.ai_summary = ai_data.get("ai_summary")
+        case.updated_at = now
+        triaged_cases.append(case)
+        job.status = TriageJob.JobStatus.DONE
+        job.error = None
+        job.finished_at = now
+
+    with transaction.atomic():
+        Case.objects.bulk_update(triaged_cases, ['ai_urgency', 'ai_category', 'ai_summary', 'updated_at'])
+        TriageJob.objects.bulk_update(jobs, ['status', 'attempts', 'error', 'finished_at'])
+
+    for case in triaged_cases:
+        if case.agent_id is None:
+            auto_assign_case(case.case_id)
+    return len(triaged_cases)
+
+
+def triage_queue_stats(sample_size=500):
+    """
+    Returns queue depth and latency figures for monitoring. Latency is the
+    time from enqueue to finish over the most recently completed jobs.
+    """
+    now = timezone.now()
+    pending = TriageJob.objects.filter(status=TriageJob.JobStatus.PENDING)
+    oldest_pending = pending.order_by('enqueued_at').values_list('enqueued_at', flat=True).first()
+    recent = list(
+        TriageJob.objects.filter(status=TriageJob.JobStatus.DONE)
+        .order_by('-finished_at')
+        .values_list('enqueued_at', 'finished_at')[:sample_size]
+    )
+    latencies = sorted((finished - enqueued).total_seconds() for enqueued, finished in recent)
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+    return {
+        'queue_depth': pending.count(),
+        'running': TriageJob.objects.filter(status=TriageJob.JobStatus.RUNNING).count(),
+        'failed': TriageJob.objects.filter(status=TriageJob.JobStatus.FAILED).count(),
+        'oldest_pending_age_seconds': (now - oldest_pending).total_seconds() if oldest_pending else 0,
+        'latency_seconds': {
+            'sample_size': len(latencies),
+            'p50': percentile(0.5),
+            'p95': percentile(0.95),
+            'max': latencies[-1] if latencies else None,
+        },
+    }
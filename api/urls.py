@@ -5,6 +5,7 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from .views import (
     UssdHandlerView,
     CaseListView,
+    CaseChangesView,
     CaseDetailView,
     ClaimCaseView,
     CurrentUserView,
@@ -17,7 +18,11 @@ from .views import (
     UserVerifyLoginOTPView,  # ✅ ADD THIS
     DarajaCallbackView, # ✅ ADD THIS
     InitiatePaymentView, # ✅ ADD THIS
-    MyTokenObtainPairView
+    PaymentAttemptView,
+    MyTokenObtainPairView,
+    TriageMetricsView,
+    MetricsView,
+    case_events,
 )
 
 # API Routes
@@ -29,6 +34,8 @@ urlpatterns = [
     # Your existing URLs
     path('ussd/', UssdHandlerView.as_view(), name='ussd_handler'),
     path('cases/', CaseListView.as_view(), name='case-list'),
+    path('cases/changes/', CaseChangesView.as_view(), name='case-changes'),
+    path('events/', case_events, name='case-events'),
     path('cases/<int:pk>/', CaseDetailView.as_view(), name='case-detail'),
     path('cases/<int:pk>/claim/', ClaimCaseView.as_view(), name='case-claim'),
     path('me/', CurrentUserView.as_view(), name='current-user'),
@@ -51,7 +58,12 @@ urlpatterns = [
 
      # ✅ ADD THIS NEW URL FOR INITIATING PAYMENTS
     path('initiate-payment/', InitiatePaymentView.as_view(), name='initiate-payment'),
+    path('payments/attempts/<int:pk>/', PaymentAttemptView.as_view(), name='payment-attempt'),
 
      # ✅ ADD THE CALLBACK URL
     path('payments/callback/', DarajaCallbackView.as_view(), name='daraja-callback'),
+
+    # Background AI triage monitoring
+    path('triage/metrics/', TriageMetricsView.as_view(), name='triage-metrics'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,173 @@
+# In api/ussd_menu.py
+
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from django.conf import settings
+from django.core import serializers
+from django.core.exceptions import ImproperlyConfigured
+
+from .models import Language, PaymentDeclaration, UssdMenuText, UssdMenuNode
+
+FALLBACK_LANGUAGE = 'en'
+MENU_NOT_CONFIGURED = "Error: Menu not configured. Please contact support."
+
+# How long a worker keeps its copy before reloading. Signals only reach the
+# process that made the edit, so this bounds staleness in the other workers.
+MENU_CACHE_TIMEOUT = getattr(settings, 'USSD_MENU_CACHE_TIMEOUT', 300)
+
+# Used when the UssdMenuNode table is empty. Load it with
+# `manage.py loaddata ussd_menu_graph` to edit the graph from the admin.
+MENU_GRAPH_FIXTURE = Path(__file__).resolve().parent / 'fixtures' / 'ussd_menu_graph.json'
+
+ROOT_PATH = ()
+ANY_INPUT = '*'
+
+# A compiled node. `path` is the tuple of choices leading to it from the root,
+# with ANY_INPUT standing in for free-text steps.
+MenuNode = namedtuple('MenuNode', ['path', 'menu_key', 'action', 'action_value', 'menu_language'])
+
+# The graph and texts are loaded and compiled lazily, by the first USSD
+# request each worker serves (and again after MENU_CACHE_TIMEOUT), not at
+# startup: AppConfig.ready() must not query the database.
+_lock = threading.Lock()
+_snapshot = None
+_loaded_at = 0.0
+
+
+def _load_menu_graph_nodes():
+    nodes = list(UssdMenuNode.objects.all())
+    if not nodes:
+        with open(MENU_GRAPH_FIXTURE, encoding='utf-8') as fixture:
+            nodes = [deserialized.object for deserialized in serializers.deserialize('json', fixture.read())]
+    return nodes
+
+
+def compile_menu_graph(nodes):
+    """
+    Compiles menu nodes into a dispatch table keyed by path, so resolving a
+    hop is a dictionary lookup per input however many branches exist.
+    """
+    by_id = {node.pk: node for node in nodes}
+    paths = {}
+
+    def path_of(node):
+        chain = []
+        current = node
+        while current.pk not in paths:
+            chain.append(current)
+            if len(chain) > len(by_id):
+                raise ImproperlyConfigured(f"USSD menu graph has a cycle at node {node.pk}.")
+            if current.parent_id is None:
+                paths[current.pk] = ROOT_PATH
+                chain.pop()
+                break
+            if current.parent_id not in by_id:
+                raise ImproperlyConfigured(f"USSD menu node {current.pk} has an unknown parent {current.parent_id}.")
+            current = by_id[current.parent_id]
+        for child in reversed(chain):
+            paths[child.pk] = paths[child.parent_id] + (child.choice,)
+        return paths[node.pk]
+
+    table = {}
+    for node in nodes:
+        path = path_of(node)
+        if path in table:
+            raise ImproperlyConfigured(f"USSD menu graph has more than one node at path {path!r}.")
+        table[path] = MenuNode(path, node.menu_key, node.action, node.action_value, node.menu_language)
+
+    if ROOT_PATH not in table:
+        raise ImproperlyConfigured("USSD menu graph has no root node.")
+    return table
+
+
+def _load_snapshot():
+    """
+    Loads every menu text in a single query and resolves the English
+    fallback ahead of time, so a lookup is a plain dictionary access.
+    The menu graph and the small lookup tables used by the USSD flow are
+    loaded alongside.
+    """
+    rows = UssdMenuText.objects.values_list('menu_key', 'language__language_code', 'menu_text')
+    texts = {(menu_key, language_code): menu_text for menu_key, language_code, menu_text in rows}
+
+    language_ids = dict(Language.objects.values_list('language_code', 'pk'))
+    declaration_ids = dict(PaymentDeclaration.objects.values_list('status_code', 'pk'))
+
+    language_codes = set(language_ids)
+    language_codes.update(language_code for _, language_code in texts)
+
+    for menu_key in {menu_key for menu_key, _ in texts}:
+        fallback = texts.get((menu_key, FALLBACK_LANGUAGE))
+        if fallback is None:
+            continue
+        for language_code in language_codes:
+            texts.setdefault((menu_key, language_code), fallback)
+
+    return {
+        'graph': compile_menu_graph(_load_menu_graph_nodes()),
+        'texts': texts,
+        'language_ids': language_ids,
+        'declaration_ids': declaration_ids,
+    }
+
+
+def _get_snapshot():
+    global _snapshot, _loaded_at
+    snapshot = _snapshot
+    if snapshot is not None and time.monotonic() - _loaded_at < MENU_CACHE_TIMEOUT:
+        return snapshot
+    with _lock:
+        if _snapshot is None or time.monotonic() - _loaded_at >= MENU_CACHE_TIMEOUT:
+            _snapshot = _load_snapshot()
+            _loaded_at = time.monotonic()
+        return _snapshot
+
+
+def get_menu_text(key, language_code=FALLBACK_LANGUAGE):
+    """
+    Returns the text for a USSD menu screen in the requested language,
+    falling back to English, without touching the database once warm.
+    """
+    texts = _get_snapshot()['texts']
+    menu_text = texts.get((key, language_code))
+    if menu_text is None:
+        # Unknown language codes were not expanded at load time.
+        menu_text = texts.get((key, FALLBACK_LANGUAGE), MENU_NOT_CONFIGURED)
+    return menu_text
+
+
+def get_menu_node(path):
+    """Returns the compiled node at `path`, or None."""
+    return _get_snapshot()['graph'].get(path)
+
+
+def resolve_menu_node(path, user_input):
+    """
+    Follows one input from the node at `path`. A matching choice wins over a
+    free-text branch; returns None when the input is not a valid selection.
+    """
+    graph = _get_snapshot()['graph']
+    node = graph.get(path + (user_input,))
+    if node is None:
+        node = graph.get(path + (ANY_INPUT,))
+    return node
+
+
+def get_language_id(language_code):
+    """Returns the primary key of a Language by code, or None."""
+    return _get_snapshot()['language_ids'].get(language_code)
+
+
+def get_declaration_id(status_code):
+    """Returns the primary key of a PaymentDeclaration by code, or None."""
+    return _get_snapshot()['declaration_ids'].get(status_code)
+
+
+def invalidate_menu_cache(**kwargs):
+    """Drops the cached snapshot; usable directly as a signal receiver."""
+    global _snapshot
+    with _lock:
+        _snapshot = None
@@ -0,0 +1,199 @@
+# In api/ussd_session.py
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .models import User, Case, CaseHistory, UssdMenuNode
+from .triage_queue import enqueue_triage
+from .ussd_menu import (
+    FALLBACK_LANGUAGE, ROOT_PATH, get_menu_text, get_menu_node, resolve_menu_node,
+    get_language_id, get_declaration_id,
+)
+
+SESSION_TIMEOUT = getattr(settings, 'USSD_SESSION_TIMEOUT', 180)
+
+
+# --- Session stores ---
+
+class LocalMemorySessionStore:
+    """Keeps USSD session state in a dictionary local to this process."""
+
+    def __init__(self, timeout=SESSION_TIMEOUT):
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            expires_at, state = entry
+            if expires_at < time.monotonic():
+                del self._sessions[session_id]
+                return None
+            return dict(state)
+
+    def set(self, session_id, state):
+        now = time.monotonic()
+        with self._lock:
+            # Sessions are short-lived, so sweep expired ones as we go.
+            if len(self._sessions) > 1000:
+                expired = [key for key, (expires_at, _) in self._sessions.items() if expires_at < now]
+                for key in expired:
+                    del self._sessions[key]
+            self._sessions[session_id] = (now + self.timeout, dict(state))
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+
+class CacheSessionStore:
+    """Keeps USSD session state in a Django cache, shared between workers."""
+
+    key_prefix = 'ussd-session:'
+
+    def __init__(self, timeout=SESSION_TIMEOUT, alias=None):
+        self.timeout = timeout
+        self.cache = caches[alias or getattr(settings, 'USSD_SESSION_CACHE_ALIAS', 'default')]
+
+    def get(self, session_id):
+        return self.cache.get(self.key_prefix + session_id)
+
+    def set(self, session_id, state):
+        self.cache.set(self.key_prefix + session_id, state, self.timeout)
+
+    def delete(self, session_id):
+        self.cache.delete(self.key_prefix + session_id)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Returns the configured session store (USSD_SESSION_STORE), built once."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_path = getattr(settings, 'USSD_SESSION_STORE', 'api.ussd_session.LocalMemorySessionStore')
+                _store = import_string(store_path)()
+    return _store
+
+
+# --- Session state machine ---
+
+def new_state():
+    return {
+        'text': '',
+        'path': ROOT_PATH,  # position in the menu graph; None once invalid
+        'language': None,
+        'declaration': None,
+        'response': None,
+    }
+
+
+class UssdSession:
+    """
+    Drives one USSD session through the compiled menu graph. The gateway
+    resends the whole `text` chain on every hop; we remember how much of it
+    was already handled (keyed on sessionId) and only resolve the new input.
+    Intermediate screens need no database access; the User and Case are
+    written once, at the end.
+    """
+
+    def __init__(self, session_id, phone_number, store=None):
+        self.session_id = session_id
+        self.phone_number = phone_number
+        self.store = store or get_session_store()
+
+    def handle(self, text):
+        text = text or ''
+        state = self.store.get(self.session_id) if self.session_id else None
+
+        if state is not None and text == state['text'] and state['response'] is not None:
+            # Gateway retry of the same hop: answer again without side effects.
+            return state['response']
+
+        if state is not None and self._extends(state['text'], text):
+            new_inputs = text[len(state['text']) + 1:].split('*') if state['text'] else text.split('*')
+        else:
+            # Unknown or expired session: replay the whole chain from the start.
+            state = new_state()
+            new_inputs = text.split('*') if text else []
+
+        if not new_inputs:
+            response = self._render(get_menu_node(ROOT_PATH), state)
+        else:
+            response = self._advance(state, new_inputs)
+
+        state['text'] = text
+        state['response'] = response
+        if self.session_id:
+            self.store.set(self.session_id, state)
+        return response
+
+    @staticmethod
+    def _extends(previous_text, text):
+        if previous_text == '':
+            return True
+        return text.startswith(previous_text + '*')
+
+    def _advance(self, state, new_inputs):
+        """Follows the new inputs through the graph and returns the screen to show."""
+        path = state['path']
+        node = None
+        for user_input in new_inputs:
+            node = resolve_menu_node(path, user_input) if path is not None else None
+            if node is None:
+                state['path'] = None
+                return get_menu_text('invalid_selection_menu', state['language'] or FALLBACK_LANGUAGE)
+            path = node.path
+            if node.action == UssdMenuNode.Action.SET_LANGUAGE:
+                state['language'] = node.action_value
+            elif node.action == UssdMenuNode.Action.SET_DECLARATION:
+                state['declaration'] = node.action_value
+        state['path'] = path
+
+        # Side effects only run for the node this hop ends on, so a replayed
+        # chain never creates a case for a step the user has moved past.
+        if node.action == UssdMenuNode.Action.CREATE_CASE:
+            new_case = self._create_case(state, symptom_input=new_inputs[-1])
+            final_message_template = self._render(node, state)
+            return final_message_template.format(case_id=new_case.case_id)
+        return self._render(node, state)
+
+    @staticmethod
+    def _render(node, state):
+        return get_menu_text(node.menu_key, node.menu_language or state['language'] or FALLBACK_LANGUAGE)
+
+    def _create_case(self, state, symptom_input):
+        """The only database write of the session: persist the User and Case."""
+        language_id = get_language_id(state['language'])
+        declaration_id = get_declaration_id(state['declaration'])
+        with transaction.atomic():
+            user, created = User.objects.get_or_create(
+                phone_number=self.phone_number,
+                defaults={'default_language_id': language_id, 'payment_declaration_id': declaration_id},
+            )
+            if not created and (user.default_language_id, user.payment_declaration_id) != (language_id, declaration_id):
+                user.default_language_id = language_id
+                user.payment_declaration_id = declaration_id
+                user.save(update_fields=['default_language', 'payment_declaration', 'updated_at'])
+            new_case = Case.objects.create(
+                user=user,
+                symptom_input=symptom_input,
+                case_language_id=language_id,
+                case_payment_declaration_id=declaration_id,
+            )
+            # Log the creation event
+            CaseHistory.objects.create(case=new_case, description="Case created via USSD.")
+            enqueue_triage(new_case)
+        return new_case
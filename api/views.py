@@ -1,9 +1,14 @@
 # Add these imports for OTP logic
-import random
-from datetime import timedelta
+import json
+from datetime import datetime
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.shortcuts import render
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework.exceptions import AuthenticationFailed, Throttled
+from asgiref.sync import sync_to_async
 
 from django.contrib.auth import authenticate
 from django.views.decorators.csrf import csrf_exempt
@@ -16,15 +21,29 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import status, generics
 from django.contrib.auth.models import User as AuthUser
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from rest_framework import serializers
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view
-
-from .daraja_service import initiate_stk_push
+from django.urls import reverse
+from rest_framework.decorators import api_view, authentication_classes, throttle_classes
+
+from .africastalking_service import send_otp_sms
+from .account_lookup import account_exists
+from .case_changes import get_case_changes
+from .events import STAFF_CHANNEL, agent_channel, get_event_broker, patient_channel
+from .metrics import render_metrics
+from .otp import OtpLocked, OtpThrottled, issue_otp, verify_otp
+from .payment_queue import enqueue_payment
+from .throttling import LookupThrottle, OtpClientThrottle, OtpPhoneThrottle, UssdPhoneThrottle
+from .ussd_session import UssdSession
+from .triage_queue import triage_queue_stats
 # MODIFIED: Import the new models and serializers
-from .models import Language, User, PaymentDeclaration, Case, UssdMenuText, Agent, Payment, CaseHistory
-from .serializers import CaseSerializer, CurrentUserSerializer, AgentRegisterSerializer, PaymentSerializer, CaseHistorySerializer
+from .models import User, Case, CaseTombstone, Agent, Payment, PaymentAttempt, CaseHistory, DarajaCallback
+from .pagination import CaseCursorPagination
+from .serializers import (
+    CaseSerializer, CaseListValues, CurrentUserSerializer, AgentRegisterSerializer, PaymentSerializer,
+    PaymentAttemptSerializer, CaseHistorySerializer,
+)
 
 
 # --- View for the USSD Handler ---
@@ -32,49 +51,25 @@ class UssdHandlerView(APIView):
     """
     This view handles all the USSD requests from the gateway.
     """
-    def get_menu_text(self, key, language_code='en'):
-        try:
-            menu = UssdMenuText.objects.get(menu_key=key, language__language_code=language_code)
-            return menu.menu_text
-        except UssdMenuText.DoesNotExist:
-            try:
-                menu = UssdMenuText.objects.get(menu_key=key, language__language_code='en')
-                return menu.menu_text
-            except UssdMenuText.DoesNotExist:
-                return "Error: Menu not configured. Please contact support."
+    # The gateway does not authenticate; skipping authentication also keeps
+    # throttled requests free of database work.
+    authentication_classes = []
+    throttle_classes = [UssdPhoneThrottle]
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Throttled):
+            # The gateway shows the body to the subscriber, so answer in USSD.
+            return Response("END Too many requests. Please try again in a few minutes.", content_type='text/plain')
+        return super().handle_exception(exc)
 
     def post(self, request, *args, **kwargs):
         session_id = request.data.get('sessionId')
         phone_number = request.data.get('phoneNumber')
         text = request.data.get('text', '')
-        user, created = User.objects.get_or_create(phone_number=phone_number)
-        response = ""
-        text_parts = text.split('*')
-        lang_code = user.default_language.language_code if user.default_language else 'en'
-        if text == '':
-            response = self.get_menu_text('welcome_menu', 'en')
-        elif text_parts[0] in ['1', '2'] and len(text_parts) == 1:
-            lang_code = 'en' if text_parts[0] == '1' else 'sw'
-            language = Language.objects.get(language_code=lang_code)
-            user.default_language = language
-            user.save()
-            response = self.get_menu_text('payment_declaration_menu', lang_code)
-        elif text_parts[0] in ['1', '2'] and len(text_parts) == 2 and text_parts[1] in ['1', '2', '3']:
-            declaration_map = {'1': 'standard', '2': 'small_fee', '3': 'cannot_pay'}
-            status_code = declaration_map.get(text_parts[1])
-            payment_declaration = PaymentDeclaration.objects.get(status_code=status_code)
-            user.payment_declaration = payment_declaration
-            user.save()
-            response = self.get_menu_text('enter_symptom_menu', lang_code)
-        elif text_parts[0] in ['1', '2'] and len(text_parts) == 3:
-            health_issue = text_parts[2]
-            new_case = Case.objects.create(user=user, symptom_input=health_issue, case_language=user.default_language, case_payment_declaration=user.payment_declaration)
-            # Log the creation event
-            CaseHistory.objects.create(case=new_case, description="Case created via USSD.")
-            final_message_template = self.get_menu_text('case_created_success', lang_code)
-            response = final_message_template.format(case_id=new_case.case_id)
-        else:
-            response = self.get_menu_text('invalid_selection_menu', lang_code)
+        # Session state (level, language, declaration) lives in the USSD
+        # session store; the database is only written at the final step.
+        session = UssdSession(session_id, phone_number)
+        response = session.handle(text)
         return Response(response, content_type='text/plain')
 
 
@@ -94,16 +89,73 @@ class MyTokenObtainPairView(TokenObtainPairView):
 class CaseListView(generics.ListCreateAPIView):
     serializer_class = CaseSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CaseCursorPagination
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Case.objects.all().order_by('-created_at')
+            return self.filter_cases(Case.objects.all().order_by('-created_at'))
         try:
             patient_profile = User.objects.get(phone_number=user.username)
-            return Case.objects.filter(user=patient_profile).order_by('-created_at')
+            return self.filter_cases(Case.objects.filter(user=patient_profile).order_by('-created_at'))
         except User.DoesNotExist:
             return Case.objects.none()
 
+    def get_tombstones(self):
+        """
+        Tombstones for the cases get_queryset() covers. Reassignments only
+        matter to a list filtered by ?agent=; elsewhere the case stays listed.
+        """
+        user = self.request.user
+        tombstones = CaseTombstone.objects.all()
+        if not user.is_staff:
+            patient_profile = User.objects.filter(phone_number=user.username).first()
+            if patient_profile is None:
+                return CaseTombstone.objects.none()
+            tombstones = tombstones.filter(user_id=patient_profile.pk)
+        agent = self.request.query_params.get('agent')
+        if agent and agent.isdigit():
+            return tombstones.filter(agent_id=agent)
+        return tombstones.filter(reason=CaseTombstone.Reason.DELETED)
+
+    def list(self, request, *args, **kwargs):
+        # Read-only fast path: render straight from .values() rows instead of
+        # hydrating models and running CaseSerializer field by field.
+        rows = CaseListValues.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        return self.get_paginated_response(CaseListValues.to_representation(page))
+
+    def filter_cases(self, queryset):
+        """
+        Applies the optional ?status=, ?agent=, ?ai_urgency=, ?created_after=
+        and ?created_before= filters. Each one is covered by a Case index.
+        """
+        params = self.request.query_params
+        if params.get('status'):
+            queryset = queryset.filter(status=params['status'])
+        if params.get('agent'):
+            if not params['agent'].isdigit():
+                raise serializers.ValidationError({'agent': "Must be an agent id."})
+            queryset = queryset.filter(agent_id=params['agent'])
+        if params.get('ai_urgency'):
+            queryset = queryset.filter(ai_urgency=params['ai_urgency'])
+        for param, lookup in (('created_after', 'created_at__gte'), ('created_before', 'created_at__lt')):
+            if params.get(param):
+                queryset = queryset.filter(**{lookup: self.parse_date_param(param, params[param])})
+        return queryset
+
+    @staticmethod
+    def parse_date_param(name, value):
+        """Accepts an ISO date or datetime; naive values use the current timezone."""
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            if day is None:
+                raise serializers.ValidationError({name: "Use an ISO date or datetime, e.g. 2025-07-01."})
+            parsed = datetime.combine(day, datetime.min.time())
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
     def perform_create(self, serializer):
         auth_user = self.request.user
         try:
@@ -114,8 +166,22 @@ class CaseListView(generics.ListCreateAPIView):
         except User.DoesNotExist:
             raise serializers.ValidationError("Could not find a patient profile for this user.")
 
+class CaseChangesView(CaseListView):
+    """
+    Incremental feed for dashboards: the cases changed (or with new history)
+    since ?since=<token>, plus tombstones for cases that were deleted or moved
+    to another agent. Takes the same filters as the case list. Call it once
+    without ?since= when loading the list, then poll with the returned token.
+    """
+    http_method_names = ['get', 'head', 'options']
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        changes = get_case_changes(self.get_queryset(), self.get_tombstones(), request.query_params.get('since'))
+        return Response(changes, status=status.HTTP_200_OK)
+
 class CaseDetailView(generics.RetrieveUpdateAPIView):
-    queryset = Case.objects.all()
+    queryset = CaseSerializer.setup_eager_loading(Case.objects.all())
     serializer_class = CaseSerializer
     permission_classes = [IsAuthenticated]
     lookup_field = 'pk'
@@ -163,20 +229,24 @@ class RegisterAgentView(generics.CreateAPIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class CheckUsernameView(APIView):
+    authentication_classes = []
+    throttle_classes = [LookupThrottle]
+
     def get(self, request):
         username = request.GET.get('username', '').strip()
         if not username:
             return Response({'error': 'Username is required.'}, status=status.HTTP_400_BAD_REQUEST)
-        exists = AuthUser.objects.filter(username__iexact=username).exists()
-        return Response({'exists': exists})
+        return Response({'exists': account_exists('username', username)})
 
 class CheckEmailView(APIView):
+    authentication_classes = []
+    throttle_classes = [LookupThrottle]
+
     def get(self, request):
         email = request.GET.get('email', '').strip()
         if not email:
             return Response({'error': 'Email is required.'}, status=status.HTTP_400_BAD_REQUEST)
-        exists = AuthUser.objects.filter(email__iexact=email).exists()
-        return Response({'exists': exists})
+        return Response({'exists': account_exists('email', email)})
 
 class ApproveAgentView(APIView):
     permission_classes = [IsAdminUser]
@@ -187,9 +257,13 @@ class ApproveAgentView(APIView):
             return Response({"message": "Agent already approved."}, status=status.HTTP_200_OK)
         auth_user.is_active = True
         auth_user.save()
+        # Cases queued while no agent was available are handed out by
+        # triage_worker, in batches, rather than in this request.
         return Response({"message": f"Agent '{agent.full_name}' approved."}, status=status.HTTP_200_OK)
 
 @api_view(['GET'])
+@authentication_classes([])
+@throttle_classes([LookupThrottle])
 def check_approval_status(request):
     username = request.GET.get('username', '').strip()
     try:
@@ -201,106 +275,88 @@ def check_approval_status(request):
 
 # --- Patient OTP Login Views ---
 class UserRequestLoginOTPView(APIView):
+    """Texts a one-time login code to a registered patient. Nothing is written to the User row."""
+    authentication_classes = []
+    throttle_classes = [OtpClientThrottle, OtpPhoneThrottle]
+
     def post(self, request, *args, **kwargs):
         phone_number = request.data.get('phone_number')
-        try:
-            user = User.objects.get(phone_number=phone_number)
-            otp_code = str(random.randint(100000, 999999))
-            user.otp = otp_code
-            user.otp_expiry = timezone.now() + timedelta(minutes=5)
-            user.save()
-            print(f"--- OTP for {phone_number}: {otp_code} ---")
-            return Response({"message": "OTP has been generated for testing."}, status=status.HTTP_200_OK)
-        except User.DoesNotExist:
+        if not phone_number or not User.objects.filter(phone_number=phone_number).exists():
             return Response({"error": "User with this phone number not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            otp_code = issue_otp(phone_number)
+        except OtpThrottled as e:
+            return Response({"error": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS,
+                            headers={'Retry-After': str(e.retry_after)})
+        send_otp_sms(phone_number, otp_code)
+        return Response({"message": "OTP has been sent."}, status=status.HTTP_200_OK)
 
 class UserVerifyLoginOTPView(APIView):
+    authentication_classes = []
+    throttle_classes = [OtpClientThrottle, OtpPhoneThrottle]
+
     def post(self, request, *args, **kwargs):
         phone_number = request.data.get('phone_number')
         otp_code = request.data.get('otp')
-        try:
-            user = User.objects.get(phone_number=phone_number)
-            if user.otp != otp_code or user.otp_expiry < timezone.now():
-                return Response({"error": "Invalid or expired OTP."}, status=status.HTTP_400_BAD_REQUEST)
-            auth_user, created = AuthUser.objects.get_or_create(username=user.phone_number)
-            if created:
-                auth_user.set_unusable_password()
-                auth_user.save()
-            user.otp = None
-            user.otp_expiry = None
-            user.save()
-            refresh = RefreshToken.for_user(auth_user)
-            return Response({'refresh': str(refresh), 'access': str(refresh.access_token)})
-        except User.DoesNotExist:
+        if not phone_number or not User.objects.filter(phone_number=phone_number).exists():
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            verified = verify_otp(phone_number, otp_code)
+        except OtpLocked:
+            return Response({"error": "Too many incorrect codes. Request a new OTP."},
+                            status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if not verified:
+            return Response({"error": "Invalid or expired OTP."}, status=status.HTTP_400_BAD_REQUEST)
+        auth_user, created = AuthUser.objects.get_or_create(username=phone_number)
+        if created:
+            auth_user.set_unusable_password()
+            auth_user.save()
+        refresh = RefreshToken.for_user(auth_user)
+        return Response({'refresh': str(refresh), 'access': str(refresh.access_token)})
 
 
 # --- Daraja Payment Views ---
 class InitiatePaymentView(APIView):
+    """
+    Queues an STK push and answers 202 straight away; the `payment_worker`
+    command talks to Daraja. Poll the returned status_url for progress.
+    """
     permission_classes = [IsAuthenticated]
     def post(self, request, *args, **kwargs):
         case_id = request.data.get('case_id')
         if not case_id:
             return Response({"error": "Case ID is required."}, status=status.HTTP_400_BAD_REQUEST)
         try:
-            case = Case.objects.get(pk=case_id)
-            amount = 1
-            phone_number = case.user.phone_number
-            account_reference = f"AFYLNK{case.case_id}"
-            transaction_desc = f"Payment for Case #{case.case_id}"
-            daraja_response = initiate_stk_push(
-                case=case, phone_number=phone_number, amount=amount,
-                account_reference=account_reference, transaction_desc=transaction_desc
-            )
-            if daraja_response.get("ResponseCode") == "0":
-                case.status = Case.CaseStatus.PAYMENT_PENDING
-                case.save()
-                CaseHistory.objects.create(case=case, description="Payment requested from patient.")
-            return Response(daraja_response)
-        except Case.DoesNotExist:
+            case = Case.objects.select_related('user').get(pk=case_id)
+        except (Case.DoesNotExist, ValueError):
             return Response({"error": "Case not found."}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            return Response({"error": f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        attempt, created = enqueue_payment(case, amount=1, requested_by=request.user)
+        return Response({
+            "attempt_id": attempt.attempt_id,
+            "status": attempt.status,
+            "status_url": reverse('payment-attempt', kwargs={'pk': attempt.attempt_id}),
+        }, status=status.HTTP_202_ACCEPTED)
+
+class PaymentAttemptView(generics.RetrieveAPIView):
+    """Progress of one STK push: pending, sending, sent, failed or confirmed."""
+    serializer_class = PaymentAttemptSerializer
+    permission_classes = [IsAuthenticated]
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return PaymentAttempt.objects.all()
+        return PaymentAttempt.objects.filter(case__user__phone_number=user.username)
 
 @method_decorator(csrf_exempt, name='dispatch')
 class DarajaCallbackView(APIView):
+    """
+    Stores the STK push result and acknowledges it at once; the
+    `payment_worker` command applies it to the case (api/payment_queue.py).
+    """
     def post(self, request, *args, **kwargs):
-        print("✅ DARAJA CALLBACK: Received a callback.")
-        stk_callback_response = request.data.get('Body', {}).get('stkCallback', {})
-        print(stk_callback_response)
-        result_code = stk_callback_response.get('ResultCode')
-        checkout_request_id = stk_callback_response.get('CheckoutRequestID')
-
-        try:
-            case = Case.objects.get(checkout_request_id=checkout_request_id)
-            if result_code == 0:
-                print(f"✅ Payment successful for CheckoutRequestID: {checkout_request_id}")
-                case.status = Case.CaseStatus.PAID
-                case.save()
-                CaseHistory.objects.create(case=case, description="Payment confirmed successfully.")
-
-                # Create a permanent Payment record
-                metadata = stk_callback_response.get('CallbackMetadata', {}).get('Item', [])
-                amount = next((item['Value'] for item in metadata if item['Name'] == 'Amount'), None)
-                receipt_number = next((item['Value'] for item in metadata if item['Name'] == 'MpesaReceiptNumber'), None)
-                transaction_date_str = next((item['Value'] for item in metadata if item['Name'] == 'TransactionDate'), None)
-
-                if amount and receipt_number and transaction_date_str:
-                    transaction_date = timezone.make_aware(datetime.strptime(str(transaction_date_str), '%Y%m%d%H%M%S'))
-                    Payment.objects.create(
-                        case=case,
-                        amount=amount,
-                        mpesa_receipt_number=receipt_number,
-                        transaction_date=transaction_date
-                    )
-            else:
-                result_desc = stk_callback_response.get('ResultDesc')
-                print(f"❌ Payment failed for CheckoutRequestID: {checkout_request_id}. Reason: {result_desc}")
-                CaseHistory.objects.create(case=case, description=f"Payment failed: {result_desc}")
-
-        except Case.DoesNotExist:
-            print(f"❌ Case with CheckoutRequestID {checkout_request_id} not found.")
-
+        payload = request.data if isinstance(request.data, dict) else {}
+        stk_callback = (payload.get('Body') or {}).get('stkCallback') or {}
+        DarajaCallback.objects.create(checkout_request_id=stk_callback.get('CheckoutRequestID'), payload=payload)
         return Response({"ResultCode": 0, "ResultDesc": "Accepted"}, status=status.HTTP_200_OK)
 
 
@@ -323,6 +379,79 @@ class CaseHistoryView(generics.ListAPIView):
         case_id = self.kwargs.get('case_id')
         return CaseHistory.objects.filter(case__pk=case_id)
 
+class TriageMetricsView(APIView):
+    """Queue depth and latency of the background AI triage pipeline."""
+    permission_classes = [IsAdminUser]
+    def get(self, request, *args, **kwargs):
+        return Response(triage_queue_stats(), status=status.HTTP_200_OK)
+
+# --- Live Events (Server-Sent Events) ---
+# Streams case_assigned, status_changed and payment_confirmed events. This is
+# an async view: serve the project through afyalink_config/asgi.py (e.g.
+# `uvicorn afyalink_config.asgi:application`) so an open stream does not tie
+# up a worker thread. EventSource cannot send headers, so the JWT access
+# token may also be passed as ?token=.
+
+def _event_channels(user):
+    """The channels a user may listen on: their agent inbox, their cases as a patient, and staff."""
+    channels = []
+    if user.is_staff:
+        channels.append(STAFF_CHANNEL)
+    agent = Agent.objects.filter(user=user).values_list('pk', flat=True).first()
+    if agent is not None:
+        channels.append(agent_channel(agent))
+    patient_profile = User.objects.filter(phone_number=user.username).values_list('pk', flat=True).first()
+    if patient_profile is not None:
+        channels.append(patient_channel(patient_profile))
+    return channels
+
+
+def _authenticate_stream(request):
+    authentication = JWTAuthentication()
+    raw_token = request.GET.get('token')
+    try:
+        if raw_token:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        result = authentication.authenticate(request)
+        return result[0] if result else None
+    except (InvalidToken, AuthenticationFailed):
+        return None
+
+
+def _format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+
+async def case_events(request):
+    user = await sync_to_async(_authenticate_stream)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
+    channels = await sync_to_async(_event_channels)(user)
+    if not channels:
+        return JsonResponse({"detail": "No events available for this account."}, status=403)
+
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else None
+
+    async def stream():
+        yield "retry: 5000\n\n"
+        async for event in get_event_broker().subscribe(channels, last_event_id=last_event_id):
+            # None means nothing happened for a while; a comment line keeps
+            # proxies from closing the idle connection.
+            yield ": keep-alive\n\n" if event is None else _format_event(event)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class MetricsView(APIView):
+    """This process's metrics in the Prometheus text format."""
+    permission_classes = [IsAdminUser]
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def frontend_home(request):
     return render(request, 'index.html')
 